@@ -5,45 +5,139 @@
 #####
 import requests
 import datetime
+import functools
 import logging
-import xml.etree.ElementTree as Et
-from xmljson import BadgerFish
+import time
+from .fetcher import ConcurrentFetcher, HostLimitedAdapter, Stage
+from .store import SQLiteCache
+from .transport import DEFAULT_TIMEOUT, AIMDLimiter, TokenBucket, Transport
+from .httpcache import ResponseCache
+from .instrumentation import Instrumentation, MeteredReader
+from .asyncclient import AsyncEnergyStarClient
+from .records import (Account, Address, Building, Consumption, Contact, Delivery, Meter, Property, Record,
+                      check_schemas, consumption_entry)
+from .parsers import (METER_FIELDS, ConsumptionColumns, MetricJobs, badgerfish, consumption_record, consumption_row,
+                      iter_meter_data, meter_ids, meter_metadata, metric_key, metric_values, metrics_final,
+                      month_range, property_links)
+
+# Records buffered ahead of the caller by iter_consumption, about two pages
+PREFETCH_RECORDS = 256
+
+
+def _instrumented(method):
+    """ Record every call of a client method with the client's instrumentation """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.instrumentation.call(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class EnergyStarClient(object):
-    def __init__(self, username, password, logging_level=logging.INFO):
-        self.domain = "https://portfoliomanager.energystar.gov/ws"
+    def __init__(self, username, password, logging_level=logging.INFO, workers=1, max_per_host=None,
+                 meter_cache=None, metric_cache=None, metric_lag_months=2, rate_limit=None, max_retries=5,
+                 backoff=0.5, pool_connections=10, pool_maxsize=None, response_cache=None,
+                 domain="https://portfoliomanager.energystar.gov/ws", instrumentation=None, raw_dicts=False,
+                 timeout=DEFAULT_TIMEOUT, concurrency=None):
+        """
+        Args:
+            username : Energy Star username
+            password : Energy Star password
+            logging_level : logging level for the client
+            workers : number of threads expected to share this client, used to
+                size the session's connection pool
+            max_per_host : maximum concurrent requests to the Portfolio Manager
+                host across all threads, None for no limit
+            meter_cache : SQLiteCache holding meter metadata between runs,
+                defaults to an in-memory cache for the life of the client
+            metric_cache : SQLiteCache holding monthly metrics of finalized months,
+                defaults to an in-memory cache for the life of the client. Give
+                it a ttl to pick up metrics revised after a month closes.
+            metric_lag_months : months after which a month's metrics are
+                considered final and are served from the metric cache
+            rate_limit : maximum requests per second across all threads, None for no limit
+            max_retries : retries for connection errors, 429 and 5xx responses
+            backoff : base delay in seconds between retries, doubled each retry
+            pool_connections : number of host connection pools to keep
+            pool_maxsize : connections kept per host, defaults to max(workers, 10)
+            response_cache : ResponseCache to serve GETs from disk, None to always
+                ask Portfolio Manager
+            domain : base URL of the web services, e.g. the test environment
+            instrumentation : Instrumentation recording calls, requests and
+                timings, defaults to a new one for this client
+            raw_dicts : return BadgerFish dictionaries from get_account_info
+                and get_building_info, as earlier versions did, instead of records
+            timeout : (connect, read) seconds for each request, a request that
+                times out is retried like a connection error
+            concurrency : requests in flight to start from. The limit grows by
+                about one per round of successful requests up to max_per_host
+                (or workers) and halves when the server throttles. Defaults to
+                max_per_host, so it only backs off and recovers.
+        """
+        self.domain = domain
+        self.raw_dicts = raw_dicts
         self.username = username
         self.password = password
+        self.workers = workers
         self.session = requests.Session()
         self.session.auth = (username, password)
+        adapter = HostLimitedAdapter(max_per_host=max_per_host, pool_connections=pool_connections,
+                                     pool_maxsize=pool_maxsize or max(workers, 10))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Concurrency adapts between 1 and the per-host cap as the server throttles
+        ceiling = max_per_host or (workers if workers > 1 else None)
+        start = min(concurrency, ceiling) if concurrency and ceiling else concurrency or ceiling
+        self.transport = Transport(self.session, rate=rate_limit, concurrency=start, max_concurrency=ceiling,
+                                   max_retries=max_retries, backoff=backoff, cache=response_cache,
+                                   timeout=timeout)
+        self.fetcher = ConcurrentFetcher(workers)
+        self.meter_cache = meter_cache if meter_cache is not None else SQLiteCache()
+        self.metric_cache = metric_cache if metric_cache is not None else SQLiteCache()
+        self.metric_lag_months = metric_lag_months
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation(domain)
         logging.basicConfig(level=logging_level)
         logging.getLogger("requests").setLevel(logging.WARNING)
         self.logger = logging.getLogger(__name__)
+    def _get(self, url, call=None, **kwargs):
+        """
+        GET through the shared transport: rate limited, retried and adaptively
+        throttled, and recorded against call (default the current call)
+        """
+        started = time.perf_counter()
+        try:
+            response = self.transport.get(url, **kwargs)
+        except Exception as e:
+            self.instrumentation.request(url, None, time.perf_counter() - started, call, error=e)
+            raise
+        self.instrumentation.request(url, response, time.perf_counter() - started, call,
+                                     streamed=kwargs.get("stream", False))
+        return response
+
+    @_instrumented
     def get_account_info(self):
         """
         Get Account information for the current user
 
         Returns:
-            Dictionary : BadgerFish style representation of Energy Star response
-                e.g.:
-                account_info = client.get_account_info()
-                account_id = account_info["account"]["id"]["$"]
+            Account : typed record of the response, e.g.:
+                account_id = client.get_account_info().id
+                With raw_dicts, the BadgerFish style dictionary instead:
+                account_id = client.get_account_info()["account"]["id"]["$"]
 
         Notes:
             BadgerFish : http://www.sklar.com/badgerfish/
         """
         resource = self.domain + "/account"
         self.logger.debug("Pulling data from {0}".format(resource))
-        response = self.session.get(resource)
+        response = self._get(resource)
 
         if response.status_code != requests.codes.ok:
             return response.raise_for_status()
-        data = response.text
-        root = Et.fromstring(data)
-        bf = BadgerFish(dict_type=dict)
-        account_info = bf.data(root)
-        return account_info
+        with self.instrumentation.parsing():
+            return badgerfish(response.text) if self.raw_dicts else Account.parse(response.text)
 
+    @_instrumented
     def get_propery_list(self, account_id):
         """
         Retrieve the properties associated with an account_id.
@@ -51,7 +145,7 @@ class EnergyStarClient(object):
         shared with you for some reason.
         Args:
             account_id : your account ID number, e.g. 100. Can be retrieved by
-                        `client.get_account_info()["id"]`
+                        `client.get_account_info().id`
         Returns:
             List of tuples : Array of tuples with property ID as the key and
                 hint as the value, e.g. [(1,"Building 1"),(2, "Building 2")]
@@ -61,17 +155,14 @@ class EnergyStarClient(object):
         """
         resource = "{0}/account/{1}/property/list".format(self.domain, account_id)
         self.logger.debug("Pulling data from {0}".format(resource))
-        response = self.session.get(resource)
+        response = self._get(resource)
 
         if response.status_code != requests.codes.ok:
             return response.raise_for_status()
-        building_list = []
-        root = Et.fromstring(response.text)
-        for e in root.find("links"):
-            data = (int(e.get("id")), e.get("hint"))
-            building_list.append(data)
-        return building_list
+        with self.instrumentation.parsing():
+            return property_links(response.text)
 
+    @_instrumented
     def get_meter_list(self, prop_id):
         """
         Get a list of meters associated with a particular property
@@ -89,19 +180,16 @@ class EnergyStarClient(object):
 
         resource =  '{0}/association/property/{1}/meter'.format(self.domain, prop_id)
         self.logger.debug("Pulling data from {0}".format(resource))
-        response = self.session.get(resource)
+        response = self._get(resource)
         if(response.status_code != requests.codes.ok):
             return response.raise_for_status()
-        meters = []
-        root = Et.fromstring(response.text)
-        for e in root.iter("*"):
-            if e.tag == "meterId":
-                meter_type = self.get_meter_type(e.text)
-                data = (int(e.text), meter_type)
-                meters.append(data)
-        return meters
+        with self.instrumentation.parsing():
+            ids = meter_ids(response.text)
+        metadata = self.get_meters(ids)
+        return [(meter_id, metadata[meter_id]["type"]) for meter_id in ids]
 
 
+    @_instrumented
     def get_meter_type(self, meter_id):
         """
         Get the type of meter
@@ -112,21 +200,61 @@ class EnergyStarClient(object):
         Returns:
             String : The type of meter, e.g. "Natural Gas"
         """
+        return self.get_meters([meter_id])[int(meter_id)]["type"]
+
+    @_instrumented
+    def get_meter(self, meter_id):
+        """
+        Get the meter metadata from Portfolio Manager, bypassing the cache
+
+        Args:
+            meter_id : the id of the meter
+
+        Returns:
+            Dictionary : the METER_FIELDS of the meter, e.g.
+                {"id":"123", "type":"Natural Gas", "unitOfMeasure":"therms", ...}
+                Fields missing from the response are None.
+
+        Raises:
+            HTTPError
+        """
         resource = self.domain + '/meter/%s' % str(meter_id)
         self.logger.debug("Pulling data from {0}".format(resource))
 
-        response = self.session.get(resource)
+        response = self._get(resource)
         if(response.status_code != requests.codes.ok):
             return response.raise_for_status()
 
-        root = Et.fromstring(response.text)
-        meter_type = ''
-        for e in root.iter("*"):
-            if e.tag == "type":
-                meter_type = e.text
+        with self.instrumentation.parsing():
+            return meter_metadata(response.text)
 
-        return meter_type
+    @_instrumented
+    def get_meters(self, meter_ids):
+        """
+        Get metadata for several meters, only asking Portfolio Manager for
+        meters missing from (or expired in) the meter cache
 
+        Args:
+            meter_ids : iterable of meter ids
+
+        Returns:
+            Dictionary : {meter id (int): metadata dictionary as returned by get_meter}
+
+        Raises:
+            HTTPError
+        """
+        meter_ids = [int(m) for m in meter_ids]
+        cached = self.meter_cache.get_many(meter_ids)
+        metadata = dict((int(k), v) for k, v in cached.items())
+        missing = [m for m in dict.fromkeys(meter_ids) if m not in metadata]
+        if missing:
+            self.logger.debug("{0} of {1} meter(s) not cached".format(len(missing), len(meter_ids)))
+            fetched = dict(zip(missing, self.fetcher.map(self.get_meter, missing)))
+            self.meter_cache.set_many(fetched)
+            metadata.update(fetched)
+        return metadata
+
+    @_instrumented
     def get_building_info(self, prop_id):
         """
         Get the building info based on a property
@@ -135,71 +263,128 @@ class EnergyStarClient(object):
             prop_id : the property ID
 
         Returns:
-            Dictionary : BadgerFish output of XML
+            Building : typed record of the response, e.g. get_building_info(prop_id).yearBuilt,
+                the BadgerFish output of the XML with raw_dicts
         """
         resource = '{0}/building/{1}'.format(self.domain, prop_id)
         self.logger.debug("Pulling data from {0}".format(resource))
-        response = self.session.get(resource)
+        response = self._get(resource)
 
         if response.status_code != requests.codes.ok:
             return response.raise_for_status()
-        root = Et.fromstring(response.text)
-        bf = BadgerFish(dict_type=dict)
-        building_info = bf.data(root)
-        return building_info
+        with self.instrumentation.parsing():
+            return badgerfish(response.text) if self.raw_dicts else Building.parse(response.text)
 
-    def get_usage_data(self, meter_id, year=2015, month=1, day=1):
+    def iter_consumption(self, meter_id, year=2015, month=1, day=1, prefetch=True, convert=consumption_record):
         """
-        Get Usage Data
+        Stream consumption data for a meter
+
+        Each page is parsed incrementally as it downloads and records are
+        yielded as soon as they are parsed. With prefetch the pages are read on
+        a background thread, so the next page downloads while the caller works
+        through the current one.
 
         Args:
             meter_id: the specific meter id
             year: start year, default 2015
             month: start month, default 1
             day: start day, default 1
+            prefetch: read pages on a background thread, default True
+            convert: function turning each meterConsumption/meterDelivery element
+                into the item yielded, e.g. consumption_entry for typed records
         Returns:
-            usage: Array of dictionaries {"DATE":YYYY-MM-DD, "USAGE":usage value}
+            Generator of dictionaries
+                {"DATE":"YYYY-MM-DD","USAGE":usage,"COST":cost,"SOURCE":"meterConsumption" or "meterDelivery"}
+                or of what convert returns
+        Raises:
+            HTTPError
         Notes:
             Meter IDs are returned from the get_meter_list function
         """
-        # Get date in YYYY-MM-DD format from months ago
-        date_format = '%Y-%m-%d'
-        start_date = datetime.datetime(year, month, day)
-        start_date_string = datetime.datetime.strftime(start_date, date_format)
-        resource = '{0}/meter/{1}/consumptionData'.format(self.domain, meter_id)
+        # The call spans the caller's iteration, so it is tracked rather than tied to this thread
+        call = self.instrumentation.begin("iter_consumption", meter_id=meter_id)
+        records = self._iter_pages(meter_id, datetime.datetime(year, month, day), convert, call)
+        if prefetch:
+            records = iter(Stage(records, PREFETCH_RECORDS))
+        return self.instrumentation.track(records, call)
+
+    @_instrumented
+    def get_consumption_frame(self, meter_id, year=2015, month=1, day=1, meter_type=None):
+        """
+        Consumption data for a meter as columns
 
+        Entries are parsed straight into typed column buffers instead of one
+        dictionary per entry.
 
-        usage = []
-        page = 1
-        url = '{0}?page={1}&startDate={2}'.format(resource, page, start_date)
+        Args:
+            meter_id: the specific meter id
+            year: start year, default 2015
+            month: start month, default 1
+            day: start day, default 1
+            meter_type: value for the METER TYPE column, e.g. from get_meter_list
+        Returns:
+            DataFrame : DATE (datetime64), USAGE and COST (float64),
+                METER ID, METER TYPE and SOURCE ("meterConsumption"/"meterDelivery") as categoricals
+        Raises:
+            HTTPError
+        """
+        columns = ConsumptionColumns()
+        rows = self._iter_pages(meter_id, datetime.datetime(year, month, day), consumption_row,
+                                self.instrumentation.current())
+        columns.extend(Stage(rows, PREFETCH_RECORDS))
+        return columns.to_frame(meter_id, meter_type)
+
+    def _iter_pages(self, meter_id, start_date, convert, call):
+        start_date_string = datetime.datetime.strftime(start_date, '%Y-%m-%d')
+        resource = '{0}/meter/{1}/consumptionData'.format(self.domain, meter_id)
+        url = '{0}?page=1&startDate={1}'.format(resource, start_date_string)
 
         while url:
             self.logger.debug("Pulling data from {0}".format(url))
+            response = self._get(url, call=call, stream=True)
+            try:
+                if response.status_code != requests.codes.ok:
+                    response.raise_for_status()
+                response.raw.decode_content = True
+                reader = MeteredReader(response.raw, self.instrumentation, call, url)
+                links = {}
+                records = iter_meter_data(reader, links, convert)
+                while True:
+                    # Parse time is time in the parser less the time it waited for the body
+                    started, read = time.perf_counter(), reader.seconds
+                    try:
+                        record = next(records)
+                    except StopIteration:
+                        break
+                    finally:
+                        self.instrumentation.parsed(call, time.perf_counter() - started - (reader.seconds - read))
+                    yield record
+            finally:
+                response.close()
+            # Stop if there are no more links
+            next_page = links.get("next page")
+            url = "{0}{1}".format(self.domain, next_page) if next_page else None
+
+    @_instrumented
+    def get_usage_data(self, meter_id, year=2015, month=1, day=1):
+        """
+        Get Usage Data
 
-            response = self.session.get(url)
-
-            if response.status_code != requests.codes.ok:
-                return response.raise_for_status()
-            # Set URL to none to stop loop if no more links
-            url = None
-
-            root = Et.fromstring(response.text)
-            for element in root.findall("meterConsumption"):
-                month_data = dict()
-                # Get the usage data
-                month_data["DATE"] = element.find("endDate").text
-                month_data["USAGE"] = float(element.find("usage").text)
-                usage.append(month_data)
-
-
-            # Get the next URL
-            for element in root.find("links"):
-                if element.get("linkDescription") == "next page":
-                    url = self.domain + element.get("link")
-
-        # Return the usage for the time period
-        return usage
+        Args:
+            meter_id: the specific meter id
+            year: start year, default 2015
+            month: start month, default 1
+            day: start day, default 1
+        Returns:
+            usage: Array of dictionaries {"DATE":YYYY-MM-DD, "USAGE":usage value}
+        Notes:
+            Meter IDs are returned from the get_meter_list function
+        """
+        return [{"DATE":r["DATE"], "USAGE":r["USAGE"]}
+                for r in self.iter_consumption(meter_id, year, month, day)
+                if r["SOURCE"] == "meterConsumption"]
 
+    @_instrumented
     def get_cost_data(self, meter_id, year=2015, month=1, day=1):
         """
         Get Cost Data
@@ -210,46 +395,24 @@ class EnergyStarClient(object):
             month: start month, default 1
             day: start day, default 1
         Returns:
-            usage: Array of dictionaries {"DATE":YYYY-MM-DD, "COST":usage value}
+            usage: Array of dictionaries {"YYYY-MM-DD":cost value}
+        Raises:
+            HTTPError
         Notes:
             Meter IDs are returned from the get_meter_list function
         """
-        # Get date in YYYY-MM-DD format from months ago
-        date_format = '%Y-%m-%d'
-        start_date = datetime.datetime(year, month, day)
-        start_date_string = datetime.datetime.strftime(start_date, date_format)
-        resource = self.domain + '/meter/%s/consumptionData' % str(meter_id)
-
         cost = []
-        page = 1
-        url = '{0}?page={1}&startDate={2}'.format(resource, page, start_date)
-
-        while url:
-            self.logger.debug("Pulling data from {0}".format(url))
-
-            response = self.session.get(url, auth=(self.username, self.password))
-
-            if response.status_code != requests.codes.ok:
-                print(response.status_code, response.reason)
-                break
-            # Set URL to none to stop loop if no more links
-            url = None
-
-            root = Et.fromstring(response.text)
-            for element in root.findall("meterConsumption"):
-                month_data = dict()
-                # Get the cost data
-                month_data[element.find("endDate").text] = float(element.find("cost").text)
-                # append to cost
-                cost.append(month_data)
-
-            # Get the next URL
-            for element in root.find("links"):
-                if element.get("linkDescription") == "next page":
-                    url = self.domain + element.get("link")
-        # Return the cost for the time period
+        try:
+            for r in self.iter_consumption(meter_id, year, month, day):
+                if r["SOURCE"] == "meterConsumption":
+                    cost.append({r["DATE"]:r["COST"]})
+        except requests.exceptions.HTTPError as e:
+            self.logger.error("Could not read cost for meter {0}: {1} {2}".format(
+                meter_id, e.response.status_code, e.response.reason))
+            raise
         return cost
 
+    @_instrumented
     def get_usage_and_cost(self, meter_id, year=2015, month=1, day=1):
         """
         Total Usage and Cost
@@ -264,63 +427,10 @@ class EnergyStarClient(object):
         Notes:
             Meter IDs are returned from the get_meter_list function
         """
-        date_format = '%Y-%m-%d'
-        start_date = datetime.datetime(year, month, day)
-        start_date_string = datetime.datetime.strftime(start_date, date_format)
-
-        resource = '{0}/meter/{1}/consumptionData'.format(self.domain,meter_id)
-
-        usage_and_cost = []
-        page = 1
-        # Initialize the URL
-        url = '{0}?page={1}&startDate={2}'.format(resource, page, start_date_string)
-
-        while url:
-            self.logger.debug("Pulling data from {0}".format(url))
-            page += 1
-
-            response = self.session.get(url)
-
-            if response.status_code != requests.codes.ok:
-                return response.raise_for_status()
-
-            # Set URL to none to stop loop if no more links
-            url = None
-
-            data = response.text
-            root = Et.fromstring(data)
-            for element in root.findall("meterConsumption"):
-                month_data = dict()
-                # Get the usage and cost data
-                month_data["DATE"] = element.find("endDate").text
-                month_data["USAGE"] = float(element.find("usage").text)
-                try:
-                    month_data["COST"] = float(element.find("cost").text)
-                except AttributeError:
-                    month_data["COST"] = 0
-
-                # append to usage
-                usage_and_cost.append(month_data)
-
-            for element in root.findall("meterDelivery"):
-                month_data = dict()
-                # Get the usage and cost data
-                month_data["DATE"] = element.find("deliveryDate").text
-                month_data["USAGE"] = float(element.find("quantity").text)
-                try:
-                    month_data["COST"] = float(element.find("cost").text)
-                except AttributeError:
-                    month_data["COST"] = 0
-
-                # append to usage
-                usage_and_cost.append(month_data)
-            # Get the next URL
-            for element in root.find("links"):
-                if element.get("linkDescription") == "next page":
-                    url = "{0}{1}".format(self.domain, element.get("link"))
-        # Return the cost for the time period
-        return usage_and_cost
+        return [{"DATE":r["DATE"], "USAGE":r["USAGE"], "COST":r["COST"]}
+                for r in self.iter_consumption(meter_id, year, month, day)]
 
+    @_instrumented
     def get_metric(self, property_id, metric, year=2015, month=1, day=1, metric_name="METRIC VALUE"):
         """
         PortfolioManager Specific Metric by Property
@@ -334,23 +444,71 @@ class EnergyStarClient(object):
 
         Returns:
             data: array of dictionaries {"DATE":"YYYY-MM", "PM ID":property_id, "METRIC VALUE":monthly value}
+                with one entry per metric per month
         """
-        today = datetime.datetime.now()
+        metrics = [m.strip() for m in metric.split(",")]
         data = []
-        dates = [(y, m) for y in range(year,today.year) for m in range(1,13)]
-        dates.extend([(today.year, m) for m in range(month, today.month + 1)])
-        for year_month in dates:
-            url = "{0}/property/{1}/metrics?year={2}&month={3}&measurementSystem=EPA".format(self.domain, property_id, year_month[0], year_month[1])
-            self.logger.debug("Pulling data from {0}".format(url))
-            if(year_month[1] < 10):
-                date = "{0}-0{1}".format(year_month[0], year_month[1])
-            else:
-                date = "{0}-{1}".format(year_month[0], year_month[1])
-            response = self.session.get(url, headers={"PM-Metrics":metric})
-            if response.status_code != requests.codes.ok:
-                return response.raise_for_status()
-            root = Et.fromstring(response.text)
-            for element in root.findall("metric"):
-                d = {"PM ID":property_id, "K":date, metric_name:element.find("value").text}
-                data.append(d)
+        for row in self.get_metrics([property_id], metrics, year, month, day):
+            for name in metrics:
+                data.append({"PM ID":property_id, "K":row["K"], metric_name:row[name]})
         return data
+
+    @_instrumented
+    def get_metrics(self, property_ids, metrics, year=2015, month=1, day=1, ignore_errors=False):
+        """
+        Several PortfolioManager metrics for several properties, one column per metric.
+
+        All metrics for a property and month are requested together in one
+        PM-Metrics header and the property/months are requested concurrently.
+        Months older than metric_lag_months are final and served from the
+        metric cache once fetched. A month with a missing value is not cached,
+        so a bill entered late still shows up on a later run.
+
+        Args:
+            property_ids: iterable of property ids
+            metrics: list of portfolio manager metrics, e.g. ["totalGHGEmissions", "score"]
+            year: start year
+            month: start month
+            day: start day
+            ignore_errors: log a property/month that can't be read and give it
+                None values instead of raising, so one failure doesn't lose the rest
+
+        Returns:
+            data: array of dictionaries {"PM ID":property_id, "K":"YYYY-MM", metric:value, ...}
+                ordered by property then month. Values are the strings returned
+                by Portfolio Manager, None when not available.
+
+        Raises:
+            HTTPError : unless ignore_errors
+        """
+        jobs = MetricJobs(property_ids, metrics, year, month, self.metric_lag_months)
+        # Final months already in the cache need no request
+        cached = self.metric_cache.get_many(jobs.keys())
+
+        def fetch(job):
+            values = jobs.cached(job, cached)
+            if values is not None:
+                return values
+            property_id, y, m = job
+            try:
+                values = self._fetch_metrics(property_id, y, m, jobs.metrics)
+            except requests.exceptions.RequestException as e:
+                if not ignore_errors:
+                    raise
+                self.logger.error("Could not read metrics of {0} for {1}-{2:02d}: {3}".format(property_id, y, m, e))
+                return jobs.failed()
+            self.metric_cache.set_many(jobs.to_cache(job, values))
+            return values
+
+        return jobs.rows(self.fetcher.map(fetch, jobs.jobs))
+
+    @_instrumented
+    def _fetch_metrics(self, property_id, year, month, metrics):
+        """ {metric: value} for one property and month in a single request """
+        url = "{0}/property/{1}/metrics?year={2}&month={3}&measurementSystem=EPA".format(self.domain, property_id, year, month)
+        self.logger.debug("Pulling data from {0}".format(url))
+        response = self._get(url, headers={"PM-Metrics":",".join(metrics)})
+        if response.status_code != requests.codes.ok:
+            return response.raise_for_status()
+        with self.instrumentation.parsing():
+            return metric_values(response.text, metrics)
@@ -0,0 +1,371 @@
+#####
+#
+# asyncio Energy Star API client
+#
+#####
+import asyncio
+import datetime
+import io
+import logging
+import time
+from collections import OrderedDict
+from .store import SQLiteCache
+from .transport import RETRY_STATUSES, THROTTLE_STATUSES, TransportStats, retry_delay
+from .parsers import (ConsumptionColumns, MetricJobs, badgerfish, consumption_record, consumption_row,
+                      iter_meter_data, meter_ids, meter_metadata, metric_values, property_links)
+from .records import Account, Building
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncTokenBucket(object):
+    """
+    Token bucket rate limiter for coroutines
+
+    Args:
+        rate : tokens added per second
+        burst : bucket size, defaults to one second of tokens
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        """ Wait until a token is available and take it """
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncEnergyStarClient(object):
+    """
+    asyncio version of EnergyStarClient with the same methods as coroutines.
+
+    Responses are parsed by the same functions as EnergyStarClient, so both
+    clients return identical results. Every request shares one aiohttp
+    connection pool and is retried like EnergyStarClient's transport. Use as
+    an async context manager, or call close() when done. Requires aiohttp.
+
+        async with AsyncEnergyStarClient(username, password) as client:
+            usage = await client.gather_usage_and_cost(property_ids, 2017, 1, 1)
+
+    Args:
+        username : Energy Star username
+        password : Energy Star password
+        logging_level : logging level for the client
+        max_per_host : maximum concurrent requests to the Portfolio Manager host
+        meter_cache : SQLiteCache holding meter metadata between runs,
+            defaults to an in-memory cache for the life of the client
+        metric_cache : SQLiteCache holding monthly metrics of finalized months,
+            defaults to an in-memory cache for the life of the client
+        metric_lag_months : months after which a month's metrics are
+            considered final and are served from the metric cache
+        rate_limit : maximum requests per second, None for no limit
+        max_retries : retries for connection errors, 429 and 5xx responses
+        backoff : base delay in seconds between retries, doubled each retry
+        max_backoff : longest delay between retries in seconds
+        timeout : total seconds allowed per request
+        domain : base URL of the web services, e.g. the test environment
+        raw_dicts : return BadgerFish dictionaries from get_account_info and
+            get_building_info instead of records
+    """
+    def __init__(self, username, password, logging_level=logging.INFO, max_per_host=8, meter_cache=None,
+                 metric_cache=None, metric_lag_months=2, rate_limit=None, max_retries=5, backoff=0.5,
+                 max_backoff=60, timeout=300, domain="https://portfoliomanager.energystar.gov/ws", raw_dicts=False):
+        if aiohttp is None:
+            raise ImportError("AsyncEnergyStarClient requires aiohttp: pip install aiohttp")
+        self.domain = domain
+        self.raw_dicts = raw_dicts
+        self.username = username
+        self.password = password
+        self.max_per_host = max_per_host
+        self.meter_cache = meter_cache if meter_cache is not None else SQLiteCache()
+        self.metric_cache = metric_cache if metric_cache is not None else SQLiteCache()
+        self.metric_lag_months = metric_lag_months
+        self.bucket = AsyncTokenBucket(rate_limit) if rate_limit else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.stats = TransportStats()
+        self.session = None
+        self._pause_until = 0
+        logging.basicConfig(level=logging_level)
+        self.logger = logging.getLogger(__name__)
+
+    async def __aenter__(self):
+        self._session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """ Close the connection pool """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _session(self):
+        # Created on first use, aiohttp sessions belong to the running event loop
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_per_host or 0, limit_per_host=self.max_per_host or 0)
+            self.session = aiohttp.ClientSession(
+                connector=connector, auth=aiohttp.BasicAuth(self.username or "", self.password or ""),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    async def _get(self, url, headers=None):
+        """
+        GET a URL on the shared connection pool, retrying connection errors and
+        RETRY_STATUSES with jittered exponential backoff (or the server's
+        Retry-After) and pausing every request when the server throttles
+
+        Returns:
+            Bytes : the response body
+
+        Raises:
+            ClientResponseError : for an error status, once retries run out
+            ClientConnectionError, TimeoutError : when every attempt failed to connect
+        """
+        session = self._session()
+        attempt = 0
+        while True:
+            await self._wait_for_pause()
+            if self.bucket:
+                await self.bucket.acquire()
+            self.stats.add("requests")
+            self.logger.debug("Pulling data from {0}".format(url))
+            try:
+                async with session.get(url, headers=headers) as response:
+                    body = await response.read()
+                    self.stats.status(response.status)
+                    if response.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                        if response.status in RETRY_STATUSES:
+                            self.stats.add("failures")
+                        response.raise_for_status()
+                        return body
+                    throttled = response.status in THROTTLE_STATUSES
+                    delay = retry_delay(attempt, response, self.backoff, self.max_backoff)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.stats.add("connection_errors")
+                if attempt >= self.max_retries:
+                    self.stats.add("failures")
+                    raise
+                throttled = False
+                delay = retry_delay(attempt, None, self.backoff, self.max_backoff)
+
+            if throttled:
+                self.stats.add("throttled")
+                self._pause_until = max(self._pause_until, time.monotonic() + delay)
+            self.logger.debug("Retrying {0} in {1:.2f}s (attempt {2})".format(url, delay, attempt + 1))
+            self.stats.add("retries")
+            self.stats.add("retry_wait_seconds", delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _wait_for_pause(self):
+        wait = self._pause_until - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def get_account_info(self):
+        """ Account information for the current user, see EnergyStarClient.get_account_info """
+        text = await self._get(self.domain + "/account")
+        return badgerfish(text) if self.raw_dicts else Account.parse(text)
+
+    async def get_propery_list(self, account_id):
+        """ [(property id, hint), ...] for an account, see EnergyStarClient.get_propery_list """
+        return property_links(await self._get("{0}/account/{1}/property/list".format(self.domain, account_id)))
+
+    async def get_meter_list(self, prop_id):
+        """ [(meter id, meter type), ...] for a property, see EnergyStarClient.get_meter_list """
+        ids = meter_ids(await self._get("{0}/association/property/{1}/meter".format(self.domain, prop_id)))
+        metadata = await self.get_meters(ids)
+        return [(meter_id, metadata[meter_id]["type"]) for meter_id in ids]
+
+    async def get_meter_type(self, meter_id):
+        """ The type of a meter, e.g. "Natural Gas" """
+        return (await self.get_meters([meter_id]))[int(meter_id)]["type"]
+
+    async def get_meter(self, meter_id):
+        """ Meter metadata from Portfolio Manager, bypassing the cache, see EnergyStarClient.get_meter """
+        return meter_metadata(await self._get("{0}/meter/{1}".format(self.domain, meter_id)))
+
+    async def get_meters(self, meter_ids):
+        """
+        Metadata for several meters, requesting the ones missing from the
+        meter cache concurrently
+
+        Returns:
+            Dictionary : {meter id (int): metadata dictionary as returned by get_meter}
+        """
+        meter_ids = [int(m) for m in meter_ids]
+        # SQLiteCache blocks on its lock and on disk, keep it off the event loop
+        cached = await asyncio.to_thread(self.meter_cache.get_many, meter_ids)
+        metadata = dict((int(k), v) for k, v in cached.items())
+        missing = [m for m in dict.fromkeys(meter_ids) if m not in metadata]
+        if missing:
+            fetched = dict(zip(missing, await asyncio.gather(*[self.get_meter(m) for m in missing])))
+            await asyncio.to_thread(self.meter_cache.set_many, fetched)
+            metadata.update(fetched)
+        return metadata
+
+    async def get_building_info(self, prop_id):
+        """ A property's building, see EnergyStarClient.get_building_info """
+        text = await self._get("{0}/building/{1}".format(self.domain, prop_id))
+        return badgerfish(text) if self.raw_dicts else Building.parse(text)
+
+    async def iter_consumption(self, meter_id, year=2015, month=1, day=1, convert=consumption_record):
+        """
+        Asynchronous generator over a meter's consumption entries
+
+        The request for the next page is sent as soon as a page has been
+        parsed, so it downloads while the caller works through the current
+        page's records.
+
+        Args:
+            meter_id: the specific meter id
+            year: start year, default 2015
+            month: start month, default 1
+            day: start day, default 1
+            convert: function turning an entry element into a record, default
+                the dictionaries of EnergyStarClient.iter_consumption
+        """
+        start_date = datetime.datetime(year, month, day).strftime('%Y-%m-%d')
+        url = '{0}/meter/{1}/consumptionData?page=1&startDate={2}'.format(self.domain, meter_id, start_date)
+        pending = asyncio.ensure_future(self._get(url))
+        try:
+            while pending is not None:
+                links = {}
+                records = list(iter_meter_data(io.BytesIO(await pending), links, convert))
+                # The next page link is at the end of the page
+                next_page = links.get("next page")
+                pending = asyncio.ensure_future(self._get(self.domain + next_page)) if next_page else None
+                for record in records:
+                    yield record
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    async def get_consumption_frame(self, meter_id, year=2015, month=1, day=1, meter_type=None):
+        """ Consumption data for a meter as a DataFrame, see EnergyStarClient.get_consumption_frame """
+        columns = ConsumptionColumns()
+        async for row in self.iter_consumption(meter_id, year, month, day, convert=consumption_row):
+            columns.append(row)
+        return columns.to_frame(meter_id, meter_type)
+
+    async def get_usage_data(self, meter_id, year=2015, month=1, day=1):
+        """ [{"DATE":"YYYY-MM-DD", "USAGE":usage}, ...], see EnergyStarClient.get_usage_data """
+        return [{"DATE":r["DATE"], "USAGE":r["USAGE"]}
+                async for r in self.iter_consumption(meter_id, year, month, day)
+                if r["SOURCE"] == "meterConsumption"]
+
+    async def get_cost_data(self, meter_id, year=2015, month=1, day=1):
+        """
+        [{"YYYY-MM-DD":cost}, ...], see EnergyStarClient.get_cost_data
+
+        Raises:
+            ClientResponseError : logged, then raised
+        """
+        cost = []
+        try:
+            async for r in self.iter_consumption(meter_id, year, month, day):
+                if r["SOURCE"] == "meterConsumption":
+                    cost.append({r["DATE"]:r["COST"]})
+        except aiohttp.ClientResponseError as e:
+            self.logger.error("Could not read cost for meter {0}: {1} {2}".format(meter_id, e.status, e.message))
+            raise
+        return cost
+
+    async def get_usage_and_cost(self, meter_id, year=2015, month=1, day=1):
+        """ [{"DATE":"YYYY-MM-DD", "USAGE":usage, "COST":cost}, ...], see EnergyStarClient.get_usage_and_cost """
+        return [{"DATE":r["DATE"], "USAGE":r["USAGE"], "COST":r["COST"]}
+                async for r in self.iter_consumption(meter_id, year, month, day)]
+
+    async def get_metric(self, property_id, metric, year=2015, month=1, day=1, metric_name="METRIC VALUE"):
+        """ One entry per metric per month, see EnergyStarClient.get_metric """
+        metrics = [m.strip() for m in metric.split(",")]
+        data = []
+        for row in await self.get_metrics([property_id], metrics, year, month, day):
+            for name in metrics:
+                data.append({"PM ID":property_id, "K":row["K"], metric_name:row[name]})
+        return data
+
+    async def get_metrics(self, property_ids, metrics, year=2015, month=1, day=1, ignore_errors=False):
+        """
+        Several metrics for several properties, one dictionary per property and
+        month, see EnergyStarClient.get_metrics. Shares the metric cache keys
+        with EnergyStarClient.
+        """
+        jobs = MetricJobs(property_ids, metrics, year, month, self.metric_lag_months)
+        cached = await asyncio.to_thread(self.metric_cache.get_many, jobs.keys())
+
+        async def fetch(job):
+            values = jobs.cached(job, cached)
+            if values is not None:
+                return values
+            property_id, y, m = job
+            url = "{0}/property/{1}/metrics?year={2}&month={3}&measurementSystem=EPA".format(
+                self.domain, property_id, y, m)
+            try:
+                values = metric_values(await self._get(url, headers={"PM-Metrics":",".join(jobs.metrics)}),
+                                       jobs.metrics)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not ignore_errors:
+                    raise
+                self.logger.error("Could not read metrics of {0} for {1}-{2:02d}: {3}".format(property_id, y, m, e))
+                return jobs.failed()
+            await asyncio.to_thread(self.metric_cache.set_many, jobs.to_cache(job, values))
+            return values
+
+        return jobs.rows(await asyncio.gather(*[fetch(job) for job in jobs.jobs]))
+
+    async def gather_meter_lists(self, property_ids):
+        """
+        Meter lists of several properties at once
+
+        Returns:
+            OrderedDict : {property id: [(meter id, meter type), ...]} in the order of property_ids
+        """
+        property_ids = list(property_ids)
+        return OrderedDict(zip(property_ids, await asyncio.gather(*[self.get_meter_list(p) for p in property_ids])))
+
+    async def gather_usage_and_cost(self, property_ids, year=2015, month=1, day=1):
+        """
+        Usage and cost of every meter of several properties at once
+
+        Returns:
+            OrderedDict : {property id: {meter id: get_usage_and_cost entries}}
+                in the order of property_ids and of each property's meter list
+        """
+        meter_lists = await self.gather_meter_lists(property_ids)
+        jobs = [(p, meter_id) for p, meters in meter_lists.items() for meter_id, _ in meters]
+        usage = await asyncio.gather(*[self.get_usage_and_cost(m, year, month, day) for _, m in jobs])
+        data = OrderedDict((p, OrderedDict()) for p in meter_lists)
+        for (p, meter_id), entries in zip(jobs, usage):
+            data[p][meter_id] = entries
+        return data
+
+    async def gather_consumption_frames(self, meters, year=2015, month=1, day=1):
+        """
+        Consumption frames of several meters at once
+
+        Args:
+            meters : iterable of (meter id, meter type), e.g. from get_meter_list
+
+        Returns:
+            List of DataFrames : one per meter, in the order of meters
+        """
+        return list(await asyncio.gather(*[self.get_consumption_frame(m, year, month, day, meter_type=t)
+                                           for m, t in meters]))
@@ -0,0 +1,236 @@
+#####
+#
+# Concurrent fetching helpers for the Energy Star API
+#
+#####
+import queue
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+
+class HostLimitedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that caps the number of requests in flight to any one host.
+
+    Every thread using the session shares the adapter's connection pool, so
+    the cap holds no matter how many workers are issuing requests. A request
+    holds its slot until its body has been read or the response is closed,
+    so streamed downloads count against the cap too.
+
+    Args:
+        max_per_host : maximum concurrent requests per host, None for no limit
+        **kwargs : passed through to HTTPAdapter (pool_connections, pool_maxsize, ...)
+    """
+    def __init__(self, max_per_host=None, **kwargs):
+        self.max_per_host = max_per_host
+        self._host_slots = {}
+        self._slots_lock = threading.Lock()
+        super(HostLimitedAdapter, self).__init__(**kwargs)
+
+    def _slot(self, host):
+        with self._slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def send(self, request, **kwargs):
+        if not self.max_per_host:
+            return super(HostLimitedAdapter, self).send(request, **kwargs)
+        slot = self._slot(urlparse(request.url).netloc)
+        slot.acquire()
+        try:
+            response = super(HostLimitedAdapter, self).send(request, **kwargs)
+        except BaseException:
+            slot.release()
+            raise
+        _release_with_body(response, slot)
+        return response
+
+
+def _release_with_body(response, slot):
+    """ Release slot once the response's connection goes back to the pool """
+    lock = threading.Lock()
+    held = [True]
+
+    def release():
+        with lock:
+            if not held[0]:
+                return
+            held[0] = False
+        slot.release()
+
+    # urllib3 calls release_conn when the body has been read in full, and
+    # Response.close calls it when the caller stops early
+    raw = response.raw
+    release_conn = getattr(raw, "release_conn", None)
+    if release_conn is None:
+        release()
+        return
+
+    def releasing():
+        try:
+            release_conn()
+        finally:
+            release()
+    raw.release_conn = releasing
+    # A response dropped without being read or closed must not keep its slot
+    weakref.finalize(response, release)
+
+
+class ConcurrentFetcher(object):
+    """
+    Run a function over many items on a thread pool, keeping input order.
+
+    The pool is started on first use and shared by every map call, from any
+    thread, for the life of the fetcher. A map called from one of the pool's
+    own threads runs inline, so nested calls can't wait on themselves.
+
+    Args:
+        workers : number of worker threads, 1 runs everything inline
+        window : maximum number of submitted but unconsumed items,
+                 defaults to twice the worker count
+    """
+    def __init__(self, workers=8, window=None):
+        self.workers = max(1, int(workers))
+        self.window = window or self.workers * 2
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fetcher",
+                                                initializer=self._mark_worker)
+            return self._pool
+
+    def _mark_worker(self):
+        self._local.worker = True
+
+    def map(self, func, items):
+        """
+        Apply func to every item concurrently
+
+        Args:
+            func : callable taking one item
+            items : any iterable, consumed lazily
+
+        Returns:
+            Generator : func(item) for each item, in the same order as items.
+                An exception raised by func is re-raised when its result is reached.
+        """
+        if self.workers == 1 or getattr(self._local, "worker", False):
+            for item in items:
+                yield func(item)
+            return
+
+        pool = self._executor()
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= self.window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Items the caller will never see are not started
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        """ Stop the worker threads once the items submitted have run """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+_DONE = object()
+
+
+class Stage(object):
+    """
+    Runs an iterator on its own thread and hands its items on through a
+    bounded queue. When the queue is full the thread blocks, which in turn
+    stops it from pulling items from the stage before it, so a chain of
+    stages never holds more than its queue sizes. The thread starts when the
+    items are first asked for. Exceptions are re-raised in the consumer.
+
+    Args:
+        items : the iterator, e.g. another Stage or ConcurrentFetcher.map
+        maxsize : items buffered ahead of the consumer
+        name : thread name, for logs
+    """
+    def __init__(self, items, maxsize, name=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.high_water = 0
+        self._items = items
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._produce, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _offer(self, item, error=None):
+        # Give up once the consumer has gone away rather than blocking forever
+        while not self._stop.is_set():
+            try:
+                self._queue.put((item, error), timeout=0.1)
+                self.high_water = max(self.high_water, self._queue.qsize())
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            for item in self._items:
+                if not self._offer(item):
+                    break
+            else:
+                self._offer(_DONE)
+        except Exception as e:
+            self._offer(_DONE, e)
+        finally:
+            # Stop the stages upstream too
+            if hasattr(self._items, "close"):
+                self._items.close()
+
+    def poll(self, timeout):
+        """
+        Generator over the items, yielding None whenever no item arrived
+        within timeout seconds, so the consumer can act while it waits
+        """
+        self._start()
+        try:
+            while True:
+                try:
+                    item, error = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    yield None
+                    continue
+                if error is not None:
+                    raise error
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.close()
+
+    def __iter__(self):
+        for item in self.poll(None):
+            yield item
+
+    def close(self):
+        """ Stop the thread and the stages upstream """
+        self._stop.set()
@@ -0,0 +1,261 @@
+#####
+#
+# On-disk cache of Portfolio Manager GET responses
+#
+#####
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Time to live in seconds for each kind of resource, first matching pattern wins
+DEFAULT_TTLS = [
+    (r"/meter/\d+/consumptionData", 60 * 60),
+    (r"/property/\d+/metrics", 60 * 60),
+    (r"/meter/\d+$", 7 * 24 * 60 * 60),
+    (r"/association/", 24 * 60 * 60),
+    (r"/building/", 24 * 60 * 60),
+    (r"/property/list", 24 * 60 * 60),
+    (r"/account$", 24 * 60 * 60),
+]
+
+# Request headers that change the response and so are part of the cache key
+VARY_HEADERS = ("PM-Metrics",)
+
+
+class CacheEntry(object):
+    """ An indexed response; body holds the body once read, None until then """
+    __slots__ = ("key", "path", "size", "expires", "etag", "last_modified", "headers", "body")
+
+    def __init__(self, key, path, size, expires, etag, last_modified, headers, body=None):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+        self.body = body
+
+    @property
+    def fresh(self):
+        return self.expires > time.time()
+
+
+class ResponseCache(object):
+    """
+    Stores response bodies on disk with an SQLite index, evicting the least
+    recently used entries once the cache grows past max_bytes.
+
+    Stale entries are kept while they fit, so they can be revalidated with
+    If-None-Match/If-Modified-Since when the server sent an ETag or
+    Last-Modified header. A body evicted (by another thread) while its entry
+    is in use counts as a miss, and the caller fetches it again.
+
+    Args:
+        directory : where bodies and the index are kept, created if missing
+        max_bytes : total size of bodies to keep
+        ttls : list of (regular expression, seconds) matched against the URL,
+            defaults to DEFAULT_TTLS
+        default_ttl : seconds for URLs no pattern matches
+        namespace : kept apart from other namespaces, e.g. the account username
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttls=None, default_ttl=60 * 60, namespace=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or DEFAULT_TTLS)]
+        self.default_ttl = default_ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, url TEXT, size INTEGER, "
+                               "accessed REAL, expires REAL, etag TEXT, last_modified TEXT, headers TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def ttl(self, url):
+        """ Time to live in seconds for a URL """
+        path = url.split("?", 1)[0]
+        for pattern, ttl in self.ttls:
+            if pattern.search(path):
+                return ttl
+        return self.default_ttl
+
+    def key(self, url, headers=None):
+        """ Cache key for a URL and the VARY_HEADERS among the request headers """
+        headers = CaseInsensitiveDict(headers or {})
+        parts = [self.namespace, url] + ["{0}:{1}".format(h, headers.get(h, "")) for h in VARY_HEADERS]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def lookup(self, url, headers=None):
+        """
+        Find a cached response
+
+        Args:
+            url : the request URL
+            headers : the request headers
+
+        Returns:
+            CacheEntry : fresh entry with its body read, or stale entry to
+                revalidate, None when nothing is cached
+        """
+        key = self.key(url, headers)
+        with self._lock:
+            row = self._conn.execute("SELECT size, expires, etag, last_modified, headers FROM entries WHERE key = ?",
+                                     (key,)).fetchone()
+        entry = None
+        if row is not None:
+            entry = CacheEntry(key, self._path(key), row[0], row[1], row[2], row[3], json.loads(row[4]))
+            if entry.fresh:
+                # Read now, so an eviction before the response is built can't lose it
+                entry.body = self._read(key)
+                if entry.body is None:
+                    entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            elif entry.fresh:
+                self.hits += 1
+        if entry is not None and entry.fresh:
+            self._touch(key)
+        return entry
+
+    def store(self, url, headers, response):
+        """
+        Cache a successful response
+
+        Args:
+            url : the request URL
+            headers : the request headers
+            response : the Response, its body is read if it was streamed
+
+        Returns:
+            CacheEntry : the stored entry, holding the body. A body larger
+                than max_bytes is returned but not kept.
+        """
+        key = self.key(url, headers)
+        body = response.content
+        kept = dict((h, response.headers[h]) for h in ("Content-Type", "ETag", "Last-Modified") if h in response.headers)
+        entry = CacheEntry(key, self._path(key), len(body), time.time() + self.ttl(url),
+                           response.headers.get("ETag"), response.headers.get("Last-Modified"), kept, body)
+        if len(body) > self.max_bytes:
+            return entry
+        tmp = self._path(key) + ".tmp.{0}".format(threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, self._path(key))
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, url, entry.size, time.time(), entry.expires, entry.etag, entry.last_modified,
+                                json.dumps(kept)))
+        self._evict(keep=key)
+        return entry
+
+    def refresh(self, entry, url):
+        """
+        Mark a stale entry fresh again after a 304 Not Modified
+
+        Returns:
+            CacheEntry : the entry with its body read, None when the body was
+                evicted since the entry was looked up, to be fetched again
+        """
+        entry.body = self._read(entry.key)
+        if entry.body is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        entry.expires = time.time() + self.ttl(url)
+        with self._lock, self._conn:
+            self.revalidated += 1
+            self._conn.execute("UPDATE entries SET expires = ?, accessed = ? WHERE key = ?",
+                               (entry.expires, time.time(), entry.key))
+        return entry
+
+    def conditional_headers(self, entry):
+        """ If-None-Match/If-Modified-Since headers to revalidate a stale entry """
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def response(self, entry, url):
+        """
+        Build a requests.Response from a cached entry
+
+        Returns:
+            Response : the cached response, None when the body was evicted
+                since the entry was looked up, to be fetched again
+        """
+        body = entry.body if entry.body is not None else self._read(entry.key)
+        if body is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        response = requests.Response()
+        response.status_code = requests.codes.ok
+        response.reason = "OK"
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry.headers)
+        response.encoding = "utf-8"
+        response._content = body
+        response.raw = io.BytesIO(body)
+        return response
+
+    def clear(self):
+        """ Remove every entry """
+        with self._lock, self._conn:
+            keys = [row[0] for row in self._conn.execute("SELECT key FROM entries")]
+            self._conn.execute("DELETE FROM entries")
+        for key in keys:
+            self._remove(key)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".body")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _touch(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        """ Remove least recently used entries until the cache fits, except keep, the entry being stored """
+        with self._lock, self._conn:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                evicted.append(key)
+                total -= size
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in evicted])
+        for key in evicted:
+            self._remove(key)
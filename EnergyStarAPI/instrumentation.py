@@ -0,0 +1,418 @@
+#####
+#
+# Timing and counters for Energy Star client calls and pipeline stages
+#
+#####
+import bisect
+import cProfile
+import datetime
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint(url, domain=""):
+    """ Path template that groups requests to the same endpoint, e.g. /meter/{id}/consumptionData """
+    if domain and url.startswith(domain):
+        url = url[len(domain):]
+    path = url.split("?", 1)[0]
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path) or "/"
+
+
+class Histogram(object):
+    """
+    Count of values in each of LATENCY_BUCKETS, plus count, total, min and max.
+    Not thread safe on its own, Instrumentation adds to it under its lock.
+    """
+    __slots__ = ("counts", "count", "total", "minimum", "maximum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def percentile(self, q):
+        """ Upper bound of the bucket holding the q-th percentile (0-100), capped at the maximum """
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        buckets = OrderedDict(("<={0}".format(b), n) for b, n in zip(LATENCY_BUCKETS, self.counts))
+        buckets["+inf"] = self.counts[-1]
+        return OrderedDict([
+            ("count", self.count), ("total", self.total), ("mean", self.total / self.count if self.count else None),
+            ("min", self.minimum), ("max", self.maximum), ("p50", self.percentile(50)),
+            ("p90", self.percentile(90)), ("p99", self.percentile(99)), ("buckets", buckets)])
+
+
+class Call(object):
+    """
+    One EnergyStarClient call, filled in while it runs and handed to the
+    hooks once it returns or raises. Its counters are updated under the
+    Instrumentation's lock, since a call's pages may be read on worker threads.
+
+    Attributes:
+        name : the client method, e.g. "get_meter"
+        args : the arguments worth reporting, e.g. {"meter_id": 123}
+        seconds : wall time of the call
+        request_seconds : time waiting for responses, including retries, rate
+            limiting and reading streamed bodies
+        parse_seconds : time spent parsing XML
+        bytes : response body bytes received
+        pages : responses received
+        status : status code of the last response
+        error : name of the exception the call raised, None on success
+    """
+    __slots__ = ("name", "args", "started", "seconds", "request_seconds", "parse_seconds", "bytes", "pages",
+                 "status", "error")
+
+    def __init__(self, name, args=None):
+        self.name = name
+        self.args = args or {}
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.request_seconds = 0.0
+        self.parse_seconds = 0.0
+        self.bytes = 0
+        self.pages = 0
+        self.status = None
+        self.error = None
+
+    def to_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__ if k != "started")
+
+
+class MeteredReader(object):
+    """
+    File-like wrapper around a streamed response body that counts the bytes
+    read and the time spent waiting for them
+
+    Args:
+        raw : the response's raw body
+        instrumentation : the Instrumentation to report to
+        call : the Call the body belongs to
+        url : the request URL
+    """
+    def __init__(self, raw, instrumentation, call, url):
+        self.raw = raw
+        self.instrumentation = instrumentation
+        self.call = call
+        self.url = url
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self.raw.read(size)
+        elapsed = time.perf_counter() - started
+        self.seconds += elapsed
+        self.instrumentation.received(self.url, self.call, len(data), elapsed)
+        return data
+
+
+class Instrumentation(object):
+    """
+    Collects what the client and the scripts spend their time on: every
+    client call, the requests it made and their status, bytes and latency
+    aggregated per endpoint, and timers around pipeline stages.
+
+    Hooks are called with each finished Call, from the thread that made it.
+
+    Args:
+        domain : base URL stripped from request URLs when naming endpoints
+    """
+    def __init__(self, domain=""):
+        self.domain = domain
+        self.hooks = []
+        self.started = datetime.datetime.now()
+        self._clock = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calls = OrderedDict()
+        self._endpoints = OrderedDict()
+        self._stages = OrderedDict()
+        self._profile = None
+
+    def add_hook(self, hook):
+        """ Call hook(call) after every client call """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def current(self):
+        """ The innermost call running on this thread, None outside client calls """
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    def begin(self, name, **args):
+        """ Start a call that is not tied to this thread, e.g. one spanning a generator """
+        return Call(name, args)
+
+    def end(self, call, error=None, seconds=None):
+        """
+        Finish a call started with begin(), record it and run the hooks
+
+        Args:
+            call : the Call
+            error : the exception that ended the call, if any
+            seconds : the call's duration, defaults to the time since begin()
+        """
+        call.seconds = time.perf_counter() - call.started if seconds is None else seconds
+        if error is not None:
+            call.error = type(error).__name__
+        with self._lock:
+            stats = self._calls.get(call.name)
+            if stats is None:
+                stats = self._calls[call.name] = {"calls":0, "errors":0, "pages":0, "bytes":0,
+                                                  "request_seconds":0.0, "parse_seconds":0.0, "latency":Histogram()}
+            stats["calls"] += 1
+            stats["errors"] += call.error is not None
+            stats["pages"] += call.pages
+            stats["bytes"] += call.bytes
+            stats["request_seconds"] += call.request_seconds
+            stats["parse_seconds"] += call.parse_seconds
+            stats["latency"].add(call.seconds)
+        for hook in self.hooks:
+            try:
+                hook(call)
+            except Exception:
+                logger.exception("Instrumentation hook {0!r} failed".format(hook))
+
+    @contextmanager
+    def call(self, name, **args):
+        """ Time a client call made on this thread, requests it makes are attributed to it """
+        call = self.begin(name, **args)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(call)
+        error = None
+        try:
+            yield call
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            stack.pop()
+            self.end(call, error)
+
+    def track(self, iterable, call):
+        """
+        Iterate on behalf of a call started with begin(), ending it when the
+        iterable is exhausted, raises or is closed. Only the time spent
+        producing items counts towards the call, not the caller's time
+        between items.
+        """
+        seconds = 0.0
+        error = None
+        iterator = iter(iterable)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+                yield item
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.end(call, error, seconds)
+
+    def request(self, url, response, seconds, call=None, error=None, streamed=False):
+        """
+        Record a request
+
+        Args:
+            url : the request URL
+            response : the Response, None if the request raised
+            seconds : time until the response arrived, including retries
+            call : the Call to attribute it to, defaults to the current call
+            error : the exception raised instead of a response
+            streamed : the body has not been read, its bytes are counted by a MeteredReader
+        """
+        call = call or self.current()
+        status = response.status_code if response is not None else type(error).__name__
+        size = len(response.content) if response is not None and not streamed else 0
+        with self._lock:
+            stats = self._endpoint(url)
+            stats["requests"] += 1
+            stats["bytes"] += size
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["latency"].add(seconds)
+            if call is not None:
+                call.pages += 1
+                call.bytes += size
+                call.request_seconds += seconds
+                call.status = status
+
+    def received(self, url, call, size, seconds):
+        """ Record part of a streamed body read by a MeteredReader """
+        with self._lock:
+            self._endpoint(url)["bytes"] += size
+            if call is not None:
+                call.bytes += size
+                call.request_seconds += seconds
+
+    def parsed(self, call, seconds):
+        """ Add seconds of parse time to a call """
+        if call is not None:
+            with self._lock:
+                call.parse_seconds += seconds
+
+    @contextmanager
+    def parsing(self, call=None):
+        """ Count the time spent in the block as parse time of the call (default the current call) """
+        call = call or self.current()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.parsed(call, time.perf_counter() - started)
+
+    @contextmanager
+    def stage(self, name):
+        """ Time a pipeline stage, repeated stages of the same name add up """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = self._stages.setdefault(name, {"count":0, "seconds":0.0})
+                stats["count"] += 1
+                stats["seconds"] += elapsed
+            logger.debug("Stage {0} took {1:.3f}s".format(name, elapsed))
+
+    @contextmanager
+    def profile(self, path=None, limit=30):
+        """
+        Run the block under cProfile and add the slowest functions to the report
+
+        Only the thread entering the block is profiled; run with one worker to
+        include the requests and parsing done on worker threads.
+
+        Args:
+            path : file to dump the raw stats to, for pstats or snakeviz
+            limit : functions listed in the report, by cumulative time
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            if path:
+                profiler.dump_stats(path)
+            stats = pstats.Stats(profiler, stream=io.StringIO())
+            functions = []
+            for (filename, line, function), (cc, nc, tt, ct, callers) in stats.stats.items():
+                functions.append(OrderedDict([("function", "{0}:{1}({2})".format(filename, line, function)),
+                                              ("calls", nc), ("total_seconds", tt), ("cumulative_seconds", ct)]))
+            functions.sort(key=lambda f: f["cumulative_seconds"], reverse=True)
+            self._profile = OrderedDict([("path", path), ("functions", functions[:limit])])
+
+    @contextmanager
+    def run(self, path=None, profile=None, extra=None):
+        """
+        Wrap a whole run: optionally profile it, and write the report when it
+        ends, with status "ok" or "failed"
+
+        Args:
+            path : report file, None to skip writing it
+            profile : file for the cProfile stats, None to run without the profiler
+            extra : function returning more report entries, called once the run ends
+        """
+        status = "failed"
+        try:
+            if profile:
+                with self.profile(profile):
+                    yield self
+            else:
+                yield self
+            status = "ok"
+        finally:
+            if path:
+                self.write_report(path, status=status, **(extra() if extra else {}))
+                logger.info("Wrote run report to {0}".format(path))
+
+    def report(self, **extra):
+        """
+        Everything recorded so far
+
+        Args:
+            **extra : more top level entries, e.g. transport=client.transport.stats.snapshot()
+
+        Returns:
+            Dictionary : started/finished times, wall_seconds, stages, calls
+                and endpoints (each with a latency histogram), the profile when
+                one was taken, and the extra entries
+        """
+        with self._lock:
+            report = OrderedDict([
+                ("started", self.started.isoformat()),
+                ("finished", datetime.datetime.now().isoformat()),
+                ("wall_seconds", time.perf_counter() - self._clock),
+                ("stages", OrderedDict((k, dict(v)) for k, v in self._stages.items())),
+                ("calls", OrderedDict((k, _with_histogram(v)) for k, v in self._calls.items())),
+                ("endpoints", OrderedDict((k, _with_histogram(v)) for k, v in self._endpoints.items())),
+            ])
+        if self._profile is not None:
+            report["profile"] = self._profile
+        report.update(extra)
+        return report
+
+    def write_report(self, path, **extra):
+        """ Write report() to a JSON file, creating its directory if needed """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, "w") as f:
+            json.dump(self.report(**extra), f, indent=2, default=str)
+        return path
+
+    def _endpoint(self, url):
+        name = endpoint(url, self.domain)
+        stats = self._endpoints.get(name)
+        if stats is None:
+            stats = self._endpoints[name] = {"requests":0, "bytes":0, "statuses":{}, "latency":Histogram()}
+        return stats
+
+
+def _with_histogram(stats):
+    data = dict(stats)
+    data["latency"] = stats["latency"].to_dict()
+    if "statuses" in data:
+        data["statuses"] = dict((str(k), v) for k, v in stats["statuses"].items())
+    return data
@@ -0,0 +1,268 @@
+#####
+#
+# XML parsing shared by the Energy Star clients
+#
+#####
+import datetime
+import numpy as np
+import pandas as pd
+import xml.etree.ElementTree as Et
+from array import array
+from xmljson import BadgerFish
+from .records import Meter
+
+CONSUMPTION_TAGS = ("meterConsumption", "meterDelivery")
+
+# Fields of the /meter/{id} response kept in the meter metadata cache, those of the Meter record
+METER_FIELDS = tuple(name for name, _, _ in Meter.FIELDS)
+
+
+def badgerfish(text):
+    """
+    Convert an XML document to a dictionary
+
+    Args:
+        text : the XML document
+
+    Returns:
+        Dictionary : BadgerFish style representation, http://www.sklar.com/badgerfish/
+    """
+    return BadgerFish(dict_type=dict).data(Et.fromstring(text))
+
+
+def property_links(text):
+    """ [(property id, hint), ...] from a property list response """
+    return [(int(e.get("id")), e.get("hint")) for e in Et.fromstring(text).find("links")]
+
+
+def meter_ids(text):
+    """ [meter id, ...] from a property/meter association response """
+    return [int(e.text) for e in Et.fromstring(text).iter("meterId")]
+
+
+def meter_metadata(text):
+    """
+    The METER_FIELDS of a meter response
+
+    Returns:
+        Dictionary : {"id":"123", "type":"Natural Gas", ...}, fields missing
+            from the response are None and a missing type is ''
+    """
+    meter = dict.fromkeys(METER_FIELDS)
+    for e in Et.fromstring(text):
+        if e.tag in meter:
+            meter[e.tag] = e.text
+    meter["type"] = meter["type"] or ''
+    return meter
+
+
+def metric_values(text, metrics):
+    """
+    {metric: value} from a property metrics response
+
+    Args:
+        text : the XML document
+        metrics : the metrics requested in the PM-Metrics header, in order
+
+    Returns:
+        Dictionary : value strings by metric, None when not reported
+    """
+    values = dict.fromkeys(metrics)
+    for name, element in zip(metrics, Et.fromstring(text).findall("metric")):
+        # Prefer the name Portfolio Manager reports, fall back to request order
+        key = element.get("name") if element.get("name") in values else name
+        values[key] = element.find("value").text
+    return values
+
+
+def month_range(year, month):
+    """ (year, month) from the given month up to and including the current month """
+    today = datetime.datetime.now()
+    return [(i // 12, i % 12 + 1) for i in range(year * 12 + month - 1, today.year * 12 + today.month)]
+
+
+def metric_key(property_id, year, month, metric):
+    """ Metric cache key of a property's metric for a month """
+    return "{0}|{1}-{2:02d}|{3}".format(property_id, year, month, metric)
+
+
+def metrics_final(year, month, final, values):
+    """
+    Whether a month's metrics can be cached: the month is at or before the
+    final month (counted as year * 12 + month - 1) and every value is present.
+    A missing value may be a bill that hasn't been entered yet.
+    """
+    return year * 12 + month - 1 <= final and all(v is not None for v in values.values())
+
+
+class MetricJobs(object):
+    """
+    The property/months of a get_metrics call and what to do with each one's
+    values, shared by EnergyStarClient and AsyncEnergyStarClient so both
+    cache and report metrics the same way.
+
+    Args:
+        property_ids : iterable of property ids
+        metrics : list of metric names
+        year : start year
+        month : start month
+        lag_months : months after which a month's metrics are final
+    """
+    def __init__(self, property_ids, metrics, year, month, lag_months):
+        self.metrics = list(metrics)
+        today = datetime.datetime.now()
+        self.final = today.year * 12 + today.month - 1 - lag_months
+        dates = month_range(year, month)
+        self.jobs = [(property_id, y, m) for property_id in property_ids for (y, m) in dates]
+
+    def keys(self, job=None):
+        """ Metric cache keys of one (property id, year, month) job, or of every job """
+        jobs = [job] if job is not None else self.jobs
+        return [metric_key(p, y, m, name) for (p, y, m) in jobs for name in self.metrics]
+
+    def cached(self, job, cached):
+        """ {metric: value} of a job when every metric is in cached, else None """
+        keys = self.keys(job)
+        if all(k in cached for k in keys):
+            return dict((name, cached[k]) for name, k in zip(self.metrics, keys))
+        return None
+
+    def to_cache(self, job, values):
+        """ {cache key: value} to store for a job's fetched values, empty until they are final """
+        property_id, y, m = job
+        if not metrics_final(y, m, self.final, values):
+            return {}
+        return dict(zip(self.keys(job), (values[name] for name in self.metrics)))
+
+    def failed(self):
+        """ Values of a job that could not be read """
+        return dict.fromkeys(self.metrics)
+
+    def rows(self, values):
+        """ [{"PM ID":property_id, "K":"YYYY-MM", metric:value, ...}, ...] from each job's values, in job order """
+        data = []
+        for (property_id, y, m), job_values in zip(self.jobs, values):
+            d = {"PM ID":property_id, "K":"{0}-{1:02d}".format(y, m)}
+            d.update(job_values)
+            data.append(d)
+        return data
+
+
+def consumption_row(element):
+    """
+    Convert a meterConsumption or meterDelivery element to a tuple
+
+    Args:
+        element : the meterConsumption/meterDelivery element
+
+    Returns:
+        Tuple : ("YYYY-MM-DD", usage, cost, source) where source is the index of
+            the element tag in CONSUMPTION_TAGS and cost is 0 when the entry has no cost
+    """
+    if element.tag == "meterConsumption":
+        date, usage, source = element.find("endDate").text, element.find("usage").text, 0
+    else:
+        date, usage, source = element.find("deliveryDate").text, element.find("quantity").text, 1
+    cost = element.find("cost")
+    return date, float(usage), float(cost.text) if cost is not None else 0.0, source
+
+
+def consumption_record(element):
+    """
+    Convert a meterConsumption or meterDelivery element to a record
+
+    Args:
+        element : the meterConsumption/meterDelivery element
+
+    Returns:
+        Dictionary : {"DATE":"YYYY-MM-DD", "USAGE":usage, "COST":cost, "SOURCE":element tag}
+            COST is 0 when the entry has no cost
+    """
+    date, usage, cost, source = consumption_row(element)
+    return {"DATE":date, "USAGE":usage, "COST":cost, "SOURCE":CONSUMPTION_TAGS[source]}
+
+
+def iter_meter_data(source, links, convert=consumption_record):
+    """
+    Incrementally parse a consumptionData page, yielding records as their
+    elements close and discarding them afterwards
+
+    Args:
+        source : file-like object (e.g. a streamed response's raw body) or file name
+        links : dictionary filled with {linkDescription: link} from the page's links
+        convert : function turning a meterConsumption/meterDelivery element into a record
+
+    Returns:
+        Generator : converted records, in document order
+    """
+    root = None
+    for event, element in Et.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = element
+            continue
+        if event != "end":
+            continue
+        if element.tag in CONSUMPTION_TAGS:
+            yield convert(element)
+            root.clear()
+        elif element.tag == "link":
+            links[element.get("linkDescription")] = element.get("link")
+
+
+def _constant_categorical(value, n):
+    """ Categorical of length n holding one value, missing when value is None """
+    if value is None:
+        return pd.Categorical.from_codes(np.full(n, -1, dtype=np.int8), [])
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [value])
+
+
+class ConsumptionColumns(object):
+    """
+    Typed column buffers filled from consumption_row tuples, avoiding a
+    dictionary per entry
+    """
+    __slots__ = ("dates", "usage", "cost", "source")
+
+    def __init__(self):
+        self.dates = []
+        self.usage = array("d")
+        self.cost = array("d")
+        self.source = array("b")
+
+    def __len__(self):
+        return len(self.dates)
+
+    def append(self, row):
+        date, usage, cost, source = row
+        self.dates.append(date)
+        self.usage.append(usage)
+        self.cost.append(cost)
+        self.source.append(source)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def to_frame(self, meter_id=None, meter_type=None):
+        """
+        Build the DataFrame without copying the numeric buffers
+
+        Args:
+            meter_id : value of the METER ID column
+            meter_type : value of the METER TYPE column
+
+        Returns:
+            DataFrame : DATE (datetime64), USAGE and COST (float64),
+                METER ID, METER TYPE and SOURCE (categorical)
+        """
+        n = len(self.dates)
+        single = np.zeros(n, dtype=np.int8)
+        return pd.DataFrame({
+            "DATE":np.array(self.dates, dtype="datetime64[D]").astype("datetime64[ns]"),
+            "USAGE":np.frombuffer(self.usage, dtype=np.float64) if n else np.empty(0),
+            "COST":np.frombuffer(self.cost, dtype=np.float64) if n else np.empty(0),
+            "METER ID":_constant_categorical(meter_id, n),
+            "METER TYPE":_constant_categorical(meter_type, n),
+            "SOURCE":pd.Categorical.from_codes(np.frombuffer(self.source, dtype=np.int8) if n else single,
+                                               list(CONSUMPTION_TAGS)),
+        })
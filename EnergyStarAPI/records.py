@@ -0,0 +1,280 @@
+#####
+#
+# Typed records of Portfolio Manager responses, checked against schemas-4.0
+#
+#####
+import datetime
+import os
+import xml.etree.ElementTree as Et
+from xmljson import BadgerFish
+
+# The XSDs bundled with the repository
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schemas-4.0")
+
+XS = "{http://www.w3.org/2001/XMLSchema}"
+
+
+def to_bool(text):
+    """ xs:boolean """
+    return text.strip() in ("true", "1")
+
+
+def to_date(text):
+    """ xs:date, ignoring any time zone """
+    return datetime.datetime.strptime(text.strip()[:10], "%Y-%m-%d").date()
+
+
+# Converter each XSD built-in type is parsed with, other types are kept as strings
+XSD_TYPES = {"xs:long":int, "xs:int":int, "xs:integer":int, "xs:decimal":float, "xs:boolean":to_bool,
+             "xs:date":to_date}
+
+
+class Record(object):
+    """
+    A Portfolio Manager document parsed into typed attributes in one pass.
+
+    Subclasses list their FIELDS as (attribute, path, converter): the path is
+    a child element ("yearBuilt", "grossFloorArea/value") or an attribute of
+    the record's element ("@city"), and the converter is None for strings.
+    Missing fields are None. Subtrees that are rarely used (contacts,
+    addresses, audit logs) are not parsed until accessed, and raw() gives the
+    BadgerFish dictionary the client returned before typed records.
+
+    Class attributes:
+        TAG : the element the record is parsed from
+        SCHEMA : (XSD file under schemas-4.0, complexType) the FIELDS are checked against
+        FIELDS : the typed attributes
+        KEEP_ELEMENT : keep the element for subtree() and raw()
+    """
+    __slots__ = ("_element",)
+    TAG = None
+    SCHEMA = None
+    FIELDS = ()
+    KEEP_ELEMENT = True
+
+    def __init__(self, element):
+        self._element = element if self.KEEP_ELEMENT else None
+        for name, path, convert in self.FIELDS:
+            if path.startswith("@"):
+                text = element.get(path[1:])
+            else:
+                text = element.findtext(path)
+            setattr(self, name, convert(text) if convert is not None and text else text)
+
+    @classmethod
+    def parse(cls, text):
+        """ Record from an XML document """
+        return cls(Et.fromstring(text))
+
+    @classmethod
+    def optional(cls, element):
+        """ Record from an element that may be missing, None when it is """
+        return cls(element) if element is not None else None
+
+    def subtree(self, path):
+        """ BadgerFish dictionary of a child element that has no typed field, None when missing """
+        child = self._element.find(path) if self._element is not None else None
+        return BadgerFish(dict_type=dict).data(child) if child is not None else None
+
+    def raw(self):
+        """ BadgerFish dictionary of the whole document, e.g. raw()["account"]["id"]["$"] """
+        if self._element is None:
+            raise ValueError("{0} records do not keep their element".format(type(self).__name__))
+        return BadgerFish(dict_type=dict).data(self._element)
+
+    def to_dict(self):
+        """ {attribute: value} of the FIELDS """
+        return dict((name, getattr(self, name)) for name, _, _ in self.FIELDS)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__,
+                                 ", ".join("{0}={1!r}".format(k, v) for k, v in self.to_dict().items()))
+
+
+class Address(Record):
+    TAG = "address"
+    SCHEMA = ("common/address.xsd", "addressType")
+    FIELDS = (("address1", "@address1", None), ("address2", "@address2", None), ("city", "@city", None),
+              ("county", "@county", None), ("postalCode", "@postalCode", None), ("state", "@state", None),
+              ("country", "@country", None))
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+
+
+class Contact(Record):
+    TAG = "contact"
+    SCHEMA = ("account/account.xsd", "contactType")
+    FIELDS = (("firstName", "firstName", None), ("lastName", "lastName", None), ("email", "email", None),
+              ("jobTitle", "jobTitle", None), ("phone", "phone", None))
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+
+    @property
+    def address(self):
+        return Address.optional(self._element.find("address"))
+
+
+class Account(Record):
+    """ /account, e.g. client.get_account_info().id """
+    TAG = "account"
+    SCHEMA = ("account/account.xsd", "accountType")
+    FIELDS = (("id", "id", int), ("username", "username", None), ("webserviceUser", "webserviceUser", to_bool),
+              ("searchable", "searchable", to_bool),
+              ("includeTestPropertiesInGraphics", "includeTestPropertiesInGraphics", to_bool))
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+
+    @property
+    def contact(self):
+        return Contact.optional(self._element.find("contact"))
+
+    @property
+    def organization(self):
+        """ BadgerFish dictionary of the organization """
+        return self.subtree("organization")
+
+
+class Property(Record):
+    """ /property/{id}, the same fields as a building """
+    TAG = "property"
+    SCHEMA = ("property/property.xsd", "propertyType")
+    FIELDS = (("name", "name", None), ("constructionStatus", "constructionStatus", None),
+              ("primaryFunction", "primaryFunction", None), ("grossFloorArea", "grossFloorArea/value", int),
+              ("yearBuilt", "yearBuilt", int), ("numberOfBuildings", "numberOfBuildings", int),
+              ("isFederalProperty", "isFederalProperty", to_bool), ("federalOwner", "federalOwner", None),
+              ("agencyDepartmentRegion", "agencyDepartmentRegion", None), ("federalCampus", "federalCampus", None),
+              ("occupancyPercentage", "occupancyPercentage", int), ("notes", "notes", None),
+              ("accessLevel", "accessLevel", None))
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+
+    @property
+    def address(self):
+        return Address.optional(self._element.find("address"))
+
+    @property
+    def grossFloorAreaUnits(self):
+        element = self._element.find("grossFloorArea")
+        return element.get("units") if element is not None else None
+
+    @property
+    def agency(self):
+        """ BadgerFish dictionary of the federal agency """
+        return self.subtree("agency")
+
+
+class Building(Property):
+    """ /building/{id}, e.g. client.get_building_info(prop_id).grossFloorArea """
+    TAG = "building"
+    __slots__ = ()
+
+
+class Meter(Record):
+    """ /meter/{id} """
+    TAG = "meter"
+    SCHEMA = ("meter/meter.xsd", "meterType")
+    FIELDS = (("id", "id", int), ("type", "type", None), ("name", "name", None), ("metered", "metered", to_bool),
+              ("unitOfMeasure", "unitOfMeasure", None), ("firstBillDate", "firstBillDate", to_date),
+              ("inUse", "inUse", to_bool), ("inactiveDate", "inactiveDate", to_date))
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        """ Meter from the metadata dictionary of get_meter/get_meters (and the meter cache) """
+        element = Et.Element(cls.TAG)
+        for name, _, _ in cls.FIELDS:
+            if metadata.get(name) is not None:
+                Et.SubElement(element, name).text = str(metadata[name])
+        return cls(element)
+
+
+class Consumption(Record):
+    """ A meterConsumption entry of /meter/{id}/consumptionData """
+    TAG = "meterConsumption"
+    SCHEMA = ("meter/meterConsumptionData.xsd", "meterConsumptionType")
+    FIELDS = (("id", "id", int), ("startDate", "startDate", to_date), ("endDate", "endDate", to_date),
+              ("usage", "usage", float), ("cost", "cost", float), ("estimatedValue", "@estimatedValue", to_bool))
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+    # Entries are parsed incrementally and their elements discarded
+    KEEP_ELEMENT = False
+
+
+class Delivery(Record):
+    """ A meterDelivery entry of /meter/{id}/consumptionData """
+    TAG = "meterDelivery"
+    SCHEMA = ("meter/meterConsumptionData.xsd", "meterDeliveryType")
+    FIELDS = (("id", "id", int), ("deliveryDate", "deliveryDate", to_date), ("quantity", "quantity", float),
+              ("cost", "cost", float), ("estimatedValue", "@estimatedValue", to_bool))
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+    KEEP_ELEMENT = False
+
+
+RECORD_TYPES = (Address, Contact, Account, Property, Building, Meter, Consumption, Delivery)
+
+
+def consumption_entry(element):
+    """
+    Consumption or Delivery record of a meterConsumption/meterDelivery element,
+    a convert function for iter_consumption
+    """
+    return Consumption(element) if element.tag == Consumption.TAG else Delivery(element)
+
+
+def schema_fields(path, type_name):
+    """
+    Child elements and attributes of a complexType
+
+    Args:
+        path : the XSD file
+        type_name : name of the complexType
+
+    Returns:
+        Dictionary : {element name or "@attribute": XSD type}, the type is None
+            for elements and attributes with an inline type
+
+    Raises:
+        KeyError : when the file has no such complexType
+    """
+    for complex_type in Et.parse(path).getroot().iter(XS + "complexType"):
+        if complex_type.get("name") == type_name:
+            fields = {}
+            _collect(complex_type, fields)
+            return fields
+    raise KeyError("{0} is not defined in {1}".format(type_name, path))
+
+
+def _collect(node, fields):
+    # Descends through all/sequence/choice/extension but not into nested elements' own types
+    for child in node:
+        if child.tag == XS + "element":
+            fields[child.get("name")] = child.get("type")
+        elif child.tag == XS + "attribute":
+            fields["@" + child.get("name")] = child.get("type")
+        elif child.tag not in (XS + "complexType", XS + "simpleType", XS + "annotation"):
+            _collect(child, fields)
+
+
+def check_schemas(directory=SCHEMA_DIR, records=RECORD_TYPES):
+    """
+    Check the FIELDS of the records against the XSDs
+
+    Every field's element or attribute must be declared in the record's
+    complexType, and a field with an XSD built-in type must use the converter
+    of XSD_TYPES for it.
+
+    Args:
+        directory : the schemas-4.0 directory
+        records : Record subclasses to check
+
+    Returns:
+        List : a description of each mismatch, empty when the records match
+    """
+    problems = []
+    for record in records:
+        declared = schema_fields(os.path.join(directory, record.SCHEMA[0]), record.SCHEMA[1])
+        for name, path, convert in record.FIELDS:
+            key = path.split("/")[0]
+            if key not in declared:
+                problems.append("{0}.{1}: {2} is not in {3}".format(record.__name__, name, key, record.SCHEMA[1]))
+            elif "/" not in path and declared[key] in XSD_TYPES and XSD_TYPES[declared[key]] is not convert:
+                problems.append("{0}.{1}: {2} is {3}".format(record.__name__, name, key, declared[key]))
+    return problems
@@ -0,0 +1,110 @@
+#####
+#
+# Local key/value store used to cache Energy Star responses between runs
+#
+#####
+import json
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache(object):
+    """
+    Thread safe key/value store backed by SQLite with optional expiry.
+
+    Values are stored as JSON so anything json.dumps accepts can be cached.
+
+    Args:
+        path : SQLite database file, ":memory:" keeps the cache for this process only
+        table : table name, lets several caches share one database file
+        ttl : default time to live in seconds, None never expires
+    """
+    def __init__(self, path=":memory:", table="cache", ttl=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS {0} (key TEXT PRIMARY KEY, value TEXT, expires REAL)".format(table))
+
+    def get(self, key, default=None):
+        """
+        Get a cached value
+
+        Args:
+            key : the cache key
+            default : returned when the key is missing or expired
+
+        Returns:
+            The cached value or default
+        """
+        return self.get_many([key]).get(str(key), default)
+
+    def get_many(self, keys):
+        """
+        Get several cached values in one query
+
+        Args:
+            keys : iterable of cache keys
+
+        Returns:
+            Dictionary : {key: value} for every key that is present and not expired.
+                Keys are returned as strings.
+        """
+        keys = [str(k) for k in keys]
+        found = {}
+        now = time.time()
+        # Stay well under SQLite's bound parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            query = "SELECT key, value FROM {0} WHERE key IN ({1}) AND (expires IS NULL OR expires > ?)".format(
+                self.table, ",".join("?" * len(chunk)))
+            with self._lock:
+                rows = self._conn.execute(query, chunk + [now]).fetchall()
+            for key, value in rows:
+                found[key] = json.loads(value)
+        return found
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value
+
+        Args:
+            key : the cache key
+            value : JSON serialisable value
+            ttl : time to live in seconds, defaults to the cache's ttl
+        """
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items, ttl=None):
+        """
+        Store several values in one transaction
+
+        Args:
+            items : dictionary of {key: value}
+            ttl : time to live in seconds, defaults to the cache's ttl
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        rows = [(str(k), json.dumps(v), expires) for k, v in items.items()]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO {0} (key, value, expires) VALUES (?, ?, ?)".format(self.table), rows)
+
+    def delete(self, key):
+        """ Remove a key from the cache """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM {0} WHERE key = ?".format(self.table), (str(key),))
+
+    def purge(self):
+        """ Remove every expired entry """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM {0} WHERE expires IS NOT NULL AND expires <= ?".format(self.table),
+                               (time.time(),))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
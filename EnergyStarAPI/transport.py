@@ -0,0 +1,285 @@
+#####
+#
+# Rate limited, retrying transport shared by every EnergyStarClient endpoint
+#
+#####
+import datetime
+import email.utils
+import logging
+import random
+import threading
+import time
+import requests
+
+# Seconds to connect and to wait between bytes of a response
+DEFAULT_TIMEOUT = (10, 120)
+
+# Statuses that mean "try again later"; 429 and 503 also mean "slow down"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter
+
+    Args:
+        rate : tokens added per second
+        burst : bucket size, defaults to one second of tokens
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available and take it """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDLimiter(object):
+    """
+    Concurrency limit with additive increase and multiplicative decrease:
+    every successful request raises the limit by 1/limit (about one more slot
+    per round of requests) and every throttled request halves it.
+
+    Args:
+        limit : starting concurrency
+        minimum : lowest limit
+        maximum : highest limit, defaults to the starting limit, which makes
+            it a back-off limiter that recovers but never grows past its start
+    """
+    def __init__(self, limit, minimum=1, maximum=None):
+        self.limit = float(limit)
+        self.minimum = minimum
+        self.maximum = max(maximum or limit, limit)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """ Block until fewer than limit requests are in flight """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        """
+        Free a slot and adjust the limit
+
+        Args:
+            throttled : whether the request was throttled by the server
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class TransportStats(object):
+    """ Thread safe counters describing what the transport has done """
+    FIELDS = ("requests", "retries", "throttled", "connection_errors", "failures", "retry_wait_seconds",
+              "cache_hits", "cache_revalidated")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+        self.statuses = {}
+
+    def add(self, field, amount=1):
+        with self._lock:
+            self._counts[field] += amount
+
+    def status(self, code):
+        with self._lock:
+            self.statuses[code] = self.statuses.get(code, 0) + 1
+
+    def snapshot(self):
+        """ Dictionary of every counter plus the count of each response status """
+        with self._lock:
+            data = dict(self._counts)
+            data["statuses"] = dict(self.statuses)
+        return data
+
+
+class Transport(object):
+    """
+    Sends GET requests for the client: waits for the rate limiter and a
+    concurrency slot, retries connection errors and RETRY_STATUSES with
+    jittered exponential backoff (or the server's Retry-After), and halves
+    the concurrency limit when the server throttles.
+
+    Args:
+        session : the requests.Session to send on
+        rate : maximum requests per second, None for no limit
+        burst : token bucket size, defaults to one second of requests
+        concurrency : starting requests in flight, None for no limit
+        max_concurrency : highest limit additive increase may reach, defaults
+            to concurrency, in which case the limit only backs off and recovers
+        max_retries : retries per request before giving up
+        backoff : base delay in seconds, doubled on every retry
+        max_backoff : longest delay between retries in seconds
+        cache : ResponseCache to serve and revalidate GETs from, None to always ask the server
+        timeout : (connect, read) seconds for each request, so a stalled
+            connection is retried instead of holding its slot forever
+    """
+    def __init__(self, session, rate=None, burst=None, concurrency=None, max_retries=5, backoff=0.5, max_backoff=60,
+                 cache=None, timeout=DEFAULT_TIMEOUT, max_concurrency=None):
+        self.session = session
+        self.cache = cache
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limiter = AIMDLimiter(concurrency, maximum=max_concurrency) if concurrency else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = TransportStats()
+        self._pause_until = 0
+        self._pause_lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        """
+        GET a URL with retries, through the response cache when there is one
+
+        Args:
+            url : the URL
+            **kwargs : passed to session.get (headers, stream, ...), timeout
+                defaults to the transport's
+
+        Returns:
+            Response : the first response that should not be retried, or the
+                last response once retries run out
+
+        Raises:
+            ConnectionError, Timeout : when every attempt failed to connect
+        """
+        if self.cache is None:
+            return self._send(url, **kwargs)
+
+        headers = kwargs.get("headers") or {}
+        entry = self.cache.lookup(url, headers)
+        if entry is not None and entry.fresh:
+            self.stats.add("cache_hits")
+            return self.cache.response(entry, url)
+        if entry is not None:
+            kwargs["headers"] = dict(headers, **self.cache.conditional_headers(entry))
+
+        response = self._send(url, **kwargs)
+        if response.status_code == requests.codes.not_modified and entry is not None:
+            entry = self.cache.refresh(entry, url)
+            if entry is not None:
+                self.stats.add("cache_revalidated")
+                return self.cache.response(entry, url)
+            # Evicted while revalidating, ask for the body itself
+            response.close()
+            kwargs["headers"] = headers
+            response = self._send(url, **kwargs)
+        if response.status_code == requests.codes.ok:
+            return self.cache.response(self.cache.store(url, headers, response), url)
+        return response
+
+    def _send(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self._wait_for_pause()
+            if self.bucket:
+                self.bucket.acquire()
+            if self.limiter:
+                self.limiter.acquire()
+            throttled = False
+            try:
+                self.stats.add("requests")
+                response = self.session.get(url, **kwargs)
+                self.stats.status(response.status_code)
+                throttled = response.status_code in THROTTLE_STATUSES
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.stats.add("connection_errors")
+                if attempt >= self.max_retries:
+                    self.stats.add("failures")
+                    raise
+                response = None
+            finally:
+                if self.limiter:
+                    self.limiter.release(throttled)
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return response
+            if attempt >= self.max_retries:
+                self.stats.add("failures")
+                return response
+
+            delay = retry_delay(attempt, response, self.backoff, self.max_backoff)
+            if throttled:
+                self.stats.add("throttled")
+                self._pause(delay)
+            if response is not None:
+                response.close()
+            logger.debug("Retrying {0} in {1:.2f}s (attempt {2})".format(url, delay, attempt + 1))
+            self.stats.add("retries")
+            self.stats.add("retry_wait_seconds", delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _pause(self, seconds):
+        # A throttled response holds back every thread, not only the one that saw it
+        with self._pause_lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def _wait_for_pause(self):
+        wait = self._pause_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+
+def retry_delay(attempt, response, backoff, max_backoff):
+    """
+    Seconds to wait before retrying, shared by Transport and AsyncEnergyStarClient
+
+    Args:
+        attempt : retries made so far
+        response : the response to retry (requests or aiohttp), None after a connection error
+        backoff : base delay in seconds, doubled on every retry
+        max_backoff : longest delay in seconds
+
+    Returns:
+        Float : the server's Retry-After when it sent one, otherwise a random
+            delay up to the exponential backoff, capped at max_backoff
+    """
+    retry_after = _retry_after(response)
+    if retry_after is not None:
+        return min(max_backoff, retry_after)
+    # Full jitter keeps retrying threads from arriving together
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def _retry_after(response):
+    """ Seconds from a Retry-After header (delta-seconds or HTTP date), or None """
+    if response is None or not response.headers.get("Retry-After"):
+        return None
+    value = response.headers["Retry-After"]
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.datetime.now(when.tzinfo)).total_seconds())
@@ -0,0 +1,14 @@
+#####
+#
+# NOAA EnergyStar sync pipeline components
+#
+#####
+from .state import SyncState, row_id
+from .transform import consumption_table, index_sites, transform, metric_table, join_metrics
+from .sinks import Sink, SocrataSink, CSVSink, ParquetSink
+from .runs import Checkpoint, make_sink, merge_outputs, parse_shard, shard_of, in_shard, shard_path
+from .timeseries import TimeSeriesStore
+from .reference import ReferenceCache, load_reference, view_metadata_url, row_identifier
+from .pipeline import MemoryBudget, Stage
+from .reconcile import Delta, Reconciler, deletions, row_hashes
+from .cube import AggregateCube
@@ -0,0 +1,164 @@
+#####
+#
+# Fiscal-year aggregates of usage and cost, maintained as rows are synced
+#
+#####
+import datetime
+import logging
+import sqlite3
+import threading
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Cube dimensions, by the column they come from in the transformed rows
+CUBE_KEYS = (("PM ID", "pm_id"), ("METER TYPE", "meter_type"), ("FY", "fy"), ("Fiscal Period", "period"))
+
+# Site attributes kept per property by default
+DEFAULT_ATTRIBUTES = ("PROPERTY", "PROPERTY ID", "State")
+
+
+class AggregateCube(object):
+    """
+    Total usage and cost per property, meter type, FY and fiscal period, with
+    the properties' site attributes, kept up to date as rows are synced.
+
+    Each update only touches the cells of the rows it is given: the
+    contribution of every ROWID is remembered, so a changed row moves its
+    old values out of its cell and its new values in, and history is never
+    rescanned. Roll-ups (e.g. cost by State and FY) read the cells, whose
+    number depends on properties and months rather than on meters or rows.
+
+    Args:
+        path : SQLite database file
+        attributes : columns of the transformed rows kept per property and
+            usable in roll-ups, e.g. site columns such as "State" or "Bureau"
+    """
+    def __init__(self, path, attributes=DEFAULT_ATTRIBUTES):
+        self.path = path
+        self.attributes = list(attributes)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS contributions (rowid_key TEXT PRIMARY KEY, pm_id TEXT, "
+                               "meter_type TEXT, fy TEXT, period TEXT, usage REAL, cost REAL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cells (pm_id TEXT, meter_type TEXT, fy TEXT, period TEXT, "
+                               "usage REAL, cost REAL, rows INTEGER, PRIMARY KEY (pm_id, meter_type, fy, period))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cells_fy ON cells (fy)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS properties (pm_id TEXT PRIMARY KEY, updated TEXT)")
+            existing = set(r[1] for r in self._conn.execute("PRAGMA table_info(properties)"))
+            for name in self.attributes:
+                if name not in existing:
+                    self._conn.execute("ALTER TABLE properties ADD COLUMN {0} TEXT".format(_quote(name)))
+
+    def update(self, rows):
+        """
+        Add new rows to the cube and replace the values of rows seen before
+
+        Args:
+            rows : DataFrame from transform (or join_metrics)
+
+        Returns:
+            Integer : cells changed
+        """
+        if len(rows) == 0:
+            return 0
+        new = pd.DataFrame({"rowid_key":rows["ROWID"].astype(str).values})
+        for column, name in CUBE_KEYS:
+            new[name] = rows[column].astype(str).values
+        new["usage"] = pd.to_numeric(rows["TOTAL USAGE"]).values
+        new["cost"] = pd.to_numeric(rows["TOTAL COST"]).values
+        # A site listed twice in the sites table repeats its rows
+        new = new.drop_duplicates("rowid_key", keep="last")
+        keys = [name for _, name in CUBE_KEYS]
+
+        with self._lock, self._conn:
+            old = self._contributions(new["rowid_key"])
+            # Old values leave their cell, new values enter theirs, one group by for all of them
+            old_part = old[keys].assign(usage=-old["usage"], cost=-old["cost"], rows=-1)
+            new_part = new[keys].assign(usage=new["usage"], cost=new["cost"], rows=1)
+            deltas = pd.concat([old_part, new_part], ignore_index=True).groupby(keys, sort=False).sum().reset_index()
+            self._conn.executemany(
+                "INSERT INTO cells (pm_id, meter_type, fy, period, usage, cost, rows) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (pm_id, meter_type, fy, period) DO UPDATE SET usage = usage + excluded.usage, "
+                "cost = cost + excluded.cost, rows = rows + excluded.rows",
+                deltas[keys + ["usage", "cost", "rows"]].itertuples(index=False, name=None))
+            self._conn.execute("DELETE FROM cells WHERE rows <= 0")
+            self._conn.executemany("INSERT OR REPLACE INTO contributions (rowid_key, pm_id, meter_type, fy, period, "
+                                   "usage, cost) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   new[["rowid_key"] + keys + ["usage", "cost"]].itertuples(index=False, name=None))
+            self._update_properties(rows)
+        logger.debug("Updated {0} cube cell(s) from {1} row(s)".format(len(deltas), len(new)))
+        return len(deltas)
+
+    def _contributions(self, rowids):
+        # Join against a temporary table rather than one lookup per ROWID
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (rowid_key TEXT PRIMARY KEY)")
+        self._conn.execute("DELETE FROM wanted")
+        self._conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((r,) for r in rowids))
+        found = self._conn.execute("SELECT c.pm_id, c.meter_type, c.fy, c.period, c.usage, c.cost FROM contributions c "
+                                   "JOIN wanted USING (rowid_key)").fetchall()
+        return pd.DataFrame(found, columns=[name for _, name in CUBE_KEYS] + ["usage", "cost"])
+
+    def _update_properties(self, rows):
+        names = [name for name in self.attributes if name in rows.columns]
+        latest = rows.drop_duplicates("PM ID", keep="last")[["PM ID"] + names].astype(object)
+        latest = latest.where(latest.notna(), None)
+        now = datetime.datetime.now().isoformat()
+        columns = ", ".join(["pm_id", "updated"] + [_quote(name) for name in names])
+        updates = ", ".join(["updated = excluded.updated"] + ["{0} = excluded.{0}".format(_quote(name)) for name in names])
+        self._conn.executemany(
+            "INSERT INTO properties ({0}) VALUES ({1}) ON CONFLICT (pm_id) DO UPDATE SET {2}".format(
+                columns, ", ".join("?" * (len(names) + 2)), updates),
+            [(str(row[0]), now) + tuple(_plain(v) for v in row[1:]) for row in latest.itertuples(index=False, name=None)])
+
+    def rollup(self, by, where=None):
+        """
+        Total usage and cost grouped by cube keys and property attributes
+
+        e.g. cube.rollup(["State", "FY"]) or
+        cube.rollup(["METER TYPE"], where={"FY":"2017", "State":["MD", "CO"]})
+
+        Args:
+            by : columns to group by, from "PM ID", "METER TYPE", "FY",
+                "Fiscal Period" and the attributes. Empty for a grand total.
+            where : {column: value or list of values} to keep
+
+        Returns:
+            DataFrame : the by columns, USAGE, COST and ROWS (the meter months
+                summed), sorted by the by columns
+        """
+        columns = dict(CUBE_KEYS)
+        columns.update((name, "p." + _quote(name)) for name in self.attributes)
+        unknown = [c for c in list(by) + list(where or {}) if c not in columns]
+        if unknown:
+            raise KeyError("Not in the cube: {0}".format(", ".join(unknown)))
+        selected = [columns[c] for c in by]
+        clauses, params = [], []
+        for column, value in (where or {}).items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            clauses.append("{0} IN ({1})".format(columns[column], ", ".join("?" * len(values))))
+            params.extend(str(v) for v in values)
+        sql = "SELECT {0} SUM(c.usage), SUM(c.cost), SUM(c.rows) FROM cells c LEFT JOIN properties p USING (pm_id)".format(
+            "".join(s + ", " for s in selected))
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if selected:
+            sql += " GROUP BY {0} ORDER BY {0}".format(", ".join(selected))
+        with self._lock:
+            found = self._conn.execute(sql, params).fetchall()
+        frame = pd.DataFrame(found, columns=list(by) + ["USAGE", "COST", "ROWS"])
+        return frame[frame["ROWS"].notna()].reset_index(drop=True) if not selected else frame
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _quote(name):
+    return '"{0}"'.format(name.replace('"', '""'))
+
+
+def _plain(value):
+    # numpy scalars to what sqlite3 accepts
+    return value.item() if hasattr(value, "item") else value
@@ -0,0 +1,70 @@
+#####
+#
+# Bounded stages for streaming the sync from fetch to sink
+#
+#####
+import logging
+import threading
+# The same bounded stage the client prefetches consumption pages with
+from EnergyStarAPI.fetcher import Stage
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudget(object):
+    """
+    Bytes of data held between fetch and sink. Producers acquire the size of
+    what they hand on and block while the budget is used up; the consumer
+    charges what it builds from that data (e.g. transformed rows) without
+    waiting, and releases both once they have been written.
+
+    An item larger than the whole budget is let through when nothing else is
+    held, so the pipeline can't stall; such items are counted as oversize.
+
+    Args:
+        max_bytes : the budget
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0
+        self.waiting = 0
+        self.waits = 0
+        self.oversize = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        """ Take size bytes of the budget, waiting until they are available """
+        with self._cond:
+            if self.used > 0 and self.used + size > self.max_bytes:
+                self.waits += 1
+                self.waiting += 1
+                try:
+                    while self.used > 0 and self.used + size > self.max_bytes:
+                        self._cond.wait()
+                finally:
+                    self.waiting -= 1
+            if size > self.max_bytes:
+                self.oversize += 1
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    def charge(self, size):
+        """
+        Take size bytes of the budget without waiting, for memory the caller
+        already holds and releases itself. Producers wait until it is released.
+        """
+        with self._cond:
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    def release(self, size):
+        """ Give back size bytes of the budget """
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {"max_bytes":self.max_bytes, "used":self.used, "peak":self.peak, "waits":self.waits,
+                    "oversize":self.oversize}
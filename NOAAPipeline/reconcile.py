@@ -0,0 +1,161 @@
+#####
+#
+# Reconciliation of keyed tables against the snapshot of the last push
+#
+#####
+import datetime
+import logging
+import sqlite3
+import threading
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def row_hashes(frame, key, columns=None):
+    """
+    One hash per row, computed for the whole frame at once
+
+    Values are compared as text, so a column read as a number one time and
+    as a string the next (e.g. a Zip of 20910 and "20910") hashes the same.
+
+    Args:
+        frame : the rows
+        key : column identifying a row, e.g. "Property ID"
+        columns : columns whose changes count, all but key by default
+
+    Returns:
+        Series : hex digests indexed by key
+    """
+    if columns is None:
+        columns = [c for c in frame.columns if c != key]
+    text = frame[sorted(columns)].astype(object).where(frame[sorted(columns)].notna(), "").astype(str)
+    hashes = pd.util.hash_pandas_object(text, index=False).map("{0:016x}".format)
+    hashes.index = frame[key].astype(str).str.strip().values
+    return hashes
+
+
+class Delta(object):
+    """
+    The difference between a table and its snapshot
+
+    Attributes:
+        added : rows whose key is not in the snapshot
+        changed : rows whose key is in the snapshot with another hash
+        removed : keys in the snapshot but not in the table
+        duplicates : rows repeating another row exactly, left out
+        conflicts : rows sharing a key with different values, all left out
+        unchanged : number of rows matching the snapshot
+        hashes : Series of the hashes of added and changed rows, by key
+    """
+    def __init__(self, added, changed, removed, duplicates, conflicts, unchanged, hashes):
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+        self.duplicates = duplicates
+        self.conflicts = conflicts
+        self.unchanged = unchanged
+        self.hashes = hashes
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    def upserts(self):
+        """ Added and changed rows, in table order """
+        return pd.concat([self.added, self.changed]).sort_index(kind="stable").reset_index(drop=True)
+
+    def summary(self):
+        return {"added":len(self.added), "changed":len(self.changed), "removed":len(self.removed),
+                "duplicates":len(self.duplicates), "conflicts":len(self.conflicts), "unchanged":self.unchanged}
+
+
+class Reconciler(object):
+    """
+    Keeps a snapshot of row hashes for keyed tables pushed to Socrata, so a
+    later run finds the added, changed and removed rows with indexed joins
+    and pushes only those.
+
+    Args:
+        path : SQLite database file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS snapshots (name TEXT, key TEXT, hash TEXT, updated TEXT, "
+                               "PRIMARY KEY (name, key))")
+
+    def snapshot(self, name):
+        """ Series of the hashes last committed for a table, by key """
+        with self._lock:
+            rows = self._conn.execute("SELECT key, hash FROM snapshots WHERE name = ?", (name,)).fetchall()
+        return pd.Series(dict(rows), dtype=object)
+
+    def diff(self, name, frame, key, columns=None):
+        """
+        Compare a table with its snapshot
+
+        Rows repeated exactly are true duplicates and are kept once. Rows that
+        share a key but differ can't be told apart, so they are reported as
+        conflicts and left out of the delta (and out of removed).
+
+        Args:
+            name : the snapshot, e.g. "rpmd"
+            frame : the table as it is now
+            key : column identifying a row
+            columns : columns whose changes count, all but key by default
+
+        Returns:
+            Delta
+        """
+        frame = frame.reset_index(drop=True)
+        hashes = row_hashes(frame, key, columns)
+        keys = pd.Series(hashes.index, index=frame.index)
+        exact = pd.Series(list(zip(hashes.index, hashes.values)), index=frame.index).duplicated()
+        duplicates = frame[exact.values]
+        frame, hashes, keys = frame[~exact.values], hashes[~exact.values], keys[~exact.values]
+        conflicted = keys.duplicated(keep=False).values
+        conflicts = frame[conflicted]
+        frame, hashes = frame[~conflicted], hashes[~conflicted]
+
+        previous = self.snapshot(name)
+        known = hashes.index.isin(previous.index)
+        added = frame[~known]
+        old = previous.reindex(hashes.index[known]).values
+        is_changed = pd.Series(False, index=frame.index)
+        is_changed[known] = hashes.values[known] != old
+        changed = frame[is_changed.values]
+        conflict_keys = set(conflicts[key].astype(str).str.strip())
+        removed = [k for k in previous.index.difference(hashes.index) if k not in conflict_keys]
+        delta = Delta(added, changed, removed, duplicates, conflicts, int(known.sum() - is_changed.sum()),
+                      hashes[(~known) | is_changed.values])
+        logger.info("{0}: {1}".format(name, delta.summary()))
+        return delta
+
+    def commit(self, name, delta, remove=True):
+        """
+        Record a delta in the snapshot, call once it has been pushed. Only
+        the added, changed and removed keys are written.
+
+        Args:
+            name : the snapshot
+            delta : Delta from diff
+            remove : drop the removed keys from the snapshot, False when the
+                removed rows were kept on the dataset
+        """
+        now = datetime.datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO snapshots (name, key, hash, updated) VALUES (?, ?, ?, ?)",
+                                   [(name, k, h, now) for k, h in delta.hashes.items()])
+            self._conn.executemany("DELETE FROM snapshots WHERE name = ? AND key = ?",
+                                   [(name, k) for k in delta.removed] if remove else [])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def deletions(keys, key):
+    """ Socrata upsert rows deleting keys from a dataset whose row identifier is key """
+    return pd.DataFrame({key:list(keys), ":deleted":True})
@@ -0,0 +1,196 @@
+#####
+#
+# Local snapshots of the Socrata reference datasets (table of contents, sites)
+#
+#####
+import datetime
+import io
+import json
+import logging
+import os
+import time
+import pandas as pd
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Columns always read as strings, so IDs keep their leading zeros
+ID_COLUMNS = {"PM ID":object, "Property ID":object}
+
+
+def view_metadata_url(domain, dataset):
+    """ Socrata view metadata, whose rowsUpdatedAt changes whenever the rows do """
+    return "{0}/api/views/{1}.json".format(domain, dataset)
+
+
+def row_identifier(metadata_url, session=None):
+    """
+    The column a Socrata dataset upserts on, read from its view metadata
+
+    Args:
+        metadata_url : the view's metadata, see view_metadata_url
+        session : requests.Session to use instead of a plain request
+
+    Returns:
+        String : the column's name, None when the dataset has no row identifier,
+            in which case upserts append rows and ":deleted" rows are ignored
+
+    Raises:
+        HTTPError : when the metadata can't be read
+    """
+    response = (session or requests).get(metadata_url)
+    response.raise_for_status()
+    view = response.json()
+    identifier = view.get("rowIdentifierColumnId", view.get("metadata", {}).get("rowIdentifier"))
+    if identifier is None:
+        return None
+    for column in view.get("columns", []):
+        # Given as the column's id, or by older views as its field name
+        if identifier in (column.get("id"), column.get("fieldName")):
+            return column.get("name")
+    return None
+
+
+def load_reference(cache, name, url, metadata_url=None, index=None, dtype=ID_COLUMNS):
+    """ ReferenceCache.load through cache, or a plain download when cache is None """
+    if cache is None:
+        frame = pd.read_csv(url, dtype=dtype)
+        return frame.set_index(index, drop=False) if index else frame
+    return cache.load(name, url, metadata_url, index, dtype)
+
+
+class ReferenceCache(object):
+    """
+    Keeps typed snapshots of Socrata datasets as uncompressed Feather files,
+    which read back without parsing CSV or inferring types, and only
+    downloads a dataset again when it has changed. Requires pyarrow.
+
+    Before a snapshot is used it is checked, in order, by its age (max_age),
+    by the view's rowsUpdatedAt when a metadata URL is given, and otherwise by
+    a conditional GET with the ETag/Last-Modified of the last download. If the
+    check fails the snapshot is used anyway, with a warning.
+
+    Args:
+        directory : where snapshots are kept, created if missing
+        max_age : seconds a snapshot is used without checking, 0 to always check
+        session : requests.Session to use instead of creating one
+    """
+    def __init__(self, directory, max_age=0, session=None):
+        try:
+            import pyarrow
+            import pyarrow.feather
+        except ImportError:
+            raise ImportError("ReferenceCache requires pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.feather = pyarrow.feather
+        self.directory = directory
+        self.max_age = max_age
+        self.session = session or requests.Session()
+        self.downloads = 0
+        self.hits = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def load(self, name, url, metadata_url=None, index=None, dtype=ID_COLUMNS):
+        """
+        A dataset from its snapshot, downloading it first if it changed
+
+        Args:
+            name : snapshot name, e.g. "table_of_contents"
+            url : the dataset's CSV export
+            metadata_url : the view's metadata, see view_metadata_url
+            index : column to index the frame on (the column is kept)
+            dtype : dtypes passed to read_csv for a download, ID_COLUMNS by default
+
+        Returns:
+            DataFrame
+
+        Raises:
+            HTTPError : when the download fails and there is no snapshot
+        """
+        meta = self._meta(name)
+        if meta is not None and (meta.get("url") != url or meta.get("dtype") != _dtype_key(dtype)):
+            # Written from another dataset or with other dtypes
+            meta = None
+        response = None
+        if meta is not None:
+            try:
+                unchanged, response = self._check(name, meta, metadata_url)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Could not check {0}, using the snapshot from {1}: {2}".format(name, meta["fetched"], e))
+                unchanged = True
+            if unchanged:
+                self.hits += 1
+                return self._read(name, index)
+
+        if response is None:
+            logger.info("Downloading {0}...".format(name))
+            response = self.session.get(url)
+        if response.status_code != requests.codes.ok:
+            return response.raise_for_status()
+        frame = pd.read_csv(io.BytesIO(response.content), dtype=dtype)
+        self.downloads += 1
+        self._write(name, frame, {
+            "url":url, "fetched":datetime.datetime.now().isoformat(), "checked":time.time(),
+            "etag":response.headers.get("ETag"), "last_modified":response.headers.get("Last-Modified"),
+            "rows_updated":self._rows_updated(metadata_url) if metadata_url else None, "rows":len(frame),
+            "dtype":_dtype_key(dtype)})
+        return self._read(name, index)
+
+    def _check(self, name, meta, metadata_url):
+        """ (whether the snapshot is current, the full response of a conditional GET that found it was not) """
+        if time.time() - meta["checked"] < self.max_age:
+            return True, None
+        response = None
+        if metadata_url and meta.get("rows_updated") is not None:
+            unchanged = self._rows_updated(metadata_url) == meta["rows_updated"]
+        elif meta.get("etag") or meta.get("last_modified"):
+            headers = {}
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            response = self.session.get(meta["url"], headers=headers)
+            unchanged = response.status_code == requests.codes.not_modified
+        else:
+            return False, None
+        if unchanged:
+            meta["checked"] = time.time()
+            self._write_meta(name, meta)
+            return True, None
+        return False, response
+
+    def _rows_updated(self, metadata_url):
+        response = self.session.get(metadata_url)
+        response.raise_for_status()
+        return response.json().get("rowsUpdatedAt")
+
+    def _path(self, name, ext):
+        return os.path.join(self.directory, name + ext)
+
+    def _meta(self, name):
+        if not (os.path.exists(self._path(name, ".json")) and os.path.exists(self._path(name, ".feather"))):
+            return None
+        with open(self._path(name, ".json")) as f:
+            return json.load(f)
+
+    def _read(self, name, index):
+        frame = self.feather.read_table(self._path(name, ".feather")).to_pandas()
+        return frame.set_index(index, drop=False) if index else frame
+
+    def _write(self, name, frame, meta):
+        tmp = self._path(name, ".feather.tmp")
+        table = self.pa.Table.from_pandas(frame, preserve_index=False)
+        self.feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, self._path(name, ".feather"))
+        self._write_meta(name, meta)
+
+    def _write_meta(self, name, meta):
+        tmp = self._path(name, ".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(name, ".json"))
+
+
+def _dtype_key(dtype):
+    return repr(sorted((k, str(v)) for k, v in dtype.items())) if dtype else None
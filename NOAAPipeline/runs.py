@@ -0,0 +1,317 @@
+#####
+#
+# Run orchestration: sharding, checkpoints and merging shard outputs
+#
+#####
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+import pandas as pd
+from .sinks import CSVSink, ParquetSink, SocrataSink
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(text):
+    """
+    Parse a "--shard i/n" option
+
+    Args:
+        text : "i/n" where n is the number of shards and i, from 0 to n - 1, is this shard
+
+    Returns:
+        Tuple : (i, n)
+
+    Raises:
+        ValueError : when the text is not a valid shard
+    """
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError("Shard must look like i/n, e.g. 0/4, not {0!r}".format(text))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Shard index must be between 0 and {0}, not {1}".format(count - 1, index))
+    return index, count
+
+
+def shard_of(pm_id, count):
+    """ Shard a property belongs to, the same on every machine and Python version """
+    return zlib.crc32(str(pm_id).strip().encode("utf-8")) % count
+
+
+def in_shard(pm_id, shard):
+    """ Whether a property belongs to shard (i, n), every property does when shard is None """
+    return shard is None or shard_of(pm_id, shard[1]) == shard[0]
+
+
+def shard_path(path, shard):
+    """ File name for one shard, e.g. output.csv -> output.shard-0-of-4.csv, unchanged when shard is None """
+    if shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return "{0}.shard-{1}-of-{2}{3}".format(root, shard[0], shard[1], ext)
+
+
+def make_sink(settings, path, dataset=None, shard=None, append=False):
+    """
+    The sink a script writes to: Socrata when the settings have Socrata
+    credentials and a dataset is given, otherwise the shard's output file
+
+    Args:
+        settings : the .settings.json dictionary
+        path : output file, Parquet when it ends in .parquet, CSV otherwise
+        dataset : Socrata dataset id to upsert to, e.g. settings["EnergyStarCostUsageDataset"]
+        shard : (i, n) to write shard i's file, see shard_path
+        append : keep the rows of an existing file, e.g. when resuming a run
+
+    Returns:
+        Sink
+    """
+    chunk_size = settings.get("ChunkSize", 5000)
+    if settings.get("Socrata_Username") is not None and dataset:
+        domain = settings.get("SocrataDomain", "https://noaa-ocao.data.socrata.com")
+        return SocrataSink("{0}/resource/{1}.json".format(domain, dataset),
+                           (settings["Socrata_Username"], settings.get("Socrata_Password")), chunk_size=chunk_size)
+    path = shard_path(path, shard)
+    if path.endswith(".parquet"):
+        return ParquetSink(path, append=append)
+    return CSVSink(path, chunk_size=chunk_size, append=append)
+
+
+class Checkpoint(object):
+    """
+    Durable record of a run's progress: the properties and meters whose rows
+    have reached the sink, and the reads that failed. An interrupted run, or
+    one with failures, can be resumed from it, skipping what was already
+    written and retrying the rest.
+
+    Args:
+        path : SQLite database file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, shard TEXT, "
+                               "since TEXT, started TEXT, finished TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS properties (run_id INTEGER, pm_id TEXT, meters INTEGER, "
+                               "entries INTEGER, finished TEXT, PRIMARY KEY (run_id, pm_id))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meters (run_id INTEGER, meter_id INTEGER, pm_id TEXT, "
+                               "entries INTEGER, PRIMARY KEY (run_id, meter_id))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS failures (run_id INTEGER, pm_id TEXT, meter_id INTEGER, "
+                               "error TEXT, failed TEXT)")
+
+    def begin(self, shard, since=None):
+        """
+        Start recording a new run
+
+        Args:
+            shard : (i, n) or None
+            since : datetime a back-fill requests consumption from, None for a
+                normal incremental run
+
+        Returns:
+            Integer : the run id
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute("INSERT INTO runs (shard, since, started) VALUES (?, ?, ?)",
+                                        (_shard_key(shard), since.strftime("%Y-%m-%d") if since else None,
+                                         datetime.datetime.now().isoformat()))
+        self.run_id = cursor.lastrowid
+        return self.run_id
+
+    def resume(self, shard):
+        """
+        Continue the latest unfinished run of a shard
+
+        Args:
+            shard : (i, n) or None
+
+        Returns:
+            Tuple : (True, since) where since is the back-fill date given to
+                begin(), (False, None) when there is no unfinished run
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT run_id, since FROM runs WHERE shard = ? AND finished IS NULL "
+                                     "ORDER BY run_id DESC LIMIT 1", (_shard_key(shard),)).fetchone()
+        if row is None:
+            return False, None
+        self.run_id = row[0]
+        return True, datetime.datetime.strptime(row[1], "%Y-%m-%d") if row[1] else None
+
+    def done_properties(self):
+        """ PM IDs of the properties finished in this run """
+        with self._lock:
+            return set(r[0] for r in self._conn.execute("SELECT pm_id FROM properties WHERE run_id = ?",
+                                                         (self.run_id,)))
+
+    def done_meters(self):
+        """ Ids of the meters finished in this run """
+        with self._lock:
+            return set(r[0] for r in self._conn.execute("SELECT meter_id FROM meters WHERE run_id = ?",
+                                                         (self.run_id,)))
+
+    def record(self, properties, unfinished=()):
+        """
+        Mark properties and their meters as done, call once their rows have
+        been flushed to the sink
+
+        Args:
+            properties : {PM ID: [(meter id, consumption entries synced), ...]}
+            unfinished : PM IDs whose meter list or some meter failed, only
+                their listed meters are marked done so a resume retries the rest
+        """
+        now = datetime.datetime.now().isoformat()
+        unfinished = set(str(pm_id) for pm_id in unfinished)
+        finished = [str(pm_id) for pm_id in properties if str(pm_id) not in unfinished]
+        meters = [(int(meter_id), str(pm_id), entries) for pm_id, done in properties.items() for meter_id, entries in done]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO meters (run_id, meter_id, pm_id, entries) "
+                                   "VALUES (?, ?, ?, ?)", [(self.run_id,) + meter for meter in meters])
+            # Counted from the meters table, a resumed property has meters from earlier attempts
+            self._conn.executemany("INSERT OR REPLACE INTO properties (run_id, pm_id, meters, entries, finished) "
+                                   "SELECT ?, ?, COUNT(*), COALESCE(SUM(entries), 0), ? FROM meters "
+                                   "WHERE run_id = ? AND pm_id = ?",
+                                   [(self.run_id, pm_id, now, self.run_id, pm_id) for pm_id in finished])
+            self._conn.executemany("DELETE FROM failures WHERE run_id = ? AND meter_id = ?",
+                                   [(self.run_id, meter_id) for meter_id, _, _ in meters])
+            self._conn.executemany("DELETE FROM failures WHERE run_id = ? AND pm_id = ?",
+                                   [(self.run_id, pm_id) for pm_id in finished])
+
+    def fail(self, pm_id, meter_id=None, error=None):
+        """
+        Note a read that failed, it is retried by --resume
+
+        Args:
+            pm_id : the property
+            meter_id : the meter, None when the property's meter list failed
+            error : what went wrong
+        """
+        meter_id = int(meter_id) if meter_id is not None else None
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM failures WHERE run_id = ? AND pm_id = ? AND meter_id IS ?",
+                               (self.run_id, str(pm_id), meter_id))
+            self._conn.execute("INSERT INTO failures (run_id, pm_id, meter_id, error, failed) VALUES (?, ?, ?, ?, ?)",
+                               (self.run_id, str(pm_id), meter_id, error, datetime.datetime.now().isoformat()))
+
+    def failures(self):
+        """ [(PM ID, meter id or None, error), ...] of the reads still failed in this run """
+        with self._lock:
+            return self._conn.execute("SELECT pm_id, meter_id, error FROM failures WHERE run_id = ? "
+                                      "ORDER BY pm_id, meter_id", (self.run_id,)).fetchall()
+
+    def finish(self):
+        """ Mark the run complete, it will not be resumed. Only call when nothing failed. """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?",
+                               (datetime.datetime.now().isoformat(), self.run_id))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _shard_key(shard):
+    return "all" if shard is None else "{0}/{1}".format(*shard)
+
+
+def read_output(path):
+    """ Rows of a CSV or Parquet output file, as strings for CSV """
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if os.path.getsize(path) == 0:
+        # Written by a run that had no rows
+        return pd.DataFrame()
+    return pd.read_csv(path, dtype=object, keep_default_na=False)
+
+
+def iter_output(path, chunk_size=50000, columns=None):
+    """
+    Rows of a CSV or Parquet output file in chunks, read like read_output
+
+    Args:
+        path : the file
+        chunk_size : rows per chunk
+        columns : only read these columns, None for all
+
+    Yields:
+        DataFrame : up to chunk_size rows
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+        return
+    if os.path.getsize(path) == 0:
+        return
+    for chunk in pd.read_csv(path, dtype=object, keep_default_na=False, usecols=columns, chunksize=chunk_size):
+        yield chunk
+
+
+def output_columns(path):
+    """ Column names of a CSV or Parquet output file, without reading its rows """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(path).names)
+    if os.path.getsize(path) == 0:
+        return []
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def merge_outputs(paths, output, key="ROWID", chunk_size=50000):
+    """
+    Combine the output files of several shards (or of a resumed run) into one
+
+    Rows are de-duplicated on key, keeping the last, so rows written again
+    after a resume appear once. Columns missing from some inputs are
+    missing values in the merged file, and rows without a key (or from an
+    input without the key column) are all kept.
+
+    The inputs are streamed in chunks: a first pass reads only the key column
+    to find the last row of each key, a second pass writes those rows. Memory
+    therefore grows with the number of keys, not with the size of the files.
+
+    Args:
+        paths : CSV or Parquet files written by the sinks
+        output : merged file, Parquet when it ends in .parquet, CSV otherwise
+        key : column identifying a row
+        chunk_size : rows per chunk read from the inputs and written to output
+
+    Returns:
+        Integer : rows in the merged file
+    """
+    names = [output_columns(path) for path in paths]
+    columns = list(dict.fromkeys(c for file_columns in names for c in file_columns))
+
+    # The (input, row) that each key was last written at
+    last = {}
+    for i, path in enumerate(paths):
+        if key not in names[i]:
+            continue
+        position = 0
+        for chunk in iter_output(path, chunk_size, columns=[key]):
+            last.update(((k, (i, position + n)) for n, k in enumerate(chunk[key]) if not pd.isna(k)))
+            position += len(chunk)
+
+    # Written beside the output and moved over it at the end, the output may be one of the inputs
+    root, ext = os.path.splitext(output)
+    tmp = root + ".merging" + ext
+    sink = ParquetSink(tmp, chunk_size) if output.endswith(".parquet") else CSVSink(tmp, chunk_size)
+    with sink:
+        for i, path in enumerate(paths):
+            position = 0
+            for chunk in iter_output(path, chunk_size):
+                rows = len(chunk)
+                if key in names[i]:
+                    chunk = chunk[[pd.isna(k) or last[k] == (i, position + n) for n, k in enumerate(chunk[key])]]
+                position += rows
+                # Every chunk has every column, so the output is never rewritten to widen it
+                sink.write(chunk.reindex(columns=columns))
+    os.replace(tmp, output)
+    logger.info("Merged {0} file(s) into {1} row(s) in {2}".format(len(paths), sink.rows_written, output))
+    return sink.rows_written
@@ -0,0 +1,280 @@
+#####
+#
+# Output sinks for the sync: Socrata upserts, CSV and Parquet files
+#
+#####
+import csv
+import gzip
+import logging
+import os
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying an upsert on
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class Sink(object):
+    """
+    Buffers rows across writes and hands them on in chunks of at most
+    chunk_size rows, so the number of uploads depends on the rows written
+    rather than on how many meters they came from.
+
+    Subclasses implement _write_chunk. Use as a context manager, or call
+    close() to flush what is left in the buffer.
+
+    Args:
+        chunk_size : maximum rows per chunk
+    """
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self.rows_written = 0
+        self.chunks_written = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, frame):
+        """
+        Add rows to the sink, flushing full chunks
+
+        Args:
+            frame : DataFrame of rows
+        """
+        if len(frame) == 0:
+            return
+        self._buffer.append(frame)
+        self._buffered += len(frame)
+        if self._buffered >= self.chunk_size:
+            self._drain(final=False)
+
+    def flush(self):
+        """ Write every buffered row """
+        self._drain(final=True)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _drain(self, final):
+        if not self._buffer:
+            return
+        rows = pd.concat(self._buffer, ignore_index=True, sort=False) if len(self._buffer) > 1 else self._buffer[0]
+        self._buffer, self._buffered = [], 0
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows.iloc[start:start + self.chunk_size]
+            if len(chunk) < self.chunk_size and not final:
+                # Keep the remainder for the next write
+                self._buffer, self._buffered = [chunk], len(chunk)
+                break
+            self._write_chunk(chunk)
+            self.rows_written += len(chunk)
+            self.chunks_written += 1
+
+    def _write_chunk(self, chunk):
+        raise NotImplementedError
+
+
+class SocrataSink(Sink):
+    """
+    Upserts rows to a Socrata dataset over one pooled session, gzip
+    compressing request bodies and retrying transient failures.
+
+    Args:
+        url : the dataset's resource endpoint, e.g. https://domain/resource/abcd-1234.json
+        auth : (username, password)
+        chunk_size : maximum rows per upsert
+        retries : retries for connection errors and TRANSIENT_STATUSES
+        backoff : backoff factor between retries, in seconds
+        compress : gzip request bodies
+        session : requests.Session to use instead of creating one
+        replace : PUT the first chunk, replacing every row of the dataset, and
+            upsert the rest after it
+    """
+    def __init__(self, url, auth, chunk_size=5000, retries=5, backoff=1.0, compress=True, session=None,
+                 replace=False):
+        super(SocrataSink, self).__init__(chunk_size)
+        self.url = url
+        self.compress = compress
+        self.replace = replace
+        self.results = []
+        self.session = session or requests.Session()
+        self.session.auth = auth
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=TRANSIENT_STATUSES,
+                      allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]), raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _write_chunk(self, chunk):
+        body = chunk.to_json(orient="records").encode("utf-8")
+        headers = {"Content-Type":"application/json"}
+        if self.compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        if self.replace and self.chunks_written == 0:
+            logger.info("Replacing the rows of {0} with {1} row(s)".format(self.url, len(chunk)))
+            response = self.session.put(self.url, data=body, headers=headers)
+        else:
+            logger.info("Upserting {0} row(s) to {1}".format(len(chunk), self.url))
+            response = self.session.post(self.url, data=body, headers=headers)
+        if response.status_code != requests.codes.ok:
+            return response.raise_for_status()
+        self.results.append(response.json())
+        logger.debug(response.text)
+
+
+class CSVSink(Sink):
+    """
+    Appends rows to one CSV file as they arrive.
+
+    The header is taken from the first chunk. If later rows bring new columns
+    (e.g. a meter type not seen before) the file is rewritten once with the
+    wider header.
+
+    Args:
+        path : output file
+        chunk_size : rows buffered before appending to the file
+        append : keep an existing file and add to it, e.g. when resuming a
+            run, rather than replacing it. A replaced file is overwritten by
+            the first chunk, or emptied on close when no rows were written.
+        **to_csv : extra arguments for DataFrame.to_csv, e.g. na_rep, quoting
+    """
+    def __init__(self, path, chunk_size=5000, append=False, **to_csv):
+        super(CSVSink, self).__init__(chunk_size)
+        self.path = path
+        self.append = append
+        self.to_csv = dict({"na_rep":"0", "quoting":csv.QUOTE_ALL}, **to_csv)
+        self.columns = None
+        if append and os.path.exists(path) and os.path.getsize(path):
+            self.columns = list(pd.read_csv(path, nrows=0).columns)
+
+    def _write_chunk(self, chunk):
+        if self.columns is None:
+            # Replaces the previous file, if any
+            self.columns = list(chunk.columns)
+            chunk.to_csv(self.path, index=False, **self.to_csv)
+            return
+        new_columns = [c for c in chunk.columns if c not in self.columns]
+        if new_columns:
+            self._widen(self.columns + new_columns)
+        chunk.reindex(columns=self.columns).to_csv(self.path, mode="a", header=False, index=False, **self.to_csv)
+
+    def _widen(self, columns):
+        logger.debug("Rewriting {0} with {1} column(s)".format(self.path, len(columns)))
+        tmp = self.path + ".tmp"
+        header = True
+        for part in pd.read_csv(self.path, dtype=object, keep_default_na=False, chunksize=self.chunk_size):
+            part.reindex(columns=columns).to_csv(tmp, mode="w" if header else "a", header=header, index=False,
+                                                 **self.to_csv)
+            header = False
+        os.replace(tmp, self.path)
+        self.columns = columns
+
+    def close(self):
+        super(CSVSink, self).close()
+        if self.columns is None and not self.append:
+            # Don't leave an earlier run's rows looking like this run's
+            logger.info("No rows written, emptying {0}".format(self.path))
+            open(self.path, "w").close()
+
+
+class ParquetSink(Sink):
+    """
+    Streams rows into one Parquet file, one row group per chunk.
+
+    The schema is taken from the first chunk. New columns, or columns whose
+    type changes between chunks, rewrite the file once with a wider schema
+    (conflicting types are stored as strings). Requires pyarrow.
+
+    Args:
+        path : output file
+        chunk_size : rows per row group
+        append : keep the rows of an existing file, e.g. when resuming a run,
+            rather than replacing it. The file is rewritten once to reopen it.
+            A replaced file is overwritten by the first chunk, or by a file
+            with no rows or columns on close when no rows were written.
+    """
+    def __init__(self, path, chunk_size=50000, append=False):
+        super(ParquetSink, self).__init__(chunk_size)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetSink requires pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.append = append
+        self.schema = None
+        self._writer = None
+        if append and os.path.exists(path):
+            # Parquet files cannot be reopened for writing, start a new one holding the old rows
+            existing = self.pq.read_table(path)
+            self.schema = existing.schema
+            self._writer = self.pq.ParquetWriter(path, self.schema)
+            self._writer.write_table(existing)
+
+    def _table(self, chunk):
+        table = self.pa.Table.from_pandas(chunk, preserve_index=False)
+        # All-missing columns have no type yet, store them as strings
+        fields = [self.pa.field(f.name, self.pa.string()) if self.pa.types.is_null(f.type) else f for f in table.schema]
+        return table.cast(self.pa.schema(fields))
+
+    def _unify(self, schema):
+        fields = dict((f.name, f) for f in self.schema)
+        names = list(self.schema.names) + [n for n in schema.names if n not in fields]
+        unified = []
+        for name in names:
+            old, new = fields.get(name), schema.field(name) if name in schema.names else None
+            if old is None or new is None or old.type == new.type:
+                unified.append(old or new)
+            else:
+                unified.append(self.pa.field(name, self.pa.string()))
+        return self.pa.schema(unified)
+
+    def _conform(self, table, schema):
+        columns = []
+        for field in schema:
+            if field.name in table.schema.names:
+                columns.append(table.column(field.name).cast(field.type))
+            else:
+                columns.append(self.pa.nulls(len(table), field.type))
+        return self.pa.Table.from_arrays(columns, schema=schema)
+
+    def _write_chunk(self, chunk):
+        table = self._table(chunk)
+        if self.schema is None:
+            self.schema = table.schema
+            self._writer = self.pq.ParquetWriter(self.path, self.schema)
+        else:
+            schema = self._unify(table.schema)
+            if not schema.equals(self.schema):
+                self._widen(schema)
+        self._writer.write_table(self._conform(table, self.schema))
+
+    def _widen(self, schema):
+        logger.debug("Rewriting {0} with {1} column(s)".format(self.path, len(schema)))
+        self._writer.close()
+        existing = self.pq.read_table(self.path)
+        self.schema = schema
+        self._writer = self.pq.ParquetWriter(self.path, schema)
+        self._writer.write_table(self._conform(existing, schema))
+
+    def close(self):
+        super(ParquetSink, self).close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        elif self.schema is None and not self.append:
+            logger.info("No rows written, emptying {0}".format(self.path))
+            self.pq.write_table(self.pa.table({}), self.path)
+            self.schema = self.pa.schema([])
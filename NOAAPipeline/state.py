@@ -0,0 +1,141 @@
+#####
+#
+# Incremental sync state: per-meter high-water marks and row hashes
+#
+#####
+import datetime
+import hashlib
+import sqlite3
+import threading
+import pandas as pd
+from collections import OrderedDict
+
+
+def row_id(date, meter_id):
+    """ The ROWID used on the Socrata dataset for a meter's month """
+    return "{0}{1}".format(date, meter_id)
+
+
+def _hash(rows):
+    data = repr(sorted(rows))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _date_strings(frame):
+    dates = frame["DATE"]
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        dates = dates.dt.strftime("%Y-%m-%d")
+    return dates
+
+
+def _rows_by_date(usage):
+    """ {"YYYY-MM-DD": [(date, usage, cost), ...]} from records or a consumption DataFrame """
+    if isinstance(usage, pd.DataFrame):
+        rows = zip(_date_strings(usage).tolist(), usage["USAGE"].tolist(), usage["COST"].tolist())
+    else:
+        rows = ((r["DATE"], r["USAGE"], r["COST"]) for r in usage)
+    by_date = OrderedDict()
+    for row in rows:
+        by_date.setdefault(row[0], []).append(row)
+    return by_date
+
+
+class SyncState(object):
+    """
+    Remembers, per meter, the latest consumption date synced and a hash of
+    every row sent so only new or changed rows are fetched and emitted.
+
+    Args:
+        path : SQLite database file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meters (meter_id INTEGER PRIMARY KEY, high_water TEXT, hash TEXT, updated TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows (rowid_key TEXT PRIMARY KEY, meter_id INTEGER, hash TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS rows_meter ON rows (meter_id)")
+
+    def high_water(self, meter_id):
+        """
+        Latest endDate/deliveryDate synced for a meter
+
+        Args:
+            meter_id : the meter id
+
+        Returns:
+            String : "YYYY-MM-DD" or None if the meter has never been synced
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT high_water FROM meters WHERE meter_id = ?", (int(meter_id),)).fetchone()
+        return row[0] if row else None
+
+    def start_for(self, meter_id, default):
+        """
+        Date to request consumption data from for a meter
+
+        The month of the high-water mark is requested again so a bill revised
+        after the last run is picked up.
+
+        Args:
+            meter_id : the meter id
+            default : datetime used for meters that have never been synced
+
+        Returns:
+            datetime : first day of the high-water month, or default
+        """
+        high_water = self.high_water(meter_id)
+        if high_water is None:
+            return default
+        date = datetime.datetime.strptime(high_water, "%Y-%m-%d")
+        return datetime.datetime(date.year, date.month, 1)
+
+    def changed(self, meter_id, usage):
+        """
+        Keep only the entries of months that are new or differ from the last sync
+
+        Args:
+            meter_id : the meter id
+            usage : array of dictionaries {"DATE":..., "USAGE":..., "COST":...}
+                as returned by get_usage_and_cost, or a DataFrame from get_consumption_frame
+
+        Returns:
+            The entries of new or changed months, in their original order and
+            of the same type as usage
+        """
+        by_date = _rows_by_date(usage)
+        with self._lock:
+            stored = dict(self._conn.execute("SELECT rowid_key, hash FROM rows WHERE meter_id = ?", (int(meter_id),)))
+        dates = set(date for date, rows in by_date.items() if stored.get(row_id(date, meter_id)) != _hash(rows))
+        if isinstance(usage, pd.DataFrame):
+            return usage[_date_strings(usage).isin(dates).values].reset_index(drop=True)
+        return [record for record in usage if record["DATE"] in dates]
+
+    def commit(self, meter_id, usage):
+        """
+        Record entries as synced, call once they have reached the sink
+
+        Args:
+            meter_id : the meter id
+            usage : the entries passed to the sink, records or a DataFrame
+        """
+        by_date = _rows_by_date(usage)
+        if not by_date:
+            return
+        rows = [(row_id(date, meter_id), int(meter_id), _hash(date_rows)) for date, date_rows in by_date.items()]
+        high_water = max(by_date)
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO rows (rowid_key, meter_id, hash) VALUES (?, ?, ?)", rows)
+            previous = self._conn.execute("SELECT high_water FROM meters WHERE meter_id = ?", (int(meter_id),)).fetchone()
+            if previous and previous[0] and previous[0] > high_water:
+                high_water = previous[0]
+            self._conn.execute("INSERT OR REPLACE INTO meters (meter_id, high_water, hash, updated) VALUES (?, ?, ?, ?)",
+                               (int(meter_id), high_water, _hash([r for date_rows in by_date.values() for r in date_rows]),
+                                datetime.datetime.now().isoformat()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
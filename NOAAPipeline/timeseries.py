@@ -0,0 +1,180 @@
+#####
+#
+# Local time-series store of synced usage and cost, partitioned Parquet
+#
+#####
+import logging
+import os
+from urllib.parse import quote, unquote
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Columns kept from the transformed rows, under the names they are stored as.
+# The per meter type columns are left out: each row is one meter, whose type
+# is a partition key, so TOTAL COST/TOTAL USAGE hold the same values.
+STORE_COLUMNS = [("ROWID", "ROWID"), ("DATE", "DATE"), ("Fiscal Period", "Fiscal Period"), ("PM ID", "PM ID"),
+                 ("PROPERTY", "PROPERTY"), ("PROPERTY ID", "PROPERTY ID"), ("METER ID", "METER ID"),
+                 ("TOTAL USAGE", "USAGE"), ("TOTAL COST", "COST")]
+
+# Partition keys, in directory order
+PARTITIONS = ("FY", "METER TYPE")
+
+
+class TimeSeriesStore(object):
+    """
+    Usage and cost rows kept as Parquet files partitioned by FY and meter
+    type, e.g. root/FY=2017/METER TYPE=Natural%20Gas/part.parquet. Rows are
+    upserted on ROWID, and queries read only the partitions and columns they
+    need through memory maps. Requires pyarrow.
+
+    Args:
+        root : directory of the store, created if missing
+    """
+    def __init__(self, root):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("TimeSeriesStore requires pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def partitions(self):
+        """ [(FY, meter type), ...] of every partition in the store, sorted """
+        found = []
+        for fy_dir in os.listdir(self.root):
+            if not fy_dir.startswith("FY="):
+                continue
+            for type_dir in os.listdir(os.path.join(self.root, fy_dir)):
+                if type_dir.startswith("METER TYPE=") and os.path.exists(self._file(fy_dir, type_dir)):
+                    found.append((unquote(fy_dir[3:]), unquote(type_dir[len("METER TYPE="):])))
+        return sorted(found)
+
+    def upsert(self, rows):
+        """
+        Add or replace rows, matched on ROWID
+
+        A ROWID already stored in another partition (e.g. a meter whose type
+        changed) is moved to the partition of the new row.
+
+        Args:
+            rows : DataFrame from transform
+
+        Returns:
+            Integer : rows written
+        """
+        if len(rows) == 0:
+            return 0
+        frame = pd.DataFrame(dict((name, rows[column].values) for column, name in STORE_COLUMNS))
+        frame["DATE"] = pd.to_datetime(frame["DATE"])
+        frame["USAGE"] = pd.to_numeric(frame["USAGE"])
+        frame["COST"] = pd.to_numeric(frame["COST"])
+        frame["METER ID"] = frame["METER ID"].astype("int64")
+        for column in ("ROWID", "Fiscal Period", "PM ID", "PROPERTY", "PROPERTY ID"):
+            frame[column] = frame[column].astype(str)
+        keys = pd.DataFrame({"FY":rows["FY"].astype(str).values, "METER TYPE":rows["METER TYPE"].astype(str).values})
+
+        for (fy, meter_type), index in keys.groupby(["FY", "METER TYPE"], sort=True).groups.items():
+            part = frame.iloc[index]
+            self._remove_elsewhere(fy, meter_type, set(part["ROWID"]))
+            path = self._partition_file(fy, meter_type)
+            if os.path.exists(path):
+                existing = self.pq.read_table(path).to_pandas()
+                part = pd.concat([existing, part], ignore_index=True)
+            part = part.drop_duplicates("ROWID", keep="last").sort_values(["METER ID", "DATE"], kind="stable")
+            self._write(path, part)
+        logger.debug("Upserted {0} row(s) into {1}".format(len(frame), self.root))
+        return len(frame)
+
+    def read(self, columns=None, fy=None, meter_types=None, property_ids=None):
+        """
+        Read rows from the partitions that match
+
+        Args:
+            columns : stored columns to read (see STORE_COLUMNS), None for all
+            fy : FY or list of FYs, None for all
+            meter_types : meter type or list of meter types, None for all
+            property_ids : keep only these PM IDs
+
+        Returns:
+            DataFrame : the columns plus FY and METER TYPE
+        """
+        fys = _as_set(fy)
+        types = _as_set(meter_types)
+        if columns is not None:
+            columns = list(columns)
+            if property_ids is not None and "PM ID" not in columns:
+                columns.append("PM ID")
+        frames = []
+        for part_fy, meter_type in self.partitions():
+            if (fys and part_fy not in fys) or (types and meter_type not in types):
+                continue
+            path = self._partition_file(part_fy, meter_type)
+            filters = [("PM ID", "in", [str(p) for p in property_ids])] if property_ids is not None else None
+            table = self.pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+            frame = table.to_pandas()
+            frame["FY"] = part_fy
+            frame["METER TYPE"] = meter_type
+            frames.append(frame)
+        if not frames:
+            names = columns if columns is not None else [name for _, name in STORE_COLUMNS]
+            return pd.DataFrame(columns=names + list(PARTITIONS))
+        return pd.concat(frames, ignore_index=True)
+
+    def monthly(self, fy, value="USAGE", by="PM ID", meter_types=None):
+        """
+        One row per property (or other column) and one column per fiscal period
+
+        e.g. store.monthly("2017") is usage by property and month for FY 2017
+
+        Args:
+            fy : the FY
+            value : "USAGE" or "COST"
+            by : column to group rows on, e.g. "PM ID" or "METER TYPE"
+            meter_types : meter type or list of meter types, None for all
+
+        Returns:
+            DataFrame : sum of value, indexed by `by`, columns are fiscal periods
+        """
+        frame = self.read(columns=[by, "Fiscal Period", value] if by not in PARTITIONS else ["Fiscal Period", value],
+                          fy=fy, meter_types=meter_types)
+        return frame.pivot_table(index=by, columns="Fiscal Period", values=value, aggfunc="sum", observed=True)
+
+    def _file(self, fy_dir, type_dir):
+        return os.path.join(self.root, fy_dir, type_dir, "part.parquet")
+
+    def _partition_file(self, fy, meter_type):
+        # Meter types can hold "/", e.g. "Municipally Supplied Potable Water - Mixed Indoor/Outdoor"
+        return self._file("FY=" + quote(fy, safe=""), "METER TYPE=" + quote(meter_type, safe=""))
+
+    def _write(self, path, frame):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = path + ".tmp"
+        self.pq.write_table(self.pa.Table.from_pandas(frame, preserve_index=False), tmp)
+        os.replace(tmp, path)
+
+    def _remove_elsewhere(self, fy, meter_type, rowids):
+        # Only partitions of the same FY can hold the same ROWID, the date is part of it
+        for part_fy, other_type in self.partitions():
+            if part_fy != fy or other_type == meter_type:
+                continue
+            path = self._partition_file(part_fy, other_type)
+            stored = self.pq.read_table(path, columns=["ROWID"], memory_map=True).column("ROWID").to_pylist()
+            if rowids.isdisjoint(stored):
+                continue
+            existing = self.pq.read_table(path).to_pandas()
+            self._write(path, existing[~existing["ROWID"].isin(rowids)])
+
+
+def _as_set(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set)):
+        return set(str(v) for v in value)
+    return {str(value)}
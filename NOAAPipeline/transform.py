@@ -0,0 +1,159 @@
+#####
+#
+# Whole-portfolio transform of meter consumption into the Socrata row layout
+#
+#####
+import numpy as np
+import pandas as pd
+
+# Columns describing which property and meter a consumption entry belongs to
+JOB_COLUMNS = ["PM ID", "PROPERTY", "PROPERTY ID", "METER ID", "METER TYPE"]
+ROW_KEYS = ["DATE", "PM ID", "PROPERTY", "PROPERTY ID"]
+
+
+def consumption_table(batches):
+    """
+    Stack the consumption of many meters into one long table
+
+    Args:
+        batches : iterable of (property row, (meter id, meter type), consumption)
+            where consumption is a DataFrame from get_consumption_frame or an
+            array of dictionaries from get_usage_and_cost
+
+    Returns:
+        DataFrame : DATE, USAGE, COST, the JOB_COLUMNS and JOB, the position of
+            the (property, meter) pair in batches. Meters without data are left out.
+    """
+    frames, jobs = [], []
+    for row, meter, consumption in batches:
+        frame = consumption if isinstance(consumption, pd.DataFrame) else pd.DataFrame(consumption)
+        if len(frame) == 0:
+            continue
+        frames.append(frame[["DATE", "USAGE", "COST"]])
+        jobs.append((row["PM ID"], row["Property Name"], row["Property ID"], meter[0], meter[1], len(frame)))
+
+    if not frames:
+        return pd.DataFrame(columns=["DATE", "USAGE", "COST"] + JOB_COLUMNS + ["JOB"])
+
+    data = pd.concat(frames, ignore_index=True)
+    jobs = pd.DataFrame(jobs, columns=JOB_COLUMNS + ["ROWS"])
+    codes = np.repeat(np.arange(len(jobs)), jobs["ROWS"].values)
+    for column in JOB_COLUMNS:
+        data[column] = jobs[column].values[codes]
+    data["JOB"] = codes
+    return data
+
+
+def index_sites(sites):
+    """
+    Index the site lookup table by Property ID for the join in transform
+
+    Args:
+        sites : the All_Properties site table
+
+    Returns:
+        DataFrame : sites indexed by Property ID, keeping the Property ID column
+    """
+    return sites.set_index("Property ID", drop=False)
+
+
+def transform(data, sites):
+    """
+    Build the Socrata rows for every meter in one pass
+
+    Produces the same rows as pivoting, merging and joining each meter on its
+    own: entries are averaged per meter and date, the cost and usage of each
+    meter type get their own "<type>_cost"/"<type>_usage" columns alongside
+    TOTAL COST/TOTAL USAGE, and the site information is joined on Property ID.
+
+    Args:
+        data : long consumption table from consumption_table
+        sites : site lookup table, ideally already passed through index_sites
+
+    Returns:
+        DataFrame : one row per meter and date, ordered by meter then date
+    """
+    if sites.index.name != "Property ID":
+        sites = index_sites(sites)
+    if len(data) == 0:
+        columns = ROW_KEYS + ["TOTAL COST", "TOTAL USAGE", "METER TYPE", "METER ID", "FY", "Fiscal Period", "ROWID"]
+        return pd.DataFrame(columns=columns + list(sites.columns) + ["GHG"])
+    data = data.copy()
+    if pd.api.types.is_datetime64_any_dtype(data["DATE"]):
+        data["DATE"] = data["DATE"].dt.strftime("%Y-%m-%d")
+
+    # One aggregation and one pivot for the whole portfolio
+    grouped = data.groupby(["JOB"] + ROW_KEYS + ["METER ID", "METER TYPE"], observed=True)[["COST", "USAGE"]].mean()
+    wide = grouped.unstack("METER TYPE")
+    meter_types = list(dict.fromkeys(grouped.index.get_level_values("METER TYPE")))
+    cost = wide["COST"][meter_types].add_suffix("_cost")
+    usage = wide["USAGE"][meter_types].add_suffix("_usage")
+
+    out = pd.concat([cost, usage], axis=1).reset_index()
+    totals = grouped.reset_index()
+    out = out.merge(totals, on=["JOB"] + ROW_KEYS + ["METER ID"], how="inner")
+    out = out.rename(columns={"COST":"TOTAL COST", "USAGE":"TOTAL USAGE"})
+    out = out.sort_values(["JOB", "DATE"], kind="stable")
+
+    out["FY"] = out["DATE"].str[0:4]
+    out["Fiscal Period"] = out["DATE"].str[5:7]
+    out["ROWID"] = out["DATE"] + out["METER ID"].astype(str)
+    columns = (ROW_KEYS + list(cost.columns) + ["TOTAL COST"] + list(usage.columns) + ["TOTAL USAGE"]
+               + ["METER TYPE", "METER ID", "FY", "Fiscal Period", "ROWID"])
+    out = out[columns]
+
+    # Join the site information once for every meter
+    full = out.merge(sites, left_on="PROPERTY ID", right_index=True, how="inner")
+    full["GHG"] = ""
+    return full.reset_index(drop=True)
+
+
+def metric_table(records, columns):
+    """
+    One row per property and month of Portfolio Manager metrics
+
+    Args:
+        records : array of dictionaries from get_metrics
+        columns : {output column: Portfolio Manager metric},
+            e.g. {"GHG":"totalGHGEmissions", "SCORE":"score"}
+
+    Returns:
+        DataFrame : PM ID, MONTH ("YYYY-MM") and one column per output column
+    """
+    names = list(columns)
+    if not records:
+        return pd.DataFrame(columns=["PM ID", "MONTH"] + names)
+    frame = pd.DataFrame.from_records(records)
+    out = pd.DataFrame({"PM ID":frame["PM ID"].astype(str).values, "MONTH":frame["K"].values})
+    for name, metric in columns.items():
+        out[name] = frame[metric].values if metric in frame.columns else None
+    return out
+
+
+def join_metrics(rows, metrics):
+    """
+    Add the metric columns to transformed rows, matched on PM ID and month
+
+    Every row of a property gets the property's metrics for the month of its
+    DATE, so all meters of a property carry the same values. Months without a
+    metric are left blank, like the GHG placeholder of transform.
+
+    Args:
+        rows : DataFrame from transform
+        metrics : DataFrame from metric_table
+
+    Returns:
+        DataFrame : rows, in the same order, with one column per metric
+    """
+    names = [c for c in metrics.columns if c not in ("PM ID", "MONTH")]
+    rows = rows.copy()
+    if len(rows) == 0:
+        for name in names:
+            rows[name] = pd.Series(dtype=object)
+        return rows
+    keys = pd.DataFrame({"PM ID":rows["PM ID"].astype(str).values, "MONTH":rows["DATE"].astype(str).str[0:7].values})
+    # A left merge keeps the order of rows, one lookup for the whole frame
+    joined = keys.merge(metrics.drop_duplicates(["PM ID", "MONTH"], keep="last"), on=["PM ID", "MONTH"], how="left")
+    for name in names:
+        rows[name] = joined[name].astype(object).where(joined[name].notna(), "").values
+    return rows
@@ -1,10 +1,18 @@
-from EnergyStarAPI import EnergyStarClient
+from EnergyStarAPI import EnergyStarClient, ConcurrentFetcher, SQLiteCache, ResponseCache
+from NOAAPipeline import SyncState, consumption_table, index_sites, transform
+from NOAAPipeline import metric_table, join_metrics, MemoryBudget, Stage
+from NOAAPipeline import Checkpoint, in_shard, make_sink, merge_outputs, parse_shard, shard_path
+from NOAAPipeline import ReferenceCache, load_reference, view_metadata_url, TimeSeriesStore, AggregateCube
+from collections import OrderedDict
+import argparse
 import pandas as pd
 import datetime
 from dateutil.relativedelta import *
 import requests
+import urllib3
 import logging
 import json
+import os
 import xml.etree.ElementTree as Et
 with open(".settings.json", 'r') as f:
     settings = json.load(f)
@@ -13,96 +21,416 @@ with open(".settings.json", 'r') as f:
     socrata_username = settings["Socrata_Username"]#SOCRATA USERNAME
     socrata_password = settings["Socrata_Password"]#SOCRATA PASSWORD
 
-    socrata_dataset = "https://noaa-ocao.data.socrata.com/resource/{0}.json".format(settings["EnergyStarCostUsageDataset"])
-    table_of_contents = "https://noaa-ocao.data.socrata.com/api/views/{0}/rows.csv?accessType=DOWNLOAD".format(settings["Table_of_Contents"])
-    all_properties = "https://noaa-ocao.data.socrata.com/api/views/{0}/rows.csv?accessType=DOWNLOAD".format(settings["All_Properties"])
+    energystar_domain = settings.get("EnergyStarDomain", "https://portfoliomanager.energystar.gov/ws")
+    socrata_domain = settings.get("SocrataDomain", "https://noaa-ocao.data.socrata.com")
 
-client = EnergyStarClient(username, password, logging_level=logging.INFO)
+    usage_dataset = settings["EnergyStarCostUsageDataset"]#SOCRATA DATASET THE ROWS ARE UPSERTED TO
+    table_of_contents = "{0}/api/views/{1}/rows.csv?accessType=DOWNLOAD".format(socrata_domain, settings["Table_of_Contents"])
+    all_properties = "{0}/api/views/{1}/rows.csv?accessType=DOWNLOAD".format(socrata_domain, settings["All_Properties"])
+    table_of_contents_view = view_metadata_url(socrata_domain, settings["Table_of_Contents"])
+    all_properties_view = view_metadata_url(socrata_domain, settings["All_Properties"])
+    workers = settings.get("Workers", 8)#CONCURRENT REQUESTS
+    max_per_host = settings.get("MaxRequestsPerHost", workers)#CAP ON REQUESTS TO PORTFOLIO MANAGER
+    concurrency = settings.get("InitialConcurrency")#REQUESTS IN FLIGHT TO START FROM, GROWS UP TO MaxRequestsPerHost
+    rate_limit = settings.get("RateLimit")#MAXIMUM PORTFOLIO MANAGER REQUESTS PER SECOND
+    max_retries = settings.get("MaxRetries", 5)#RETRIES FOR THROTTLED OR FAILED REQUESTS
+    timeout = (settings.get("ConnectTimeout", 10), settings.get("ReadTimeout", 120))#SECONDS TO CONNECT, SECONDS BETWEEN BYTES
+    response_cache_dir = settings.get("ResponseCache")#DIRECTORY CACHING PORTFOLIO MANAGER RESPONSES, None TO DISABLE
+    response_cache_mb = settings.get("ResponseCacheMB", 512)
+    meter_cache_path = settings.get("MeterCache", ":memory:")#METER METADATA CACHE FILE
+    meter_cache_ttl = settings.get("MeterCacheTTLDays", 30) * 24 * 60 * 60
+    metric_cache_path = settings.get("MetricCache", ":memory:")#FINALIZED MONTHLY METRICS CACHE FILE
+    metric_cache_ttl = settings.get("MetricCacheTTLDays", 30) * 24 * 60 * 60#DAYS BEFORE A CACHED METRIC IS FETCHED AGAIN
+    metric_columns = settings.get("Metrics", {"GHG":"totalGHGEmissions"})#OUTPUT COLUMN: PORTFOLIO MANAGER METRIC, {} TO SKIP
+    sync_state_path = settings.get("SyncState")#INCREMENTAL SYNC STATE FILE, None RE-PULLS 3 MONTHS
+    output_file = settings.get("OutputFile", "output.csv")#CSV OR .parquet FILE USED WITHOUT SOCRATA CREDENTIALS
+    chunk_size = settings.get("ChunkSize", 5000)#ROWS PER SOCRATA UPSERT
+    run_report_dir = settings.get("RunReport")#DIRECTORY FOR JSON RUN REPORTS, None TO DISABLE
+    profile_path = settings.get("Profile")#CPROFILE STATS FILE, None TO RUN WITHOUT THE PROFILER
+    checkpoint_path = settings.get("Checkpoint")#RUN CHECKPOINT FILE FOR --resume, None TO DISABLE
+    checkpoint_every = settings.get("CheckpointEvery", 50)#PROPERTIES WRITTEN BETWEEN CHECKPOINTS
+    reference_cache_dir = settings.get("ReferenceCache")#DIRECTORY FOR TABLE OF CONTENTS/SITES SNAPSHOTS, None TO DISABLE
+    reference_max_age = settings.get("ReferenceMaxAgeMinutes", 0) * 60#MINUTES BEFORE A SNAPSHOT IS CHECKED AGAIN
+    timeseries_dir = settings.get("TimeSeriesStore")#DIRECTORY OF THE LOCAL PARQUET TIME SERIES, None TO DISABLE
+    cube_path = settings.get("AggregateCube")#FISCAL YEAR AGGREGATES FILE, None TO DISABLE
+    cube_attributes = settings.get("CubeAttributes", ["PROPERTY", "PROPERTY ID", "State"])#SITE COLUMNS TO ROLL UP BY
+    queue_size = settings.get("PipelineQueueSize", 64)#ITEMS BUFFERED BETWEEN PIPELINE STAGES
+    batch_rows = settings.get("BatchRows", 50000)#CONSUMPTION ROWS TRANSFORMED AND WRITTEN TOGETHER
+    memory_budget_mb = settings.get("MemoryBudgetMB", 256)#CONSUMPTION AND TRANSFORMED ROWS HELD BETWEEN FETCH AND SINK
+
+meter_cache = SQLiteCache(meter_cache_path, table="meters", ttl=meter_cache_ttl)
+response_cache = None
+if response_cache_dir:
+    response_cache = ResponseCache(response_cache_dir, max_bytes=response_cache_mb * 1024 * 1024, namespace=username or "")
+client = EnergyStarClient(username, password, logging_level=logging.INFO, workers=workers, max_per_host=max_per_host,
+                          meter_cache=meter_cache, metric_cache=SQLiteCache(metric_cache_path, table="metrics", ttl=metric_cache_ttl),
+                          rate_limit=rate_limit, max_retries=max_retries, timeout=timeout, concurrency=concurrency,
+                          response_cache=response_cache, domain=energystar_domain)
+fetcher = ConcurrentFetcher(workers)
+sync_state = SyncState(sync_state_path) if sync_state_path else None
+reference_cache = ReferenceCache(reference_cache_dir, max_age=reference_max_age) if reference_cache_dir else None
+timeseries = TimeSeriesStore(timeseries_dir) if timeseries_dir else None
+cube = AggregateCube(cube_path, cube_attributes) if cube_path else None
+budget = MemoryBudget(memory_budget_mb * 1024 * 1024)
+instrumentation = client.instrumentation
+sink_totals = {}
+run_info = {}
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-if __name__ == "__main__":
-    # Set up relative time for automation
-    today = datetime.datetime.now()
-    start = today + relativedelta(months=-3)
+# Usage of a meter, or meter of a property, that could not be read
+FAILED = object()
+# Errors that fail one read rather than the run: error statuses, connections
+# and timeouts once retries run out, and bodies cut off mid-stream
+READ_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError)
+# Memory of one transformed row with its site columns, until a batch has been measured
+ROW_BYTES = 2048
+
+
+def read_meter_list(row):
+    """ Meter list for a property row, FAILED if the property can't be read """
+    # Catch bad meter lists url
+    try:
+        return client.get_meter_list(row["PM ID"])
+    except READ_ERRORS as e:
+        logger.error("Could not read meters for {0}: {1}".format(row["PM ID"], e))
+        return FAILED
+
+
+def read_usage(job, start, backfill=False):
+    """
+    Usage and cost for a (property row, meter) job: empty when meter is None,
+    FAILED when the meter (or the property's meter list) can't be read
+
+    Args:
+        job : (property row, meter) from meter_jobs
+        start : datetime to read meters never synced (or every meter) from
+        backfill : read every meter from start, ignoring the sync state
+    """
+    row, meter = job
+    if meter is None or meter is FAILED:
+        return row, meter, [] if meter is None else FAILED
+    # A back-fill re-reads every meter from its start date whatever was synced before
+    meter_start = sync_state.start_for(meter[0], start) if sync_state and not backfill else start
+    # Catch bad meter URLs
+    try:
+        usage = client.get_consumption_frame(meter[0], meter_start.year, meter_start.month, 1, meter_type=meter[1])
+    except READ_ERRORS as e:
+        logger.error("Could not read meter {0}: {1}".format(meter[0], e))
+        return row, meter, FAILED
+    if sync_state:
+        # Only months that are new or changed since the last sync
+        usage = sync_state.changed(meter[0], usage)
+    return row, meter, usage
+
+
+def usage_bytes(usage):
+    """ Memory held by the consumption of one meter, or by a frame of rows """
+    if isinstance(usage, pd.DataFrame):
+        return int(usage.memory_usage(deep=True).sum())
+    return len(usage) * 256
+
 
+def charged(results):
+    """
+    Take each meter's usage from the memory budget, in order, waiting while
+    the budget is used up, which stops the fetch stage from reading more
 
-    df_array = []
-    logger.info("Reading in master table of contents...")
-    master = pd.read_csv(table_of_contents, dtype={"PM ID":object,"Property ID":object})
+    Yields:
+        (property row, meter, usage, bytes taken from the budget)
+    """
+    for row, meter, usage in results:
+        size = usage_bytes(usage) if usage is not FAILED else 0
+        budget.acquire(size)
+        yield row, meter, usage, size
 
-    property_list = master[master["PM ID"].notnull()]
 
-    logger.info("Reading in site lookup table...")
-    sites = pd.read_csv(all_properties, dtype={"PM ID":object,"Property ID":object})
+def read_metrics(rows):
+    """
+    Metric table for the properties and months in rows, from their earliest
+    month on. Every metric of a property and month is one request and the
+    requests run concurrently. A property/month that can't be read is blank.
+    """
+    if len(rows) == 0 or not metric_columns:
+        return metric_table([], metric_columns)
+    first = datetime.datetime.strptime(rows["DATE"].min(), "%Y-%m-%d")
+    records = client.get_metrics(list(rows["PM ID"].unique()), list(dict.fromkeys(metric_columns.values())),
+                                 first.year, first.month, ignore_errors=True)
+    return metric_table(records, metric_columns)
 
-    ### PURE API
-    # account_info = client.get_account_info()
-    # p_list = client.get_propery_list(account_info["account"]["id"]["$"])
 
+def meter_jobs(properties, done_meters=()):
+    """
+    Yield (property row, meter) pairs, discovering meters concurrently
+
+    Meters in done_meters are left out. A property with no meters left yields
+    (property row, None) so it can still be checkpointed; one whose meter list
+    can't be read yields (property row, FAILED).
+    """
+    # properties may be a Stage, which can only be iterated once
+    for row, meterlist in fetcher.map(lambda row: (row, read_meter_list(row)), properties):
+        if meterlist is FAILED:
+            yield row, FAILED
+            continue
+        logger.info("Retrieved {0} Meter(s) for {1}:{2}".format(len(meterlist), row["PM ID"], row["Property Name"]))
+        meterlist = [meter for meter in meterlist if meter[0] not in done_meters]
+        for meter in meterlist:
+            yield row, meter
+        if not meterlist:
+            yield row, None
+
+
+def property_source(property_list, shard=None, done_properties=()):
+    """
+    Property rows to sync, in table of contents order
+
+    Args:
+        property_list : the table of contents rows with a PM ID
+        shard : (i, n) to keep only shard i's properties, None for all
+        done_properties : PM IDs already finished, left out
+    """
     for idx, row in property_list.iterrows():
-        logger.info("Reading data for {0}:{1}".format(row["PM ID"], row["Property Name"]))
         # Filter out Property IDs
         if(row["Category"] == "N"):
             logger.debug("Passing {0}".format(row["PM ID"]))
             continue
-        # Catch bad meter lists url
-        logger.info("\tGetting Meter List...")
-        try:
-            meterlist = client.get_meter_list(row["PM ID"])
-        except requests.exceptions.HTTPError as e:
-            meterlist = []
-        logger.info("\tRetrieved {0} Meter(s)".format(len(meterlist)))
+        if not in_shard(row["PM ID"], shard) or str(row["PM ID"]) in done_properties:
+            continue
+        yield row
 
-        for meter in meterlist:
-            # Catch bad meter URLs
-            logger.info("\tReading data for {0}:{1}".format(meter[0], meter[1]))
-            try:
-                usage = client.get_usage_and_cost(meter[0], start.year, start.month, 1)
-            except requests.exceptions.HTTPError:
-                usage = []
-            df = pd.DataFrame(usage)
-            if(len(df) == 0):
-                logger.info("Meter {0} on property {1} has no data".format(meter[1],row["Property Name"]))
-                continue
-
-            # Consistent information to all values
-            df["PROPERTY"] = row["Property Name"]
-            df["PROPERTY ID"] = row["Property ID"]
-            df["PM ID"] = row["PM ID"]
-            df["METER TYPE"] = meter[1]
-
-            # Create the cost columns
-            df_cost = df.pivot_table(index=["DATE","PM ID","PROPERTY","PROPERTY ID"], values=["COST"], columns=["METER TYPE"])
-            df_cost.columns = df_cost.columns.get_level_values(1)
-            df_cost.reset_index(inplace=True)
-            df_cost["TOTAL COST"] = df_cost.sum(axis=1)
-
-            # Create the usage columns
-            df_usage = df.pivot_table(index=["DATE","PM ID","PROPERTY","PROPERTY ID"], values=["USAGE"], columns=["METER TYPE"])
-            df_usage.columns = df_usage.columns.get_level_values(1)
-            df_usage.reset_index(inplace=True)
-            df_usage["TOTAL USAGE"] = df_usage.sum(axis=1)
-
-            # Merge cost and usage columns, Create Fiscal Year and Fiscal Period from date column
-            df_merged = df_cost.merge(df_usage, on=["DATE","PM ID","PROPERTY","PROPERTY ID"], suffixes=["_cost","_usage"])
-            df_merged["METER TYPE"] = meter[1]
-            df_merged["METER ID"] = meter[0]
-            df_merged["FY"] = df_merged["DATE"].map(lambda x: x[0:4])
-            df_merged["Fiscal Period"] = df_merged["DATE"].map(lambda x: x[5:7])
-            df_merged["ROWID"] = df_merged["DATE"] + df_merged["METER ID"].astype(str)
-
-            # Merge Property Data Information
-            logger.info("\tMerging Property Information and Usage/Cost dataset")
-            df_full = df_merged.merge(sites, left_on="PROPERTY ID", right_on="Property ID", how="inner")
-            df_full["GHG"] = ""
-            logger.info("\tMerged {0} row(s)".format(len(df_full)))
-            if(socrata_username is not None):
-                # Write to Socrata
-                logger.info("Writing to Socrata...")
-                response = requests.post(socrata_dataset, data=df_full.to_json(orient="records"),auth=(socrata_username, socrata_password))
-                print(response.text)
-            else:
-                # Optional Write out to CSV
-                logger.info("Writing to CSV...")
-                df_full.to_csv("output.csv", index=False, na_rep="0", quoting=csv.QUOTE_ALL)
+
+def write_group(sink, batches, done, checkpoint, sites, failed=()):
+    """
+    Transform the meters of a group of properties, join their metrics, write
+    and flush them, upsert them into the time series store and the aggregate
+    cube, and only then record them in the sync state and the checkpoint
+
+    The transformed rows and metrics are charged to the memory budget until
+    they have been written, so fetching waits for them too.
+
+    Args:
+        sink : the Sink
+        batches : [(property row, meter, usage), ...] with data
+        done : {PM ID: [(meter id, entries), ...]} of every meter read in the group
+        checkpoint : Checkpoint, or None
+        sites : the site table from index_sites
+        failed : PM IDs in done with a meter or meter list that failed, left
+            unfinished in the checkpoint
+
+    Returns:
+        Tuple : (rows written, bytes they held)
+    """
+    df_full, size = None, 0
+    if batches:
+        # Pivot, fiscal periods and the site join for every meter at once
+        logger.info("Merging Property Information and Usage/Cost dataset for {0} meter(s)".format(len(batches)))
+        with instrumentation.stage("transform"):
+            df_full = transform(consumption_table(batches), sites)
+        logger.info("\tMerged {0} row(s)".format(len(df_full)))
+        metrics = None
+        if metric_columns:
+            with instrumentation.stage("metrics"):
+                metrics = read_metrics(df_full)
+                df_full = join_metrics(df_full, metrics)
+        size = usage_bytes(df_full) + (usage_bytes(metrics) if metrics is not None else 0)
+        budget.charge(size)
+    try:
+        if df_full is not None:
+            with instrumentation.stage("write"):
+                sink.write(df_full)
+        with instrumentation.stage("write"):
+            sink.flush()
+        if timeseries and df_full is not None:
+            with instrumentation.stage("timeseries"):
+                timeseries.upsert(df_full)
+        if cube and df_full is not None:
+            with instrumentation.stage("cube"):
+                cube.update(df_full)
+    finally:
+        budget.release(size)
+    if sync_state:
+        # Only reached once every chunk is written, failed rows are retried next run
+        with instrumentation.stage("sync_state"):
+            for row, meter, usage in batches:
+                sync_state.commit(meter[0], usage)
+    if checkpoint:
+        checkpoint.record(done, unfinished=failed)
+    return (len(df_full) if df_full is not None else 0), size
+
+
+def sync(sink, jobs, checkpoint, group_size, sites):
+    """
+    Consume the fetched meters, writing them in batches
+
+    A batch is written when it reaches group_size properties or batch_rows
+    rows, when the consumption held plus the rows it will transform into
+    (estimated from the batches written so far) would pass the memory
+    budget, or as soon as the fetch stage is waiting on the budget. Only
+    properties whose meters have all been written are checkpointed; a
+    property cut by a batch is carried into the next one. Failed reads are
+    noted in the checkpoint and counted in run_info["failed"], and their
+    property is left unfinished so --resume retries them.
+
+    Args:
+        sink : the Sink
+        jobs : Stage of (property row, meter, usage, bytes) from charged
+        checkpoint : Checkpoint, or None
+        group_size : properties per checkpointed group
+        sites : the site table from index_sites
+    """
+    batches, done, rows, held = [], OrderedDict(), 0, 0
+    failed = set()
+    row_bytes = [ROW_BYTES]
+
+    def flush(complete):
+        # Unless complete, the last property in done may have meters still to come
+        carried = None
+        if not complete and done:
+            pm_id = next(reversed(done))
+            carried = (pm_id, done.pop(pm_id))
+        written, size = write_group(sink, batches, done, checkpoint, sites, failed & set(done))
+        if written:
+            row_bytes[0] = size // written + 1
+        budget.release(held)
+        run_info["batches"] = run_info.get("batches", 0) + 1
+        done.clear()
+        if carried:
+            done[carried[0]] = carried[1]
+        failed.intersection_update(done)
+        del batches[:]
+
+    for item in jobs.poll(0.1):
+        if item is None:
+            # Nothing arrived, write what is held if fetching is stalled on the budget
+            if budget.waiting and held:
+                flush(complete=False)
+                rows, held = 0, 0
+            continue
+        row, meter, usage, size = item
+        if row["PM ID"] not in done and done and (len(done) >= group_size or budget.waiting):
+            flush(complete=True)
+            rows, held = 0, 0
+        held += size
+        meters = done.setdefault(row["PM ID"], [])
+        if usage is FAILED:
+            failed.add(row["PM ID"])
+            run_info["failed"] = run_info.get("failed", 0) + 1
+            if checkpoint:
+                checkpoint.fail(row["PM ID"], meter[0] if meter is not FAILED else None)
+            continue
+        if meter is None:
+            continue
+        meters.append((meter[0], len(usage)))
+        logger.info("\tRead {0} entries for {1}:{2}".format(len(usage), meter[0], meter[1]))
+        if(len(usage) == 0):
+            logger.info("Meter {0} on property {1} has no new data".format(meter[1],row["Property Name"]))
+            continue
+        batches.append((row, meter, usage))
+        rows += len(usage)
+        if rows >= batch_rows or held + rows * row_bytes[0] >= budget.max_bytes:
+            flush(complete=False)
+            rows, held = 0, 0
+    flush(complete=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync Portfolio Manager usage and cost to Socrata or a file")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/n",
+                        help="only sync shard i (0 to n-1) of n, properties are split by PM ID")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the latest unfinished run recorded in the Checkpoint file")
+    parser.add_argument("--since", type=lambda text: datetime.datetime.strptime(text, "%Y-%m"), metavar="YYYY-MM",
+                        help="back-fill every meter from this month instead of syncing incrementally")
+    parser.add_argument("--merge", nargs="+", metavar="FILE",
+                        help="merge the output files given after the first one into the first one and exit")
+    args = parser.parse_args()
+    if args.resume and not checkpoint_path:
+        parser.error("--resume needs a Checkpoint file in .settings.json")
+    if args.merge and len(args.merge) < 2:
+        parser.error("--merge needs an output file and at least one input file")
+    return args
+
+
+def report_path():
+    """ Timestamped run report file in the RunReport directory, None when reports are off """
+    if not run_report_dir:
+        return None
+    name = "NOAA_EnergyStar-{0:%Y%m%dT%H%M%S}.json".format(instrumentation.started)
+    return os.path.join(run_report_dir, name)
+
+
+def report_extra():
+    """ Transport, cache and sink totals added to the run report """
+    extra = {"transport":client.transport.stats.snapshot(), "sink":sink_totals, "run":run_info,
+             "memory_budget":budget.snapshot()}
+    if reference_cache is not None:
+        extra["reference_cache"] = {"hits":reference_cache.hits, "downloads":reference_cache.downloads}
+    if response_cache is not None:
+        extra["response_cache"] = {"hits":response_cache.hits, "misses":response_cache.misses,
+                                   "revalidated":response_cache.revalidated}
+    return extra
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.merge:
+        merge_outputs(args.merge[1:], args.merge[0], chunk_size=chunk_size)
+        raise SystemExit(0)
+
+    # Set up relative time for automation
+    today = datetime.datetime.now()
+    start = today + relativedelta(months=-3)
+    shard = args.shard
+    checkpoint = Checkpoint(shard_path(checkpoint_path, shard)) if checkpoint_path else None
+    resumed, since = checkpoint.resume(shard) if args.resume else (False, None)
+    if resumed:
+        logger.info("Resuming run {0} from {1}".format(checkpoint.run_id, checkpoint.path))
+    else:
+        since = args.since
+        if checkpoint:
+            checkpoint.begin(shard, since)
+    backfill = False
+    if since:
+        start, backfill = since, True
+    done_properties = checkpoint.done_properties() if resumed else set()
+    done_meters = checkpoint.done_meters() if resumed else set()
+    run_info.update(shard="{0}/{1}".format(*shard) if shard else None, resumed=resumed,
+                    since=since.strftime("%Y-%m") if since else None, run_id=checkpoint.run_id if checkpoint else None)
+
+    with instrumentation.run(report_path(), profile_path, report_extra):
+        logger.info("Reading in master table of contents...")
+        with instrumentation.stage("table_of_contents"):
+            master = load_reference(reference_cache, "table_of_contents", table_of_contents, table_of_contents_view)
+            property_list = master[master["PM ID"].notnull()]
+
+        logger.info("Reading in site lookup table...")
+        with instrumentation.stage("sites"):
+            sites = index_sites(load_reference(reference_cache, "sites", all_properties, all_properties_view))
+
+        ### PURE API
+        # account_info = client.get_account_info()
+        # p_list = client.get_propery_list(account_info.id)
+
+        logger.info("{0} propert(ies) already done".format(len(done_properties)))
+
+        # Without a checkpoint, batches are only cut by BatchRows and the memory budget
+        group_size = checkpoint_every if checkpoint else float("inf")
+        with instrumentation.stage("sync"), make_sink(settings, output_file, usage_dataset, shard, append=resumed) as sink:
+            logger.info("Writing to {0}...".format(type(sink).__name__))
+            # property source -> meter discovery -> consumption fetch, each on its own
+            # thread behind a bounded queue; results keep property/meter order
+            properties = Stage(property_source(property_list, shard, done_properties), queue_size, "properties")
+            meters = Stage(meter_jobs(properties, done_meters), queue_size, "meters")
+            jobs = Stage(charged(fetcher.map(lambda job: read_usage(job, start, backfill), meters)), queue_size,
+                         "consumption")
+            sync(sink, jobs, checkpoint, group_size, sites)
+            run_info["queue_high_water"] = {"properties":properties.high_water, "meters":meters.high_water,
+                                            "consumption":jobs.high_water}
+        sink_totals.update(sink=type(sink).__name__, rows=sink.rows_written, chunks=sink.chunks_written)
+        logger.info("\tWrote {0} row(s) in {1} chunk(s)".format(sink.rows_written, sink.chunks_written))
+        if run_info.get("failed"):
+            # Left unfinished so --resume retries what failed
+            logger.warning("{0} meter(s) or meter list(s) could not be read{1}".format(
+                run_info["failed"], ", run with --resume to retry them" if checkpoint else ""))
+        elif checkpoint:
+            checkpoint.finish()
+        logger.info("Portfolio Manager requests: {0}".format(client.transport.stats.snapshot()))
@@ -1,21 +1,59 @@
-from EnergyStarAPI import EnergyStarClient
-import pandas as pd
+from EnergyStarAPI import EnergyStarClient, SQLiteCache
+from NOAAPipeline import ReferenceCache, load_reference, view_metadata_url, metric_table, make_sink
 import json
+import logging
+import os
 with open(".settings.json", 'r') as settings:
     credentials = json.load(settings)
     username = credentials["ES_Username"]#ENERGYSTAR USERNAME
     password = credentials["ES_Password"]#ENERGYSTAR PASSWORD
     socrata_username = credentials["Socrata_Username"]#SOCRATA USERNAME
     socrata_password = credentials["Socrata_Password"]#SOCRATA PASSWORD
+    workers = credentials.get("Workers", 8)#CONCURRENT REQUESTS
+    max_per_host = credentials.get("MaxRequestsPerHost", workers)#CAP ON REQUESTS TO PORTFOLIO MANAGER
+    concurrency = credentials.get("InitialConcurrency")#REQUESTS IN FLIGHT TO START FROM, GROWS UP TO MaxRequestsPerHost
+    timeout = (credentials.get("ConnectTimeout", 10), credentials.get("ReadTimeout", 120))#SECONDS TO CONNECT, SECONDS BETWEEN BYTES
+    metric_cache_path = credentials.get("MetricCache", ":memory:")#FINALIZED MONTHLY METRICS CACHE FILE
+    metric_cache_ttl = credentials.get("MetricCacheTTLDays", 30) * 24 * 60 * 60#DAYS BEFORE A CACHED METRIC IS FETCHED AGAIN
+    metric_columns = credentials.get("Metrics", {"GHG":"totalGHGEmissions"})#OUTPUT COLUMN: PORTFOLIO MANAGER METRIC
+    metrics_output_file = credentials.get("MetricsOutputFile", "metrics.csv")#CSV OR .parquet FILE USED WITHOUT SOCRATA CREDENTIALS
+    metrics_dataset = credentials.get("MetricsDataset")#SOCRATA DATASET THE METRICS ARE UPSERTED TO, None TO WRITE THE FILE
+    energystar_domain = credentials.get("EnergyStarDomain", "https://portfoliomanager.energystar.gov/ws")
+    socrata_domain = credentials.get("SocrataDomain", "https://noaa-ocao.data.socrata.com")
+    table_of_contents = "{0}/api/views/{1}/rows.csv?accessType=DOWNLOAD".format(socrata_domain, credentials["Table_of_Contents"])
+    table_of_contents_view = view_metadata_url(socrata_domain, credentials["Table_of_Contents"])
+    reference_cache_dir = credentials.get("ReferenceCache")#DIRECTORY FOR TABLE OF CONTENTS SNAPSHOTS, None TO DISABLE
+    reference_max_age = credentials.get("ReferenceMaxAgeMinutes", 0) * 60
+    run_report_dir = credentials.get("RunReport")#DIRECTORY FOR JSON RUN REPORTS, None TO DISABLE
+    profile_path = credentials.get("Profile")#CPROFILE STATS FILE, None TO RUN WITHOUT THE PROFILER
 
-client = EnergyStarClient(username, password)
+client = EnergyStarClient(username, password, workers=workers, max_per_host=max_per_host, timeout=timeout, concurrency=concurrency,
+                          metric_cache=SQLiteCache(metric_cache_path, table="metrics", ttl=metric_cache_ttl),
+                          domain=energystar_domain)
+
+reference_cache = ReferenceCache(reference_cache_dir, max_age=reference_max_age) if reference_cache_dir else None
+instrumentation = client.instrumentation
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 if __name__ == "__main__":
     year = 2015
     month = 1
-    master = pd.read_csv("https://noaa-ocao.data.socrata.com/api/views/phzv-979t/rows.csv?accessType=DOWNLOAD", dtype={"PM ID":object,"Property ID":object})
-
-    property_list = master[master["PM ID"].notnull()]
-    for idx, row in property_list.iterrows():
-        greenhousegas = client.get_metric(row["PM ID"],"totalGHGEmissions",year,month,1, metric_name="GHG")
-        ghg_df = pd.DataFrame(greenhousegas)
+    report = None
+    if run_report_dir:
+        report = os.path.join(run_report_dir, "NOAA_GreenHouseGas-{0:%Y%m%dT%H%M%S}.json".format(instrumentation.started))
+    with instrumentation.run(report, profile_path, lambda: {"transport":client.transport.stats.snapshot()}):
+        with instrumentation.stage("table_of_contents"):
+            master = load_reference(reference_cache, "table_of_contents", table_of_contents, table_of_contents_view)
+            property_list = master[master["PM ID"].notnull()]
+        # Every metric, property and month in one concurrent pass, closed months come from the metric cache
+        with instrumentation.stage("metrics"):
+            records = client.get_metrics(property_list["PM ID"], list(dict.fromkeys(metric_columns.values())),
+                                         year, month, 1, ignore_errors=True)
+            metrics = metric_table(records, metric_columns)
+            metrics["ROWID"] = metrics["MONTH"] + metrics["PM ID"]
+        with instrumentation.stage("write"):
+            with make_sink(credentials, metrics_output_file, metrics_dataset) as sink:
+                sink.write(metrics)
+            logger.info("Wrote {0} row(s) of {1} with {2}".format(sink.rows_written, ", ".join(metric_columns),
+                                                                 type(sink).__name__))
@@ -4,8 +4,8 @@ path = os.path.dirname(sys.modules[__name__].__file__)
 path = os.path.join(path, '..')
 sys.path.insert(0, path)
 from EnergyStarAPI import EnergyStarClient
+from NOAAPipeline import ReferenceCache, load_reference, view_metadata_url, row_identifier, Reconciler, SocrataSink, deletions
 import pandas as pd
-import requests
 import json
 with open("../.settings.json", 'r') as f:
     settings = json.load(f)
@@ -15,22 +15,49 @@ with open("../.settings.json", 'r') as f:
     socrata_password = settings["Socrata_Password"]#SOCRATA PASSWORD
     table_of_contents = "https://noaa-ocao.data.socrata.com/api/views/{0}/rows.csv?accessType=DOWNLOAD".format(settings["Table_of_Contents"])
     rpmd_url = "https://noaa-ocao.data.socrata.com/resource/{0}.json".format(settings["All_Properties"])
+    rpmd_view = view_metadata_url("https://noaa-ocao.data.socrata.com", settings["All_Properties"])
+    table_of_contents_view = view_metadata_url("https://noaa-ocao.data.socrata.com", settings["Table_of_Contents"])
+    reference_cache_dir = settings.get("ReferenceCache")#DIRECTORY FOR TABLE OF CONTENTS SNAPSHOTS, None TO DISABLE
+    property_state_path = settings.get("PropertyState", "property_state.db")#SNAPSHOT OF THE ROWS PUSHED TO SOCRATA
+    chunk_size = settings.get("ChunkSize", 5000)#ROWS PER SOCRATA UPSERT
 client = EnergyStarClient(username, password)
+reference_cache = ReferenceCache(reference_cache_dir) if reference_cache_dir else None
+reconciler = Reconciler(property_state_path)
 
 if __name__ == "__main__":
     RPMD_DATA = "Properties.xls"
     rpmd = pd.read_excel(RPMD_DATA)
-    lookup = pd.read_csv(table_of_contents)
+    # Read without ID dtypes, the IDs are compared with the numeric ones of the RPMD spreadsheet
+    lookup = load_reference(reference_cache, "table_of_contents", table_of_contents, table_of_contents_view, dtype=None)
 
     account_info = client.get_account_info()
-    energystar_property_list = client.get_propery_list(account_info["account"]["id"]["$"])
+    energystar_property_list = client.get_propery_list(account_info.id)
     property_list = pd.DataFrame(energystar_property_list)
     property_list.columns = ["PM ID", "Property Name"]
     property_list.to_csv("CurrentEnergyStarProperties.csv", index=False)
 
-    # Overwrite the Current Sites dataset on Socrata
-    response = requests.put(rpmd_url, data=rpmd.to_json(orient="records"), auth=(socrata_username, socrata_password))
-    print(response.json())
+    # Upsert only the sites added or changed since the last push and delete the removed ones. This needs a
+    # snapshot of what the dataset holds and Property ID as its row identifier, otherwise every row is replaced
+    replace = reconciler.snapshot("rpmd").empty
+    if not replace:
+        identifier = row_identifier(rpmd_view)
+        if identifier != "Property ID":
+            print("RPMD row identifier is {0}, not Property ID: replacing every site".format(identifier))
+            replace = True
+    delta = reconciler.diff("rpmd", rpmd, "Property ID")
+    print("RPMD sites: {0}".format(delta.summary()))
+    if len(delta.conflicts):
+        delta.conflicts.to_csv("ConflictingProperties.csv", index=False)
+    if replace:
+        with SocrataSink(rpmd_url, (socrata_username, socrata_password), chunk_size=chunk_size, replace=True) as sink:
+            sink.write(rpmd)
+        reconciler.commit("rpmd", delta)
+    elif len(delta):
+        with SocrataSink(rpmd_url, (socrata_username, socrata_password), chunk_size=chunk_size) as sink:
+            sink.write(delta.upserts())
+            sink.flush()
+            sink.write(deletions(delta.removed, "Property ID"))
+        reconciler.commit("rpmd", delta)
 
     # Delineate the rpmd and lookup files
     lookup["FILE"] = "LOOKUP"
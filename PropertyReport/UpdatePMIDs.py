@@ -1,14 +1,27 @@
+import sys
+import os
+path = os.path.dirname(sys.modules[__name__].__file__)
+path = os.path.join(path, '..')
+sys.path.insert(0, path)
+from NOAAPipeline import Reconciler, SocrataSink
 import pandas as pd
-import requests
 import json
-with open("../.settings.json", 'r') as d:
+with open("../.settings.json", 'r') as f:
     settings = json.load(f)
     socrata_username = settings["Socrata_Username"]#SOCRATA USERNAME
     socrata_password = settings["Socrata_Password"]#SOCRATA PASSWORD
     table_of_contents = "https://noaa-ocao.data.socrata.com/resource/{0}.json".format(settings["Table_of_Contents"])
+    property_state_path = settings.get("PropertyState", "property_state.db")#SNAPSHOT OF THE ROWS PUSHED TO SOCRATA
+    chunk_size = settings.get("ChunkSize", 5000)#ROWS PER SOCRATA UPSERT
+reconciler = Reconciler(property_state_path)
 
-new_properties = pd.read_csv("NewProperties.csv")
+new_properties = pd.read_csv("NewProperties.csv", dtype={"Property ID":object})
 new_properties = new_properties[["PM ID","Property ID","Category"]]
 
-response = requests.post(table_of_contents, data=new_properties.to_json(orient="records"), auth=(socrata_username, socrata_password))
-print(response.json())
+# Only rows added or changed since the last push, rows no longer in the file stay on Socrata
+delta = reconciler.diff("new_properties", new_properties, "Property ID")
+print("New properties: {0}".format(delta.summary()))
+with SocrataSink(table_of_contents, (socrata_username, socrata_password), chunk_size=chunk_size) as sink:
+    sink.write(delta.upserts())
+print("Upserted {0} row(s) in {1} chunk(s)".format(sink.rows_written, sink.chunks_written))
+reconciler.commit("new_properties", delta, remove=False)
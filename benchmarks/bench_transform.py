@@ -0,0 +1,104 @@
+"""
+Compare the per-meter transform NOAA_EnergyStar.py used to run with the
+whole-portfolio NOAAPipeline.transform on synthetic data.
+
+    python benchmarks/bench_transform.py --properties 450 --meters 3 --months 36
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from NOAAPipeline.transform import consumption_table, index_sites, transform
+
+METER_TYPES = ["Electric - Grid", "Natural Gas", "Municipally Supplied Potable Water - Mixed Indoor/Outdoor"]
+
+
+def synthetic(properties, meters, months, seed=0):
+    """ Property rows, meters with usage and a sites table shaped like the Socrata datasets """
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range("2015-01-31", periods=months, freq="ME").strftime("%Y-%m-%d")
+    batches = []
+    for p in range(properties):
+        row = {"PM ID":str(1000000 + p), "Property Name":"Property {0}".format(p), "Property ID":"RPMD{0:05d}".format(p)}
+        for m in range(meters):
+            meter = (2000000 + p * meters + m, METER_TYPES[m % len(METER_TYPES)])
+            usage = [{"DATE":d, "USAGE":float(rng.randint(1, 1000)), "COST":float(rng.randint(0, 100))} for d in dates]
+            batches.append((row, meter, usage))
+    sites = pd.DataFrame({"Property ID":["RPMD{0:05d}".format(p) for p in range(0, properties, 1)],
+                          "State":rng.choice(["MD", "CO", "WA", "HI"], properties),
+                          "Area":rng.randint(1000, 90000, properties)})
+    # A few sites appear twice in the RPMD extract
+    sites = pd.concat([sites, sites.iloc[:3]], ignore_index=True)
+    return batches, sites
+
+
+def legacy(batches, sites):
+    """ The per-meter loop body from NOAA_EnergyStar.py, one frame per meter """
+    out = []
+    for row, meter, usage in batches:
+        df = pd.DataFrame(usage)
+        if(len(df) == 0):
+            continue
+        df["PROPERTY"] = row["Property Name"]
+        df["PROPERTY ID"] = row["Property ID"]
+        df["PM ID"] = row["PM ID"]
+        df["METER TYPE"] = meter[1]
+        df_cost = df.pivot_table(index=["DATE","PM ID","PROPERTY","PROPERTY ID"], values=["COST"], columns=["METER TYPE"])
+        df_cost.columns = df_cost.columns.get_level_values(1)
+        df_cost.reset_index(inplace=True)
+        # pandas < 2 silently skipped the string columns here
+        df_cost["TOTAL COST"] = df_cost.sum(axis=1, numeric_only=True)
+        df_usage = df.pivot_table(index=["DATE","PM ID","PROPERTY","PROPERTY ID"], values=["USAGE"], columns=["METER TYPE"])
+        df_usage.columns = df_usage.columns.get_level_values(1)
+        df_usage.reset_index(inplace=True)
+        df_usage["TOTAL USAGE"] = df_usage.sum(axis=1, numeric_only=True)
+        df_merged = df_cost.merge(df_usage, on=["DATE","PM ID","PROPERTY","PROPERTY ID"], suffixes=["_cost","_usage"])
+        df_merged["METER TYPE"] = meter[1]
+        df_merged["METER ID"] = meter[0]
+        df_merged["FY"] = df_merged["DATE"].map(lambda x: x[0:4])
+        df_merged["Fiscal Period"] = df_merged["DATE"].map(lambda x: x[5:7])
+        df_merged["ROWID"] = df_merged["DATE"] + df_merged["METER ID"].astype(str)
+        df_full = df_merged.merge(sites, left_on="PROPERTY ID", right_on="Property ID", how="inner")
+        df_full["GHG"] = ""
+        out.append(df_full)
+    return out
+
+
+def vectorized(batches, sites):
+    return transform(consumption_table(batches), index_sites(sites))
+
+
+def check(legacy_frames, full):
+    """ Every legacy row must appear, in order, in the vectorized output """
+    expected = pd.concat(legacy_frames, ignore_index=True)
+    assert len(expected) == len(full), "row count {0} != {1}".format(len(expected), len(full))
+    offset = 0
+    for frame in legacy_frames:
+        got = full.iloc[offset:offset + len(frame)][list(frame.columns)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(frame.reset_index(drop=True), got, check_dtype=False)
+        offset += len(frame)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--properties", type=int, default=450)
+    parser.add_argument("--meters", type=int, default=3)
+    parser.add_argument("--months", type=int, default=3)
+    args = parser.parse_args()
+
+    batches, sites = synthetic(args.properties, args.meters, args.months)
+    legacy_frames, legacy_time = timed(legacy, batches, sites)
+    full, vectorized_time = timed(vectorized, batches, sites)
+    check(legacy_frames, full)
+    print("meters: {0}  rows: {1}".format(len(batches), len(full)))
+    print("per-meter:  {0:8.3f}s".format(legacy_time))
+    print("vectorized: {0:8.3f}s  ({1:.1f}x)".format(vectorized_time, legacy_time / vectorized_time))
@@ -0,0 +1,395 @@
+"""
+Local stand-in for Portfolio Manager and the NOAA Socrata datasets.
+
+Serves schemas-4.0 shaped XML for the endpoints EnergyStarClient uses, the
+table of contents and site CSVs, and accepts Socrata upserts. Property, meter
+and page counts, latency and error rates are configurable.
+
+    python benchmarks/mockpm.py --properties 50 --latency 0.05
+
+or from Python:
+
+    with MockPortfolioManager(properties=50, latency=0.05) as pm:
+        client = EnergyStarClient("user", "password", domain=pm.energystar_domain)
+"""
+import argparse
+import datetime
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import quoteattr
+
+METER_TYPES = ["Electric - Grid", "Natural Gas", "Municipally Supplied Potable Water - Mixed Indoor/Outdoor",
+               "Fuel Oil (No. 2)"]
+# Bulk fuels are reported as meterDelivery entries, everything else as meterConsumption
+DELIVERY_TYPES = ("Fuel Oil (No. 2)",)
+UNITS = {"Electric - Grid":"kWh (thousand Watt-hours)", "Natural Gas":"therms",
+         "Municipally Supplied Potable Water - Mixed Indoor/Outdoor":"kGal (thousand gallons) (US)",
+         "Fuel Oil (No. 2)":"Gallons (US)"}
+ACCOUNT_ID = 12341
+TOC_DATASET = "phzv-979t"
+SITES_DATASET = "8wgy-ye8p"
+USAGE_DATASET = "8vm3-6zrm"
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is expected, not worth a traceback
+        pass
+
+
+def _month_ends(months):
+    """ The last day of each of the past months, oldest first, ending last month """
+    today = datetime.date.today()
+    end = today.replace(day=1) - datetime.timedelta(days=1)
+    dates = []
+    for _ in range(months):
+        dates.append(end)
+        end = end.replace(day=1) - datetime.timedelta(days=1)
+    return dates[::-1]
+
+
+class MockPortfolioManager(object):
+    """
+    Threaded HTTP server pretending to be Portfolio Manager and Socrata
+
+    Args:
+        properties : number of properties
+        meters : meters per property
+        months : months of consumption per meter
+        page_size : consumption entries per consumptionData page
+        latency : seconds added to every response
+        jitter : random extra latency, up to this many seconds
+        error_rate : fraction of Portfolio Manager requests answered with an error
+        error_status : status used for injected errors, 429/503 include Retry-After
+        retry_after : Retry-After seconds sent with injected errors
+        seed : random seed for usage values and injected errors
+        host : interface to listen on
+        port : port to listen on, 0 picks a free one
+    """
+    def __init__(self, properties=10, meters=3, months=36, page_size=12, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, retry_after=0.1, seed=0, host="127.0.0.1", port=0):
+        self.properties = properties
+        self.meters = meters
+        self.months = months
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.seed = seed
+        self.rows_updated_at = int(time.time())
+        # Column the Socrata datasets upsert on, None for datasets without a row identifier
+        self.row_identifier = "Property ID"
+        self.dates = _month_ends(months)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self.server = _QuietServer((host, port), self._handler())
+        self._thread = None
+
+    # Portfolio
+
+    def pm_id(self, p):
+        return 100000 + p
+
+    def property_id(self, p):
+        return "P{0:05d}".format(p)
+
+    def meter_id(self, p, m):
+        return 500000 + p * self.meters + m
+
+    def meter_type(self, meter_id):
+        return METER_TYPES[(meter_id - 500000) % self.meters % len(METER_TYPES)]
+
+    def usage(self, meter_id, i):
+        # Deterministic so repeated runs see the same data
+        return round(random.Random(meter_id * 1000 + i).uniform(10, 1000), 2)
+
+    # Server lifecycle
+
+    @property
+    def url(self):
+        return "http://{0}:{1}".format(*self.server.server_address[:2])
+
+    @property
+    def energystar_domain(self):
+        return self.url + "/ws"
+
+    @property
+    def socrata_domain(self):
+        return self.url
+
+    def settings(self, **overrides):
+        """ A .settings.json dictionary pointing the sync scripts at this server """
+        settings = {"ES_Username":"bench", "ES_Password":"bench", "Socrata_Username":"bench",
+                    "Socrata_Password":"bench", "EnergyStarDomain":self.energystar_domain,
+                    "SocrataDomain":self.socrata_domain, "EnergyStarCostUsageDataset":USAGE_DATASET,
+                    "Table_of_Contents":TOC_DATASET, "All_Properties":SITES_DATASET, "MeterCache":":memory:",
+                    "MetricCache":":memory:"}
+        settings.update(overrides)
+        return settings
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests":0, "errors":0, "endpoints":{}, "rows_received":0, "upserts":0, "replaces":0,
+                          "bytes_sent":0, "bytes_received":0}
+
+    def _count(self, endpoint, sent=0, received=0):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["endpoints"][endpoint] = self.stats["endpoints"].get(endpoint, 0) + 1
+            self.stats["bytes_sent"] += sent
+            self.stats["bytes_received"] += received
+
+    def _inject_error(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        return failed
+
+    def _delay(self):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    # Portfolio Manager documents
+
+    def account(self):
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><account><id>{0}</id>'
+                '<username>bench</username><webserviceUser>true</webserviceUser><searchable>false</searchable>'
+                '<contact><firstName>Bench</firstName><lastName>Mark</lastName><email>bench@example.com</email>'
+                '</contact><organization name="NOAA"><primaryBusiness>Other</primaryBusiness>'
+                '<energyStarPartner>false</energyStarPartner></organization></account>').format(ACCOUNT_ID)
+
+    def property_list(self):
+        links = "".join('<link id="{0}" hint={1} link="/property/{0}" linkDescription="This is the GET url for this Property."/>'
+                        .format(self.pm_id(p), quoteattr("Property {0}".format(p))) for p in range(self.properties))
+        return '<?xml version="1.0" encoding="UTF-8" standalone="yes"?><response status="Ok"><links>{0}</links></response>'.format(links)
+
+    def association(self, pm_id):
+        p = pm_id - 100000
+        ids = "".join("<meterId>{0}</meterId>".format(self.meter_id(p, m)) for m in range(self.meters))
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><meterPropertyAssociationList>'
+                '<energyMeterAssociation><meters>{0}</meters><propertyRepresentation><propertyRepresentationType>'
+                'Whole Property</propertyRepresentationType></propertyRepresentation></energyMeterAssociation>'
+                '</meterPropertyAssociationList>').format(ids)
+
+    def meter(self, meter_id):
+        meter_type = self.meter_type(meter_id)
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><meter><id>{0}</id><type>{1}</type>'
+                '<name>Meter {0}</name><metered>{2}</metered><unitOfMeasure>{3}</unitOfMeasure>'
+                '<firstBillDate>{4}</firstBillDate><inUse>true</inUse><accessLevel>Read</accessLevel></meter>'
+                ).format(meter_id, meter_type, "false" if meter_type in DELIVERY_TYPES else "true",
+                         UNITS[meter_type], self.dates[0].replace(day=1))
+
+    def consumption(self, meter_id, page, start_date):
+        entries = [(i, d) for i, d in enumerate(self.dates) if start_date is None or d >= start_date]
+        pages = max(1, (len(entries) + self.page_size - 1) // self.page_size)
+        delivery = self.meter_type(meter_id) in DELIVERY_TYPES
+        body = []
+        for i, d in entries[(page - 1) * self.page_size:page * self.page_size]:
+            usage, cost = self.usage(meter_id, i), round(self.usage(meter_id, i) * 0.12, 2)
+            if delivery:
+                body.append("<meterDelivery><id>{0}</id><deliveryDate>{1}</deliveryDate><quantity>{2}</quantity>"
+                            "<cost>{3}</cost></meterDelivery>".format(meter_id * 1000 + i, d, usage, cost))
+            else:
+                body.append("<meterConsumption><id>{0}</id><startDate>{1}</startDate><endDate>{2}</endDate>"
+                            "<usage>{3}</usage><cost>{4}</cost></meterConsumption>"
+                            .format(meter_id * 1000 + i, d.replace(day=1), d, usage, cost))
+        links = ""
+        if page < pages:
+            link = "/meter/{0}/consumptionData?page={1}{2}".format(
+                meter_id, page + 1, "&startDate={0}".format(start_date) if start_date else "")
+            links = '<link httpMethod="GET" link={0} linkDescription="next page"/>'.format(quoteattr(link))
+        return '<?xml version="1.0" encoding="UTF-8" standalone="yes"?><meterData>{0}<links>{1}</links></meterData>'.format(
+            "".join(body), links)
+
+    def metrics(self, pm_id, year, month, names):
+        values = []
+        for name in names:
+            seed = zlib.crc32("{0}|{1}|{2}|{3}".format(pm_id, year, month, name).encode("utf-8"))
+            value = round(random.Random(seed).uniform(1, 500), 2)
+            values.append('<metric name={0} uom="Unitless" dataType="numeric"><value>{1}</value></metric>'.format(
+                quoteattr(name), value))
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><propertyMetrics year="{0}" month="{1}" '
+                'propertyId="{2}">{3}</propertyMetrics>').format(year, month, pm_id, "".join(values))
+
+    def building(self, pm_id):
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><building><name>Property {0}</name>'
+                '<address address1="1 Main St" city="Silver Spring" state="MD" postalCode="20910" country="US"/>'
+                '<constructionStatus>Existing</constructionStatus><primaryFunction>Office</primaryFunction>'
+                '<yearBuilt>1990</yearBuilt><grossFloorArea units="Square Feet" temporary="false"><value>48000</value>'
+                '</grossFloorArea><occupancyPercentage>90</occupancyPercentage><isFederalProperty>true</isFederalProperty>'
+                '</building>').format(pm_id - 100000)
+
+    # Socrata documents
+
+    def table_of_contents_csv(self):
+        lines = ['"PM ID","Property ID","Property Name","Category"']
+        for p in range(self.properties):
+            lines.append('"{0}","{1}","Property {2}","{3}"'.format(self.pm_id(p), self.property_id(p), p,
+                                                                   "N" if p % 25 == 24 else "Y"))
+        return "\n".join(lines) + "\n"
+
+    def sites_csv(self):
+        lines = ['"Property ID","Property Name","Property Type","Address","City","State","Zip","Bureau","Area"']
+        states = ["MD", "CO", "WA", "HI", "FL"]
+        for p in range(self.properties):
+            lines.append('"{0}","Site {1}","Office","{1} Main St","Town","{2}","{3:05d}","NWS","{4}"'.format(
+                self.property_id(p), p, states[p % len(states)], 20000 + p, 1000 + 37 * p))
+        return "\n".join(lines) + "\n"
+
+    def _handler(self):
+        pm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="application/xml", headers=None, endpoint=None,
+                      received=0):
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                if endpoint:
+                    # Count before responding, so a client that has its response sees it counted
+                    pm._count(endpoint, len(body), received)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                return len(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                path = url.path
+                pm._delay()
+                if path.startswith("/api/views/") and path.endswith(".json"):
+                    # View metadata, used to see whether the rows changed
+                    dataset = path.split("/")[3][:-len(".json")]
+                    view = {"id":dataset, "rowsUpdatedAt":pm.rows_updated_at,
+                            "columns":[{"id":1, "name":"Property ID", "fieldName":"property_id"},
+                                       {"id":2, "name":"PM ID", "fieldName":"pm_id"}]}
+                    if pm.row_identifier:
+                        view["rowIdentifierColumnId"] = 1 if pm.row_identifier == "Property ID" else 2
+                    body = json.dumps(view)
+                    self._send(200, body, "application/json", endpoint="socrata_view")
+                    return
+                if path.startswith("/api/views/"):
+                    dataset = path.split("/")[3]
+                    body = pm.table_of_contents_csv() if dataset == TOC_DATASET else pm.sites_csv()
+                    etag = '"{0:08x}"'.format(zlib.crc32(body.encode("utf-8")))
+                    if self.headers.get("If-None-Match") == etag:
+                        self._send(304, headers={"ETag":etag}, endpoint="socrata_csv_not_modified")
+                        return
+                    self._send(200, body, "text/csv", headers={"ETag":etag}, endpoint="socrata_csv")
+                    return
+                if not path.startswith("/ws/"):
+                    self._send(404, "<error/>")
+                    return
+                path = path[3:]
+                if pm._inject_error():
+                    headers = {"Retry-After":str(pm.retry_after)} if pm.error_status in (429, 503) else {}
+                    self._send(pm.error_status, "<error/>", headers=headers, endpoint="error")
+                    return
+                routes = [
+                    (r"^/account$", "account", lambda m: pm.account()),
+                    (r"^/account/\d+/property/list$", "property_list", lambda m: pm.property_list()),
+                    (r"^/association/property/(\d+)/meter$", "association", lambda m: pm.association(int(m.group(1)))),
+                    (r"^/meter/(\d+)/consumptionData$", "consumption", lambda m: pm.consumption(
+                        int(m.group(1)), int(query.get("page", ["1"])[0]), _date(query.get("startDate", [None])[0]))),
+                    (r"^/meter/(\d+)$", "meter", lambda m: pm.meter(int(m.group(1)))),
+                    (r"^/property/(\d+)/metrics$", "metrics", lambda m: pm.metrics(
+                        int(m.group(1)), int(query["year"][0]), int(query["month"][0]),
+                        [n.strip() for n in self.headers.get("PM-Metrics", "").split(",") if n.strip()])),
+                    (r"^/building/(\d+)$", "building", lambda m: pm.building(int(m.group(1)))),
+                ]
+                for pattern, endpoint, build in routes:
+                    match = re.match(pattern, path)
+                    if match:
+                        body = build(match)
+                        etag = '"{0:08x}"'.format(zlib.crc32(body.encode("utf-8")))
+                        if self.headers.get("If-None-Match") == etag:
+                            self._send(304, headers={"ETag":etag}, endpoint=endpoint + "_not_modified")
+                            return
+                        self._send(200, body, headers={"ETag":etag}, endpoint=endpoint)
+                        return
+                self._send(404, "<error/>", endpoint="not_found")
+
+            def do_POST(self):
+                self._upsert(replace=False)
+
+            def do_PUT(self):
+                self._upsert(replace=True)
+
+            def _upsert(self, replace):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                pm._delay()
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                rows = json.loads(body.decode("utf-8"))
+                with pm._lock:
+                    pm.stats["rows_received"] += len(rows)
+                    pm.stats["upserts"] += 1
+                    pm.stats["replaces"] += replace
+                result = json.dumps({"Errors":0, "Rows Deleted":0, "Rows Updated":0, "Rows Created":len(rows)})
+                self._send(200, result, "application/json", endpoint="socrata_upsert", received=len(body))
+
+        return Handler
+
+
+def _date(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock Portfolio Manager and Socrata server")
+    parser.add_argument("--properties", type=int, default=10)
+    parser.add_argument("--meters", type=int, default=3)
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--page-size", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    pm = MockPortfolioManager(args.properties, args.meters, args.months, args.page_size, latency=args.latency,
+                              error_rate=args.error_rate, port=args.port)
+    print(json.dumps(pm.settings(), indent=2))
+    pm.server.serve_forever()
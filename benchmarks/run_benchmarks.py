@@ -0,0 +1,110 @@
+"""
+End-to-end throughput benchmarks against the local mock server.
+
+Measures requests/sec, rows/sec, peak memory and wall time for
+EnergyStarClient at several worker counts and for a full run of
+NOAA_EnergyStar.py, with no credentials or network access needed.
+
+    python benchmarks/run_benchmarks.py --properties 50 --latency 0.02 --workers 1 4 16
+    python benchmarks/run_benchmarks.py --json results.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from EnergyStarAPI import EnergyStarClient, ConcurrentFetcher
+from mockpm import MockPortfolioManager
+
+
+def bench_client(pm, workers, months_back):
+    """ Meter discovery and consumption for every property with a fresh client """
+    client = EnergyStarClient("bench", "bench", workers=workers, max_per_host=workers, domain=pm.energystar_domain,
+                              backoff=0.05)
+    fetcher = ConcurrentFetcher(workers)
+    pm.reset_stats()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    pm_ids = [pm.pm_id(p) for p in range(pm.properties)]
+    meters = [m for meter_list in fetcher.map(client.get_meter_list, pm_ids) for m in meter_list]
+    since = pm.dates[-months_back] if months_back else pm.dates[0]
+    rows = sum(len(frame) for frame in fetcher.map(
+        lambda meter: client.get_consumption_frame(meter[0], since.year, since.month, 1, meter_type=meter[1]), meters))
+
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stats = client.transport.stats.snapshot()
+    return {"benchmark":"client", "workers":workers, "wall_seconds":round(wall, 3),
+            "requests":stats["requests"], "requests_per_second":round(stats["requests"] / wall, 1),
+            "rows":rows, "rows_per_second":round(rows / wall, 1), "retries":stats["retries"],
+            "throttled":stats["throttled"], "peak_python_mb":round(peak / 1e6, 1)}
+
+
+def bench_pipeline(pm, workers):
+    """ Run NOAA_EnergyStar.py in a subprocess pointed at the mock server """
+    workdir = tempfile.mkdtemp(prefix="noaa-bench-")
+    with open(os.path.join(workdir, ".settings.json"), "w") as f:
+        json.dump(pm.settings(Workers=workers, MaxRequestsPerHost=workers), f)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    pm.reset_stats()
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, os.path.join(ROOT, "NOAA_EnergyStar.py")], cwd=workdir, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = child.stderr.read()
+    child.stderr.close()
+    # Reap the child ourselves for its own rusage; RUSAGE_CHILDREN would be the largest child so far
+    _, status, usage = os.wait4(child.pid, 0)
+    child.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    if child.returncode != 0:
+        raise RuntimeError("NOAA_EnergyStar.py failed:\n" + stderr.decode("utf-8", "replace")[-2000:])
+    # ru_maxrss is in kilobytes on Linux
+    peak = usage.ru_maxrss / 1e3
+    return {"benchmark":"pipeline", "workers":workers, "wall_seconds":round(wall, 3),
+            "requests":pm.stats["requests"], "requests_per_second":round(pm.stats["requests"] / wall, 1),
+            "rows":pm.stats["rows_received"], "rows_per_second":round(pm.stats["rows_received"] / wall, 1),
+            "upserts":pm.stats["upserts"], "peak_rss_mb":round(peak, 1)}
+
+
+def print_table(results):
+    columns = ["benchmark", "workers", "wall_seconds", "requests", "requests_per_second", "rows", "rows_per_second"]
+    print("  ".join("{0:>19}".format(c) for c in columns + ["peak memory MB"]))
+    for r in results:
+        peak = r.get("peak_python_mb", r.get("peak_rss_mb"))
+        print("  ".join("{0:>19}".format(r[c]) for c in columns) + "  {0:>19}".format(peak))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--properties", type=int, default=25)
+    parser.add_argument("--meters", type=int, default=3)
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--page-size", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--months-back", type=int, default=3, help="months of consumption each client run pulls, 0 for all")
+    parser.add_argument("--skip-pipeline", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with MockPortfolioManager(args.properties, args.meters, args.months, args.page_size, latency=args.latency,
+                              error_rate=args.error_rate) as pm:
+        for workers in args.workers:
+            results.append(bench_client(pm, workers, args.months_back))
+        if not args.skip_pipeline:
+            for workers in args.workers:
+                results.append(bench_pipeline(pm, workers))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,61 @@
+#####
+#
+# Shared fixtures: the mock Portfolio Manager/Socrata server and script runs against it
+#
+#####
+import json
+import os
+import subprocess
+import sys
+import pytest
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from mockpm import MockPortfolioManager
+
+
+@pytest.fixture
+def pm():
+    """ A small portfolio served on a free local port """
+    with MockPortfolioManager(properties=6, meters=2, months=24, page_size=6, seed=3) as server:
+        yield server
+
+
+@pytest.fixture
+def run_script(tmp_path):
+    """
+    Run a script (NOAA_EnergyStar.py by default) in a working directory
+    holding the given settings
+
+    Returns:
+        Function : run(settings, *args, workdir=tmp_path, script=...)
+            returning the CompletedProcess, failing the test if the script fails
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+
+    def run(settings, *args, workdir=tmp_path, script="NOAA_EnergyStar.py"):
+        workdir.mkdir(parents=True, exist_ok=True)
+        with open(os.path.join(str(workdir), ".settings.json"), "w") as f:
+            json.dump(settings, f)
+        result = subprocess.run([sys.executable, os.path.join(ROOT, script)] + list(args),
+                                cwd=str(workdir), env=env, capture_output=True, text=True, timeout=300)
+        assert result.returncode == 0, result.stderr[-3000:]
+        return result
+    return run
+
+
+@pytest.fixture
+def file_settings(pm):
+    """
+    Settings for the mock server that write the sync to OutputFile instead of Socrata
+
+    Returns:
+        Function : file_settings(**overrides) returning the settings dictionary
+    """
+    def settings(**overrides):
+        values = pm.settings(Workers=4, RunReport=None, OutputFile="output.csv", Metrics={}, ReferenceCache=None,
+                             TimeSeriesStore=None, SyncState=None, Checkpoint=None)
+        values["Socrata_Username"] = None
+        values.update(overrides)
+        return values
+    return settings
@@ -0,0 +1,124 @@
+import datetime
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from mockpm import MockPortfolioManager
+from EnergyStarAPI import ConsumptionColumns, EnergyStarClient, SQLiteCache, metrics_final, month_range
+
+
+def make_client(pm, **kwargs):
+    kwargs.setdefault("workers", 4)
+    kwargs.setdefault("backoff", 0.01)
+    return EnergyStarClient("bench", "bench", domain=pm.energystar_domain, **kwargs)
+
+
+def test_meter_list_reads_each_meter_once(pm):
+    client = make_client(pm)
+    pm_id = pm.pm_id(1)
+    expected = [(pm.meter_id(1, m), pm.meter_type(pm.meter_id(1, m))) for m in range(pm.meters)]
+    assert client.get_meter_list(pm_id) == expected
+    assert client.get_meter_list(pm_id) == expected
+    assert pm.stats["endpoints"]["meter"] == pm.meters
+    assert client.get_meter_type(pm.meter_id(1, 0)) == expected[0][1]
+    assert pm.stats["endpoints"]["meter"] == pm.meters
+
+
+def test_meter_cache_is_kept_between_clients(pm, tmp_path):
+    path = str(tmp_path / "meters.db")
+    make_client(pm, meter_cache=SQLiteCache(path)).get_meter_list(pm.pm_id(0))
+    pm.reset_stats()
+    meters = make_client(pm, meter_cache=SQLiteCache(path)).get_meters([pm.meter_id(0, 0), pm.meter_id(2, 1)])
+    # Only the meter missing from the cache is requested
+    assert pm.stats["endpoints"]["meter"] == 1
+    assert meters[pm.meter_id(0, 0)]["unitOfMeasure"] is not None
+    assert sorted(meters) == [pm.meter_id(0, 0), pm.meter_id(2, 1)]
+
+
+def test_final_complete_months_are_served_from_the_metric_cache(pm):
+    client = make_client(pm, metric_lag_months=2)
+    pm_ids = [pm.pm_id(0), pm.pm_id(1)]
+    months = month_range(2025, 1)
+    first = client.get_metrics(pm_ids, ["score", "totalGHGEmissions"], 2025, 1)
+    assert [(row["PM ID"], row["K"]) for row in first] == [
+        (p, "{0}-{1:02d}".format(y, m)) for p in pm_ids for (y, m) in months]
+    assert pm.stats["endpoints"]["metrics"] == len(first)
+
+    pm.reset_stats()
+    assert client.get_metrics(pm_ids, ["score", "totalGHGEmissions"], 2025, 1) == first
+    # The last metric_lag_months months are not final yet
+    assert pm.stats["endpoints"]["metrics"] == 2 * 2
+
+
+def test_months_with_missing_values_are_not_cached():
+    today = datetime.datetime.now()
+    final = today.year * 12 + today.month - 1 - 2
+    assert metrics_final(2020, 1, final, {"score":"50"})
+    assert not metrics_final(2020, 1, final, {"score":"50", "totalGHGEmissions":None})
+    assert not metrics_final(today.year, today.month, final, {"score":"50"})
+
+
+def test_metric_cache_ttl_expires_final_months(pm, monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    client = make_client(pm, metric_cache=SQLiteCache(ttl=60))
+    client.get_metrics([pm.pm_id(0)], ["score"], 2025, 1)
+    now[0] += 61
+    pm.reset_stats()
+    client.get_metrics([pm.pm_id(0)], ["score"], 2025, 1)
+    assert pm.stats["endpoints"]["metrics"] == len(month_range(2025, 1))
+
+
+def test_consumption_is_streamed_across_pages(pm):
+    client = make_client(pm)
+    meter_id = pm.meter_id(0, 0)
+    records = list(client.iter_consumption(meter_id, 2000, 1, 1))
+    assert len(records) == pm.months
+    assert pm.stats["endpoints"]["consumption"] == pm.months // pm.page_size
+    assert [r["DATE"] for r in records] == [d.strftime("%Y-%m-%d") for d in pm.dates]
+    assert list(client.iter_consumption(meter_id, 2000, 1, 1, prefetch=False)) == records
+    assert client.get_usage_and_cost(meter_id, 2000, 1, 1) == [
+        {"DATE":r["DATE"], "USAGE":r["USAGE"], "COST":r["COST"]} for r in records]
+
+
+def test_closing_the_stream_stops_paging(pm):
+    client = make_client(pm)
+    records = client.iter_consumption(pm.meter_id(0, 0), 2000, 1, 1, prefetch=False)
+    next(records)
+    records.close()
+    assert pm.stats["endpoints"]["consumption"] == 1
+
+
+def test_failed_cost_read_is_logged_and_raised(pm, caplog):
+    client = make_client(pm, max_retries=0)
+    pm.error_rate, pm.error_status = 1, 404
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get_cost_data(pm.meter_id(0, 0), 2000, 1, 1)
+    assert "Could not read cost for meter {0}: 404".format(pm.meter_id(0, 0)) in caplog.text
+    assert client.instrumentation.report()["calls"]["get_cost_data"]["errors"] == 1
+
+
+def test_consumption_frame_matches_the_records():
+    with MockPortfolioManager(properties=1, meters=4, months=15, page_size=4) as pm:
+        client = make_client(pm)
+        for m in range(pm.meters):
+            meter_id = pm.meter_id(0, m)
+            meter_type = pm.meter_type(meter_id)
+            frame = client.get_consumption_frame(meter_id, 2000, 1, 1, meter_type=meter_type)
+            records = pd.DataFrame(list(client.iter_consumption(meter_id, 2000, 1, 1)))
+            assert str(frame["DATE"].dtype) == "datetime64[ns]"
+            assert frame["USAGE"].dtype == np.float64 and frame["COST"].dtype == np.float64
+            assert all(isinstance(frame[c].dtype, pd.CategoricalDtype) for c in ("METER ID", "METER TYPE", "SOURCE"))
+            assert frame["DATE"].dt.strftime("%Y-%m-%d").tolist() == records["DATE"].tolist()
+            assert frame["USAGE"].tolist() == records["USAGE"].tolist()
+            assert frame["COST"].tolist() == records["COST"].tolist()
+            assert frame["SOURCE"].astype(str).tolist() == records["SOURCE"].tolist()
+            assert set(frame["METER ID"]) == {meter_id} and set(frame["METER TYPE"]) == {meter_type}
+        assert set(frame["SOURCE"]) == {"meterDelivery"}
+
+
+def test_empty_columns_build_an_empty_frame():
+    frame = ConsumptionColumns().to_frame(500000, "Natural Gas")
+    assert len(frame) == 0
+    assert list(frame.columns) == ["DATE", "USAGE", "COST", "METER ID", "METER TYPE", "SOURCE"]
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import aiohttp
+import pytest
+from EnergyStarAPI import EnergyStarClient, AsyncEnergyStarClient, MetricJobs, SQLiteCache
+from EnergyStarAPI.transport import retry_delay
+
+
+def async_client(pm, **kwargs):
+    return AsyncEnergyStarClient("bench", "bench", domain=pm.energystar_domain, max_per_host=4, backoff=0.01,
+                                 **kwargs)
+
+
+def test_sync_and_async_clients_agree(pm):
+    pm.error_rate = 0.05
+    client = EnergyStarClient("bench", "bench", domain=pm.energystar_domain, workers=4, max_per_host=4, backoff=0.01)
+    pm_ids = [pm.pm_id(p) for p in range(pm.properties)]
+    expected = {pm_id:{meter_id:client.get_usage_and_cost(meter_id, 2015, 1, 1)
+                       for meter_id, _ in client.get_meter_list(pm_id)} for pm_id in pm_ids}
+    meter_id = pm.meter_id(0, 0)
+
+    async def compare():
+        async with async_client(pm) as other:
+            usage = await other.gather_usage_and_cost(pm_ids, 2015, 1, 1)
+            assert {pm_id:dict(meters) for pm_id, meters in usage.items()} == expected
+            assert await other.get_account_info() == client.get_account_info()
+            assert await other.get_propery_list(1) == client.get_propery_list(1)
+            assert await other.get_meter_type(meter_id) == client.get_meter_type(meter_id)
+            assert await other.get_cost_data(meter_id, 2015, 1, 1) == client.get_cost_data(meter_id, 2015, 1, 1)
+            frames = await other.gather_consumption_frames([(meter_id, "Natural Gas")], 2015, 1, 1)
+            assert frames[0].equals(client.get_consumption_frame(meter_id, 2015, 1, 1, meter_type="Natural Gas"))
+    asyncio.run(compare())
+
+
+def test_clients_share_the_metric_cache(pm):
+    cache = SQLiteCache()
+    client = EnergyStarClient("bench", "bench", domain=pm.energystar_domain, workers=4, backoff=0.01,
+                              metric_cache=cache)
+    pm_ids = [pm.pm_id(0), pm.pm_id(1)]
+    expected = client.get_metrics(pm_ids, ["score", "totalGHGEmissions"], 2025, 1)
+    pm.reset_stats()
+
+    async def fetch():
+        async with async_client(pm, metric_cache=cache) as other:
+            return await other.get_metrics(pm_ids, ["score", "totalGHGEmissions"], 2025, 1)
+    assert asyncio.run(fetch()) == expected
+    # Only the months that are not final yet are requested again
+    assert pm.stats["endpoints"]["metrics"] == 2 * 2
+
+
+def test_metric_jobs_cache_only_final_complete_months():
+    jobs = MetricJobs([7], ["score", "site"], 2020, 1, 2)
+    assert jobs.jobs[0] == (7, 2020, 1)
+    assert jobs.keys(jobs.jobs[0]) == ["7|2020-01|score", "7|2020-01|site"]
+    assert jobs.to_cache((7, 2020, 1), {"score":"50", "site":"1.5"}) == {"7|2020-01|score":"50", "7|2020-01|site":"1.5"}
+    assert jobs.to_cache((7, 2020, 1), {"score":"50", "site":None}) == {}
+    assert jobs.to_cache(jobs.jobs[-1], {"score":"50", "site":"1.5"}) == {}
+    assert jobs.cached((7, 2020, 1), {"7|2020-01|score":"50"}) is None
+    assert jobs.rows([jobs.failed()])[0] == {"PM ID":7, "K":"2020-01", "score":None, "site":None}
+
+
+def test_async_cost_read_failure_is_logged_and_raised(pm, caplog):
+    pm.error_rate, pm.error_status = 1.0, 404
+
+    async def read():
+        async with async_client(pm) as other:
+            await other.get_cost_data(pm.meter_id(0, 0), 2015, 1, 1)
+    with caplog.at_level(logging.ERROR), pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(read())
+    assert "Could not read cost for meter" in caplog.text
+
+
+def test_retry_delay_prefers_retry_after_and_caps_backoff():
+    class Response(object):
+        headers = {"Retry-After":"120"}
+    assert retry_delay(0, Response(), 0.5, 60) == 60
+    assert all(0 <= retry_delay(3, None, 0.5, 60) <= 4 for _ in range(100))
+    assert all(retry_delay(20, None, 0.5, 60) <= 60 for _ in range(100))
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+from NOAAPipeline import AggregateCube
+
+
+def rows(values):
+    """ Transformed rows for one property and meter type, {date: (usage, cost)} """
+    return pd.DataFrame([{"ROWID":date + "500000", "PM ID":"100000", "PROPERTY":"Site", "PROPERTY ID":"P1",
+                          "State":"MD", "METER TYPE":"Natural Gas", "FY":date[:4], "Fiscal Period":date[5:7],
+                          "TOTAL USAGE":usage, "TOTAL COST":cost} for date, (usage, cost) in values.items()])
+
+
+def test_rows_seen_again_replace_their_values(tmp_path):
+    cube = AggregateCube(str(tmp_path / "cube.db"), ["PROPERTY", "State"])
+    cube.update(rows({"2024-01-31":(10.0, 1.0), "2024-02-29":(20.0, 2.0), "2025-01-31":(5.0, 0.5)}))
+    # A revised bill and a repeat of an unchanged one
+    cube.update(rows({"2024-02-29":(25.0, 2.5), "2024-01-31":(10.0, 1.0)}))
+    by_fy = cube.rollup(["FY"])
+    assert by_fy["FY"].tolist() == ["2024", "2025"]
+    assert by_fy["USAGE"].tolist() == [35.0, 5.0]
+    assert by_fy["COST"].tolist() == [3.5, 0.5]
+    assert by_fy["ROWS"].tolist() == [2, 1]
+
+
+def test_rollup_by_attribute_and_filter(tmp_path):
+    cube = AggregateCube(str(tmp_path / "cube.db"), ["PROPERTY", "State"])
+    cube.update(rows({"2024-01-31":(10.0, 1.0), "2025-01-31":(5.0, 0.5)}))
+    assert cube.rollup(["State"], where={"FY":"2025"}).to_dict("records") == [
+        {"State":"MD", "USAGE":5.0, "COST":0.5, "ROWS":1}]
+    total = cube.rollup([])
+    assert total["USAGE"].tolist() == [15.0]
+    with pytest.raises(KeyError):
+        cube.rollup(["Bureau"])
+
+
+def test_script_keeps_the_cube_in_step_with_the_output(pm, run_script, file_settings, tmp_path):
+    settings = file_settings(AggregateCube="aggregates.db", CubeAttributes=["PROPERTY", "State"])
+    run_script(settings, "--since", "2024-01")
+    # A second run re-syncs the same months, which must not add to the totals
+    run_script(settings, "--since", "2024-01")
+    output = pd.read_csv(str(tmp_path / "output.csv"), dtype={"FY":str})
+    cube = AggregateCube(str(tmp_path / "aggregates.db"), ["PROPERTY", "State"])
+    by_fy = cube.rollup(["FY"]).set_index("FY")
+    expected = output.groupby("FY")[["TOTAL USAGE", "TOTAL COST"]].sum()
+    assert by_fy["ROWS"].sum() == len(output)
+    assert by_fy["USAGE"].round(2).to_dict() == expected["TOTAL USAGE"].round(2).to_dict()
+    assert by_fy["COST"].round(2).to_dict() == expected["TOTAL COST"].round(2).to_dict()
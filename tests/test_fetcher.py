@@ -0,0 +1,91 @@
+import gc
+import threading
+import pytest
+import requests
+from EnergyStarAPI import ConcurrentFetcher, HostLimitedAdapter
+
+
+def test_map_keeps_order_on_one_pool():
+    fetcher = ConcurrentFetcher(4)
+    names = set()
+
+    def work(x):
+        names.add(threading.current_thread().name)
+        return x * x
+    assert list(fetcher.map(work, range(50))) == [x * x for x in range(50)]
+    pool = fetcher._pool
+    assert list(fetcher.map(work, range(5))) == [0, 1, 4, 9, 16]
+    assert fetcher._pool is pool
+    assert all(name.startswith("fetcher") for name in names)
+    fetcher.close()
+    assert fetcher._pool is None
+
+
+def test_nested_map_runs_inline():
+    fetcher = ConcurrentFetcher(2, window=2)
+    # With the pool's two threads waiting on inner maps, these would deadlock if submitted
+    assert list(fetcher.map(lambda x: sum(fetcher.map(lambda y: y, range(x))), range(6))) == [0, 0, 1, 3, 6, 10]
+    fetcher.close()
+
+
+def test_errors_are_raised_at_their_result():
+    def work(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+    results = ConcurrentFetcher(4).map(work, range(6))
+    assert [next(results) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def host_limited_session(pm, max_per_host):
+    session = requests.Session()
+    adapter = HostLimitedAdapter(max_per_host=max_per_host)
+    session.mount("http://", adapter)
+    session.auth = ("bench", "bench")
+    return session, adapter
+
+
+def free_slots(adapter):
+    return [slot._value for slot in adapter._host_slots.values()]
+
+
+def test_streamed_response_holds_its_slot_until_read(pm):
+    session, adapter = host_limited_session(pm, 2)
+    url = "{0}/meter/{1}/consumptionData".format(pm.energystar_domain, pm.meter_id(0, 0))
+    response = session.get(url, stream=True)
+    assert free_slots(adapter) == [1]
+    response.content
+    assert free_slots(adapter) == [2]
+
+    response = session.get(url, stream=True)
+    response.close()
+    assert free_slots(adapter) == [2]
+
+    # Dropped without being read or closed
+    session.get(url, stream=True)
+    gc.collect()
+    assert free_slots(adapter) == [2]
+
+
+def test_slots_cap_concurrent_requests(pm, monkeypatch):
+    pm.latency = 0.05
+    session, adapter = host_limited_session(pm, 2)
+    in_flight, peak, lock = [0], [0], threading.Lock()
+    send = requests.adapters.HTTPAdapter.send
+
+    def counting(self, request, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            return send(self, request, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", counting)
+    url = "{0}/meter/{1}".format(pm.energystar_domain, pm.meter_id(0, 0))
+    assert all(r.status_code == 200 for r in ConcurrentFetcher(6).map(lambda _: session.get(url), range(12)))
+    assert peak[0] == 2
+    assert free_slots(adapter) == [2]
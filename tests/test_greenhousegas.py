@@ -0,0 +1,28 @@
+import pandas as pd
+from EnergyStarAPI import month_range
+
+
+def ghg_settings(pm, **overrides):
+    settings = pm.settings(Workers=4, RunReport=None, ReferenceCache=None, MetricsOutputFile="metrics.csv",
+                           Metrics={"GHG":"totalGHGEmissions", "SCORE":"score"})
+    settings.update(overrides)
+    return settings
+
+
+def test_metrics_are_written_to_the_file_without_a_dataset(pm, run_script, tmp_path):
+    result = run_script(ghg_settings(pm, MetricsDataset=None), script="NOAA_GreenHouseGas.py")
+    metrics = pd.read_csv(str(tmp_path / "metrics.csv"), dtype=object)
+    months = len(month_range(2015, 1))
+    assert len(metrics) == pm.properties * months
+    assert {"GHG", "SCORE", "PM ID", "ROWID"} <= set(metrics.columns)
+    assert metrics["ROWID"].is_unique
+    assert pm.stats["upserts"] == 0
+    assert "Wrote {0} row(s) of GHG, SCORE with CSVSink".format(len(metrics)) in result.stderr
+
+
+def test_metrics_are_upserted_like_the_sync(pm, run_script, tmp_path):
+    run_script(ghg_settings(pm, MetricsDataset="ghgm-1234", ChunkSize=100), script="NOAA_GreenHouseGas.py")
+    rows = pm.properties * len(month_range(2015, 1))
+    assert pm.stats["rows_received"] == rows
+    assert pm.stats["upserts"] == -(-rows // 100)
+    assert not (tmp_path / "metrics.csv").exists()
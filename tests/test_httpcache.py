@@ -0,0 +1,85 @@
+import os
+import time
+import requests
+from EnergyStarAPI import ResponseCache, Transport
+
+
+def transport_for(cache):
+    session = requests.Session()
+    session.auth = ("bench", "bench")
+    return Transport(session, cache=cache, backoff=0.01)
+
+
+def meter_url(pm, p=0, m=0):
+    return "{0}/meter/{1}".format(pm.energystar_domain, pm.meter_id(p, m))
+
+
+def test_fresh_entries_are_served_from_disk(pm, tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    transport = transport_for(cache)
+    first = transport.get(meter_url(pm))
+    assert transport.get(meter_url(pm)).content == first.content
+    assert pm.stats["endpoints"]["meter"] == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    # The PM-Metrics header is part of the key
+    assert cache.lookup(meter_url(pm), {"PM-Metrics":"score"}) is None
+
+
+def test_stale_entries_are_revalidated(pm, tmp_path):
+    cache = ResponseCache(str(tmp_path), ttls=[(r"/meter/", 0)])
+    transport = transport_for(cache)
+    body = transport.get(meter_url(pm)).content
+    assert transport.get(meter_url(pm)).content == body
+    assert pm.stats["endpoints"]["meter"] == 1 and pm.stats["endpoints"]["meter_not_modified"] == 1
+    assert cache.revalidated == 1 and transport.stats.snapshot()["cache_revalidated"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(pm, tmp_path):
+    size = len(requests.get(meter_url(pm), auth=("bench", "bench")).content)
+    cache = ResponseCache(str(tmp_path), max_bytes=int(size * 2.5))
+    transport = transport_for(cache)
+    for m in range(2):
+        transport.get(meter_url(pm, 0, m))
+        time.sleep(0.01)
+    transport.get(meter_url(pm, 0, 0))
+    time.sleep(0.01)
+    transport.get(meter_url(pm, 1, 0))
+    assert cache.lookup(meter_url(pm, 0, 1)) is None
+    assert cache.lookup(meter_url(pm, 0, 0)) is not None
+    assert cache.lookup(meter_url(pm, 1, 0)) is not None
+    assert len([f for f in os.listdir(str(tmp_path)) if f.endswith(".body")]) == 2
+
+
+def test_a_body_larger_than_the_cache_is_returned_not_kept(pm, tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10)
+    transport = transport_for(cache)
+    response = transport.get(meter_url(pm))
+    assert response.status_code == 200 and b"<meter>" in response.content
+    assert cache.lookup(meter_url(pm)) is None
+
+
+def test_a_body_evicted_while_revalidating_is_fetched_again(pm, tmp_path):
+    cache = ResponseCache(str(tmp_path), ttls=[(r"/meter/", 0)])
+    transport = transport_for(cache)
+    body = transport.get(meter_url(pm)).content
+    entry = cache.lookup(meter_url(pm))
+    refresh = cache.refresh
+
+    def evicted_first(entry, url):
+        os.remove(entry.path)
+        return refresh(entry, url)
+    cache.refresh = evicted_first
+    assert transport.get(meter_url(pm)).content == body
+    assert pm.stats["endpoints"]["meter"] == 2
+    cache.refresh = refresh
+    assert entry.key in [f[:-len(".body")] for f in os.listdir(str(tmp_path))]
+
+
+def test_a_fresh_entry_keeps_its_body_once_looked_up(pm, tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    transport_for(cache).get(meter_url(pm))
+    entry = cache.lookup(meter_url(pm))
+    os.remove(entry.path)
+    assert b"<meter>" in cache.response(entry, meter_url(pm)).content
+    # Gone from disk: a miss, not an error
+    assert cache.lookup(meter_url(pm)) is None
@@ -0,0 +1,89 @@
+import io
+import json
+import threading
+from EnergyStarAPI import EnergyStarClient
+from EnergyStarAPI.instrumentation import Histogram, Instrumentation, MeteredReader, endpoint
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+
+
+def test_endpoint_groups_ids():
+    assert endpoint("https://pm/ws/meter/123/consumptionData?page=2", "https://pm/ws") == "/meter/{id}/consumptionData"
+    assert endpoint("https://pm/ws/property/9/metrics?year=2020", "https://pm/ws") == "/property/{id}/metrics"
+    assert endpoint("https://pm/ws", "https://pm/ws") == "/"
+
+
+def test_histogram_percentiles_are_bucket_bounds():
+    histogram = Histogram()
+    for value in [0.001] * 50 + [0.2] * 40 + [3.0] * 10:
+        histogram.add(value)
+    assert histogram.count == 100 and histogram.minimum == 0.001 and histogram.maximum == 3.0
+    assert histogram.percentile(50) == 0.005
+    assert histogram.percentile(90) == 0.25
+    assert histogram.percentile(99) == 3.0
+    assert Histogram().percentile(50) is None
+
+
+def test_counters_add_up_across_threads():
+    instrumentation = Instrumentation("https://pm")
+    call = instrumentation.begin("get_consumption_data", meter_id=1)
+
+    def work():
+        for _ in range(500):
+            instrumentation.request("https://pm/meter/1/consumptionData", FakeResponse(200, b"abcd"), 0.01, call)
+            instrumentation.received("https://pm/meter/1/consumptionData", call, 2, 0.001)
+            instrumentation.parsed(call, 0.001)
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    instrumentation.end(call)
+
+    assert call.pages == 4000 and call.bytes == 4000 * 6
+    report = instrumentation.report()
+    assert report["calls"]["get_consumption_data"]["pages"] == 4000
+    assert report["endpoints"]["/meter/{id}/consumptionData"]["requests"] == 4000
+    assert report["endpoints"]["/meter/{id}/consumptionData"]["bytes"] == 4000 * 6
+    assert report["endpoints"]["/meter/{id}/consumptionData"]["latency"]["count"] == 4000
+
+
+def test_metered_reader_counts_bytes():
+    instrumentation = Instrumentation()
+    with instrumentation.call("stream") as call:
+        reader = MeteredReader(io.BytesIO(b"x" * 1000), instrumentation, call, "/meter/1")
+        while reader.read(64):
+            pass
+    assert call.bytes == 1000
+    assert instrumentation.report()["endpoints"]["/meter/{id}"]["bytes"] == 1000
+
+
+def test_hooks_see_errors_and_a_failing_hook_is_logged():
+    instrumentation = Instrumentation()
+    seen = []
+    instrumentation.add_hook(seen.append)
+    instrumentation.add_hook(lambda call: 1 / 0)
+    try:
+        with instrumentation.call("get_meter", meter_id=5):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert seen[0].error == "ValueError" and seen[0].args == {"meter_id":5}
+    assert instrumentation.report()["calls"]["get_meter"]["errors"] == 1
+
+
+def test_client_calls_are_reported(pm, tmp_path):
+    client = EnergyStarClient("bench", "bench", domain=pm.energystar_domain, workers=2, backoff=0.01)
+    client.get_consumption_frame(pm.meter_id(0, 0), pm.dates[0].year, pm.dates[0].month, 1)
+    path = client.instrumentation.write_report(str(tmp_path / "reports" / "run.json"),
+                                               transport=client.transport.stats.snapshot())
+    with open(path) as f:
+        report = json.load(f)
+    call = report["calls"]["get_consumption_frame"]
+    assert call["calls"] == 1 and call["pages"] == 4 and call["bytes"] > 0 and call["parse_seconds"] > 0
+    assert report["endpoints"]["/meter/{id}/consumptionData"]["statuses"] == {"200":4}
+    assert report["transport"]["requests"] == 4
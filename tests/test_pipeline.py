@@ -0,0 +1,95 @@
+import threading
+import time
+import pandas as pd
+import pytest
+from NOAAPipeline import MemoryBudget, Stage, merge_outputs
+
+
+def test_budget_blocks_producers_until_released():
+    budget = MemoryBudget(100)
+    budget.acquire(60)
+    acquired = threading.Event()
+
+    def producer():
+        budget.acquire(60)
+        acquired.set()
+    thread = threading.Thread(target=producer)
+    thread.start()
+    assert not acquired.wait(0.1)
+    budget.release(60)
+    assert acquired.wait(1)
+    thread.join()
+    assert budget.snapshot() == {"max_bytes":100, "used":60, "peak":60, "waits":1, "oversize":0}
+
+
+def test_charged_rows_hold_back_producers_and_oversize_items_pass_alone():
+    budget = MemoryBudget(100)
+    budget.charge(150)
+    assert budget.used == 150 and budget.peak == 150
+    budget.release(150)
+    budget.acquire(500)
+    assert budget.snapshot()["oversize"] == 1
+
+
+def test_stage_bounds_what_it_reads_ahead():
+    produced = []
+
+    def items():
+        for i in range(100):
+            produced.append(i)
+            yield i
+    stage = Stage(items(), maxsize=4)
+    consumed = iter(stage)
+    assert next(consumed) == 0
+    time.sleep(0.1)
+    # The queue, the item being offered and the one handed out
+    assert len(produced) <= 4 + 2
+    assert list(consumed) == list(range(1, 100))
+    assert stage.high_water <= 4
+
+
+def test_stage_raises_producer_errors_in_the_consumer():
+    def items():
+        yield 1
+        raise ValueError("boom")
+    with pytest.raises(ValueError):
+        list(Stage(items(), maxsize=2))
+
+
+def write_csv(path, rows):
+    pd.DataFrame(rows).to_csv(str(path), index=False)
+
+
+def test_merge_keeps_the_last_row_of_each_key_across_chunks(tmp_path):
+    write_csv(tmp_path / "a.csv", [{"ROWID":str(i), "USAGE":"a{0}".format(i)} for i in range(10)])
+    write_csv(tmp_path / "b.csv", [{"ROWID":str(i), "USAGE":"b{0}".format(i), "GHG":"1"} for i in range(5, 15)]
+              + [{"ROWID":"7", "USAGE":"again", "GHG":"2"}])
+    rows = merge_outputs([str(tmp_path / "a.csv"), str(tmp_path / "b.csv")], str(tmp_path / "merged.csv"), chunk_size=3)
+    merged = pd.read_csv(str(tmp_path / "merged.csv"), dtype=object, keep_default_na=False)
+    assert rows == len(merged) == 15
+    assert list(merged.columns) == ["ROWID", "USAGE", "GHG"]
+    values = merged.set_index("ROWID")["USAGE"]
+    assert values["0"] == "a0" and values["5"] == "b5" and values["7"] == "again" and values["14"] == "b14"
+    assert merged.set_index("ROWID")["GHG"]["0"] == "0"
+    assert not (tmp_path / "merged.merging.csv").exists()
+
+
+def test_merge_into_one_of_its_inputs(tmp_path):
+    write_csv(tmp_path / "output.csv", [{"ROWID":str(i), "USAGE":"old"} for i in range(6)])
+    write_csv(tmp_path / "resumed.csv", [{"ROWID":str(i), "USAGE":"new"} for i in range(4, 8)])
+    merge_outputs([str(tmp_path / "output.csv"), str(tmp_path / "resumed.csv")], str(tmp_path / "output.csv"),
+                  chunk_size=2)
+    merged = pd.read_csv(str(tmp_path / "output.csv"), dtype=object)
+    assert merged["ROWID"].tolist() == [str(i) for i in range(8)]
+    assert merged["USAGE"].tolist() == ["old"] * 4 + ["new"] * 4
+
+
+def test_merge_parquet_and_empty_inputs(tmp_path):
+    pytest.importorskip("pyarrow")
+    pd.DataFrame({"ROWID":["1", "2"], "USAGE":[1.0, 2.0]}).to_parquet(str(tmp_path / "a.parquet"))
+    pd.DataFrame({"ROWID":["2", "3"], "USAGE":[20.0, 3.0]}).to_parquet(str(tmp_path / "b.parquet"))
+    open(str(tmp_path / "empty.csv"), "w").close()
+    rows = merge_outputs([str(tmp_path / "a.parquet"), str(tmp_path / "empty.csv"), str(tmp_path / "b.parquet")],
+                         str(tmp_path / "merged.parquet"))
+    merged = pd.read_parquet(str(tmp_path / "merged.parquet"))
+    assert rows == 3 and merged.set_index("ROWID")["USAGE"].to_dict() == {"1":1.0, "2":20.0, "3":3.0}
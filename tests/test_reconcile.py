@@ -0,0 +1,52 @@
+import pandas as pd
+from NOAAPipeline import Reconciler, deletions, row_identifier, view_metadata_url
+
+SITES = pd.DataFrame({"Property ID":["P1", "P2", "P3"], "City":["Town", "Bay", "Hill"], "Zip":[20910, 80301, 98101]})
+
+
+def test_first_run_adds_every_row(tmp_path):
+    reconciler = Reconciler(str(tmp_path / "state.db"))
+    assert reconciler.snapshot("rpmd").empty
+    delta = reconciler.diff("rpmd", SITES, "Property ID")
+    assert delta.summary() == {"added":3, "changed":0, "removed":0, "duplicates":0, "conflicts":0, "unchanged":0}
+    assert delta.upserts()["Property ID"].tolist() == ["P1", "P2", "P3"]
+
+
+def test_diff_against_the_snapshot(tmp_path):
+    reconciler = Reconciler(str(tmp_path / "state.db"))
+    reconciler.commit("rpmd", reconciler.diff("rpmd", SITES, "Property ID"))
+    assert len(reconciler.diff("rpmd", SITES, "Property ID")) == 0
+
+    # Zip read as text hashes the same as the number
+    current = SITES.assign(Zip=SITES["Zip"].astype(str))
+    current.loc[1, "City"] = "Cove"
+    current = pd.concat([current[current["Property ID"] != "P3"],
+                         pd.DataFrame({"Property ID":["P4"], "City":["Dale"], "Zip":["30301"]})], ignore_index=True)
+    delta = reconciler.diff("rpmd", current, "Property ID")
+    assert delta.added["Property ID"].tolist() == ["P4"]
+    assert delta.changed["Property ID"].tolist() == ["P2"]
+    assert delta.removed == ["P3"]
+    assert delta.unchanged == 1
+    assert deletions(delta.removed, "Property ID").to_dict("records") == [{"Property ID":"P3", ":deleted":True}]
+
+    reconciler.commit("rpmd", delta)
+    assert sorted(reconciler.snapshot("rpmd").index) == ["P1", "P2", "P4"]
+    assert len(reconciler.diff("rpmd", current, "Property ID")) == 0
+
+
+def test_duplicates_and_conflicts(tmp_path):
+    reconciler = Reconciler(str(tmp_path / "state.db"))
+    reconciler.commit("rpmd", reconciler.diff("rpmd", SITES, "Property ID"))
+    current = pd.concat([SITES, SITES.iloc[[0]], SITES.iloc[[2]].assign(City="Elsewhere")], ignore_index=True)
+    delta = reconciler.diff("rpmd", current, "Property ID")
+    assert len(delta.duplicates) == 1
+    assert delta.conflicts["Property ID"].tolist() == ["P3", "P3"]
+    # A conflicting key is neither upserted nor deleted
+    assert len(delta) == 0 and delta.removed == []
+
+
+def test_row_identifier(pm):
+    url = view_metadata_url(pm.socrata_domain, "8wgy-ye8p")
+    assert row_identifier(url) == "Property ID"
+    pm.row_identifier = None
+    assert row_identifier(url) is None
@@ -0,0 +1,65 @@
+import datetime
+import xml.etree.ElementTree as Et
+import pytest
+from EnergyStarAPI import (Account, Building, Consumption, Delivery, EnergyStarClient, Meter, check_schemas,
+                           consumption_entry, meter_metadata)
+
+
+def test_records_match_the_schemas():
+    assert check_schemas() == []
+
+
+def test_account_fields_are_typed(pm):
+    account = Account.parse(pm.account())
+    assert account.id == int(pm.account().split("<id>")[1].split("<")[0])
+    assert account.username == "bench"
+    assert account.webserviceUser is True and account.searchable is False
+    assert account.includeTestPropertiesInGraphics is None
+    assert account.contact.firstName == "Bench" and account.contact.address is None
+    assert account.organization["organization"]["@name"] == "NOAA"
+    assert account.raw()["account"]["username"]["$"] == "bench"
+
+
+def test_building_fields_and_subtrees(pm):
+    building = Building.parse(pm.building(pm.pm_id(2)))
+    assert building.name == "Property 2"
+    assert (building.grossFloorArea, building.grossFloorAreaUnits) == (48000, "Square Feet")
+    assert building.yearBuilt == 1990 and building.occupancyPercentage == 90
+    assert building.isFederalProperty is True and building.notes is None
+    assert (building.address.city, building.address.state, building.address.postalCode) == (
+        "Silver Spring", "MD", "20910")
+    with pytest.raises(AttributeError):
+        building.color = "blue"
+
+
+def test_meter_from_xml_and_from_cached_metadata(pm):
+    meter_id = pm.meter_id(0, 3 % pm.meters)
+    meter = Meter.parse(pm.meter(meter_id))
+    assert meter.id == meter_id and meter.type == pm.meter_type(meter_id)
+    assert isinstance(meter.firstBillDate, datetime.date) and meter.inUse is True and meter.inactiveDate is None
+    assert Meter.from_metadata(meter_metadata(pm.meter(meter_id))) == meter
+
+
+def test_consumption_entries_become_consumption_or_delivery():
+    consumption = consumption_entry(Et.fromstring(
+        '<meterConsumption estimatedValue="true"><id>7</id><startDate>2020-01-01</startDate>'
+        '<endDate>2020-01-31</endDate><usage>12.5</usage><cost>3</cost></meterConsumption>'))
+    assert isinstance(consumption, Consumption)
+    assert consumption.to_dict() == {"id":7, "startDate":datetime.date(2020, 1, 1),
+                                     "endDate":datetime.date(2020, 1, 31), "usage":12.5, "cost":3.0,
+                                     "estimatedValue":True}
+    delivery = consumption_entry(Et.fromstring(
+        '<meterDelivery><id>8</id><deliveryDate>2020-02-15</deliveryDate><quantity>40</quantity></meterDelivery>'))
+    assert isinstance(delivery, Delivery)
+    assert (delivery.deliveryDate, delivery.quantity, delivery.cost) == (datetime.date(2020, 2, 15), 40.0, None)
+    # Entries drop their elements once parsed
+    with pytest.raises(ValueError):
+        delivery.raw()
+
+
+def test_client_returns_records_or_raw_dicts(pm):
+    client = EnergyStarClient("bench", "bench", domain=pm.energystar_domain, backoff=0.01)
+    assert client.get_account_info() == Account.parse(pm.account())
+    assert client.get_building_info(pm.pm_id(0)).name == "Property 0"
+    raw = EnergyStarClient("bench", "bench", domain=pm.energystar_domain, backoff=0.01, raw_dicts=True)
+    assert raw.get_account_info()["account"]["id"]["$"] == client.get_account_info().id
@@ -0,0 +1,74 @@
+import json
+import os
+import pandas as pd
+from mockpm import TOC_DATASET
+from NOAAPipeline import ReferenceCache, load_reference, view_metadata_url
+
+
+def toc_urls(pm):
+    url = "{0}/api/views/{1}/rows.csv?accessType=DOWNLOAD".format(pm.socrata_domain, TOC_DATASET)
+    return url, view_metadata_url(pm.socrata_domain, TOC_DATASET)
+
+
+def test_snapshot_is_reused_until_rows_change(pm, tmp_path):
+    url, view = toc_urls(pm)
+    cache = ReferenceCache(str(tmp_path))
+    first = cache.load("toc", url, view, index="PM ID")
+    assert first.index.name == "PM ID" and first["PM ID"].tolist() == [str(pm.pm_id(p)) for p in range(pm.properties)]
+
+    pm.reset_stats()
+    again = cache.load("toc", url, view, index="PM ID")
+    pd.testing.assert_frame_equal(again, first)
+    assert (cache.downloads, cache.hits) == (1, 1)
+    assert pm.stats["endpoints"] == {"socrata_view":1}
+
+    pm.rows_updated_at += 1
+    cache.load("toc", url, view)
+    assert cache.downloads == 2 and pm.stats["endpoints"]["socrata_csv"] == 1
+
+
+def test_without_view_metadata_a_conditional_get_is_used(pm, tmp_path):
+    url, _ = toc_urls(pm)
+    cache = ReferenceCache(str(tmp_path))
+    cache.load("toc", url)
+    pm.reset_stats()
+    cache.load("toc", url)
+    assert pm.stats["endpoints"] == {"socrata_csv_not_modified":1}
+    assert cache.hits == 1
+
+
+def test_young_snapshots_are_not_checked(pm, tmp_path):
+    url, view = toc_urls(pm)
+    cache = ReferenceCache(str(tmp_path), max_age=3600)
+    cache.load("toc", url, view)
+    pm.reset_stats()
+    pm.rows_updated_at += 1
+    cache.load("toc", url, view)
+    assert pm.stats["requests"] == 0 and cache.downloads == 1
+
+
+def test_snapshot_is_used_when_the_check_fails(pm, tmp_path):
+    url, view = toc_urls(pm)
+    ReferenceCache(str(tmp_path)).load("toc", url, view)
+    with open(str(tmp_path / "toc.json")) as f:
+        meta = json.load(f)
+    cache = ReferenceCache(str(tmp_path))
+    frame = cache.load("toc", url, "http://127.0.0.1:1/api/views/gone.json")
+    assert len(frame) == meta["rows"] and cache.hits == 1
+
+
+def test_ids_keep_their_type_and_other_datasets_dont_share_a_snapshot(pm, tmp_path):
+    url, view = toc_urls(pm)
+    cache = ReferenceCache(str(tmp_path))
+    frame = cache.load("toc", url, view)
+    assert frame["PM ID"].map(type).eq(str).all()
+    cache.load("toc", url.replace(TOC_DATASET, "other"), None)
+    assert cache.downloads == 2
+    assert sorted(os.listdir(str(tmp_path))) == ["toc.feather", "toc.json"]
+
+
+def test_load_reference_without_a_cache_downloads(pm):
+    url, _ = toc_urls(pm)
+    frame = load_reference(None, "toc", url, index="PM ID")
+    assert frame.index.name == "PM ID" and pm.stats["endpoints"]["socrata_csv"] == 1
+
@@ -0,0 +1,85 @@
+import sqlite3
+import pandas as pd
+import pytest
+from NOAAPipeline import Checkpoint
+from NOAAPipeline.runs import in_shard, parse_shard, shard_of, shard_path
+
+
+def test_shards_split_properties_stably():
+    assert parse_shard("1/4") == (1, 4)
+    for text in ("4/4", "-1/2", "a/b", "1"):
+        with pytest.raises(ValueError):
+            parse_shard(text)
+    assert shard_path("output.csv", (0, 4)) == "output.shard-0-of-4.csv"
+    assert shard_path("output.csv", None) == "output.csv"
+    pm_ids = [str(100000 + i) for i in range(200)]
+    assert all(sum(in_shard(p, (i, 3)) for i in range(3)) == 1 for p in pm_ids)
+    assert all(in_shard(p, None) for p in pm_ids)
+    assert shard_of(" 100000 ", 3) == shard_of("100000", 3)
+
+
+def test_record_and_resume(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.db"))
+    run_id = checkpoint.begin(None)
+    checkpoint.record({"100000":[(500000, 12), (500001, 12)]})
+    assert checkpoint.resume((0, 2)) == (False, None)
+
+    resumed = Checkpoint(str(tmp_path / "checkpoint.db"))
+    assert resumed.resume(None) == (True, None)
+    assert resumed.run_id == run_id
+    assert resumed.done_properties() == {"100000"}
+    assert resumed.done_meters() == {500000, 500001}
+    resumed.finish()
+    assert Checkpoint(str(tmp_path / "checkpoint.db")).resume(None) == (False, None)
+
+
+def test_failed_meters_leave_the_property_unfinished(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.db"))
+    checkpoint.begin(None)
+    checkpoint.fail("100000", 500001, "404")
+    checkpoint.record({"100000":[(500000, 12)]}, unfinished={"100000"})
+    assert checkpoint.done_properties() == set()
+    assert checkpoint.done_meters() == {500000}
+    assert checkpoint.failures() == [("100000", 500001, "404")]
+
+    # The retry finishes the property and clears the failure
+    checkpoint.record({"100000":[(500001, 10)]})
+    assert checkpoint.done_properties() == {"100000"}
+    assert checkpoint.failures() == []
+    meters, entries = checkpoint._conn.execute("SELECT meters, entries FROM properties").fetchone()
+    assert (meters, entries) == (2, 22)
+
+
+def test_script_resumes_failed_reads(pm, run_script, file_settings, tmp_path):
+    settings = file_settings(MaxRetries=0, Checkpoint="checkpoint.db", CheckpointEvery=2)
+    pm.error_rate, pm.error_status = 0.3, 404
+    run_script(settings, "--since", "2024-01", workdir=tmp_path / "run")
+    conn = sqlite3.connect(str(tmp_path / "run" / "checkpoint.db"))
+    assert conn.execute("SELECT finished FROM runs").fetchall() == [(None,)]
+    assert conn.execute("SELECT COUNT(*) FROM failures").fetchone()[0] > 0
+
+    pm.error_rate = 0
+    run_script(settings, "--resume", workdir=tmp_path / "run")
+    assert conn.execute("SELECT finished IS NOT NULL FROM runs").fetchall() == [(1,)]
+    assert conn.execute("SELECT COUNT(*) FROM failures").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM properties").fetchone()[0] == pm.properties
+
+    (tmp_path / "run" / "output.csv").rename(tmp_path / "run" / "resumed.csv")
+    run_script(settings, "--merge", "merged.csv", "resumed.csv", workdir=tmp_path / "run")
+    run_script(settings, "--since", "2024-01", workdir=tmp_path / "clean")
+    merged = pd.read_csv(str(tmp_path / "run" / "merged.csv"), dtype=object)
+    clean = pd.read_csv(str(tmp_path / "clean" / "output.csv"), dtype=object)
+    assert len(merged) == len(clean)
+    assert set(merged["ROWID"]) == set(clean["ROWID"])
+
+
+def test_sharded_runs_merge_to_a_full_run(pm, run_script, file_settings, tmp_path):
+    settings = file_settings()
+    for shard in ("0/2", "1/2"):
+        run_script(settings, "--since", "2024-01", "--shard", shard, workdir=tmp_path / "run")
+    run_script(settings, "--merge", "merged.csv", "output.shard-0-of-2.csv", "output.shard-1-of-2.csv",
+               workdir=tmp_path / "run")
+    run_script(settings, "--since", "2024-01", workdir=tmp_path / "clean")
+    merged = pd.read_csv(str(tmp_path / "run" / "merged.csv"), dtype=object)
+    clean = pd.read_csv(str(tmp_path / "clean" / "output.csv"), dtype=object)
+    assert sorted(merged["ROWID"]) == sorted(clean["ROWID"])
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from NOAAPipeline import CSVSink, ParquetSink, Sink, SocrataSink
+from NOAAPipeline.runs import read_output
+
+
+class ListSink(Sink):
+    def __init__(self, chunk_size):
+        super(ListSink, self).__init__(chunk_size)
+        self.chunks = []
+
+    def _write_chunk(self, chunk):
+        self.chunks.append(chunk["n"].tolist())
+
+
+def frame(start, stop, **columns):
+    data = {"n":list(range(start, stop))}
+    data.update((k, [v] * (stop - start)) for k, v in columns.items())
+    return pd.DataFrame(data)
+
+
+def test_rows_are_rechunked_across_writes():
+    sink = ListSink(4)
+    with sink:
+        for start in range(0, 10, 3):
+            sink.write(frame(start, min(start + 3, 10)))
+        sink.write(frame(0, 0))
+    assert sink.chunks == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert (sink.rows_written, sink.chunks_written) == (10, 3)
+
+
+def test_socrata_chunks_are_gzipped_upserts(pm):
+    with SocrataSink(pm.socrata_domain + "/resource/8vm3-6zrm.json", ("bench", "bench"), chunk_size=4) as sink:
+        sink.write(frame(0, 10, METER="x"))
+    assert (sink.rows_written, sink.chunks_written) == (10, 3)
+    assert pm.stats["upserts"] == 3 and pm.stats["replaces"] == 0 and pm.stats["rows_received"] == 10
+    assert [r["Rows Created"] for r in sink.results] == [4, 4, 2]
+
+
+def test_socrata_replace_puts_the_first_chunk(pm):
+    with SocrataSink(pm.socrata_domain + "/resource/8wgy-ye8p.json", ("bench", "bench"), chunk_size=4,
+                     replace=True, compress=False) as sink:
+        sink.write(frame(0, 6))
+    assert pm.stats["upserts"] == 2 and pm.stats["replaces"] == 1
+
+
+def test_csv_widens_its_header(tmp_path):
+    path = str(tmp_path / "out.csv")
+    with CSVSink(path, chunk_size=2) as sink:
+        sink.write(frame(0, 2, A="a"))
+        sink.write(frame(2, 4, B="b"))
+    out = read_output(path)
+    assert list(out.columns) == ["n", "A", "B"]
+    assert out["A"].tolist() == ["a", "a", "0", "0"] and out["B"].tolist() == ["0", "0", "b", "b"]
+
+
+@pytest.mark.parametrize("name", ["out.csv", "out.parquet"])
+def test_file_is_replaced_or_appended(tmp_path, name):
+    path = str(tmp_path / name)
+    sink_class = ParquetSink if name.endswith(".parquet") else CSVSink
+    with sink_class(path, chunk_size=2) as sink:
+        sink.write(frame(0, 3))
+    with sink_class(path, chunk_size=2, append=True) as sink:
+        sink.write(frame(3, 5))
+    assert read_output(path)["n"].astype(int).tolist() == [0, 1, 2, 3, 4]
+    with sink_class(path, chunk_size=2) as sink:
+        sink.write(frame(7, 8))
+    assert read_output(path)["n"].astype(int).tolist() == [7]
+
+
+@pytest.mark.parametrize("name", ["out.csv", "out.parquet"])
+def test_run_without_rows_empties_the_file(tmp_path, name):
+    path = str(tmp_path / name)
+    sink_class = ParquetSink if name.endswith(".parquet") else CSVSink
+    with sink_class(path) as sink:
+        sink.write(frame(0, 3))
+    with sink_class(path, append=True):
+        pass
+    assert len(read_output(path)) == 3
+    with sink_class(path) as sink:
+        sink.write(frame(0, 0))
+    assert len(read_output(path)) == 0
@@ -0,0 +1,45 @@
+import pandas as pd
+from NOAAPipeline import SyncState, row_id
+
+USAGE = [{"DATE":"2024-01-31", "USAGE":10.0, "COST":1.0},
+         {"DATE":"2024-02-29", "USAGE":20.0, "COST":2.0},
+         {"DATE":"2024-03-31", "USAGE":30.0, "COST":3.0}]
+
+
+def test_everything_is_new_before_a_commit(tmp_path):
+    state = SyncState(str(tmp_path / "state.db"))
+    assert state.changed(500000, USAGE) == USAGE
+    assert state.high_water(500000) is None
+
+
+def test_commit_keeps_only_new_and_changed_months(tmp_path):
+    state = SyncState(str(tmp_path / "state.db"))
+    state.commit(500000, USAGE)
+    assert state.changed(500000, USAGE) == []
+    revised = [dict(USAGE[1], COST=2.5)]
+    added = [{"DATE":"2024-04-30", "USAGE":40.0, "COST":4.0}]
+    assert state.changed(500000, USAGE + revised + added) == [USAGE[1]] + revised + added
+    # Another meter's months are its own
+    assert state.changed(500001, USAGE) == USAGE
+
+
+def test_high_water_and_start(tmp_path):
+    state = SyncState(str(tmp_path / "state.db"))
+    state.commit(500000, USAGE)
+    assert state.high_water(500000) == "2024-03-31"
+    assert state.start_for(500000, None).strftime("%Y-%m-%d") == "2024-03-01"
+    # Committing an older month doesn't move the mark back
+    state.commit(500000, USAGE[:1])
+    assert state.high_water(500000) == "2024-03-31"
+
+
+def test_frames_and_records_hash_the_same(tmp_path):
+    state = SyncState(str(tmp_path / "state.db"))
+    state.commit(500000, USAGE)
+    frame = pd.DataFrame(USAGE)
+    frame["DATE"] = pd.to_datetime(frame["DATE"])
+    frame.loc[2, "USAGE"] = 31.0
+    changed = state.changed(500000, frame)
+    assert isinstance(changed, pd.DataFrame)
+    assert changed["USAGE"].tolist() == [31.0]
+    assert row_id("2024-03-31", 500000) == "2024-03-31500000"
@@ -0,0 +1,33 @@
+import time
+from EnergyStarAPI import SQLiteCache
+
+
+def test_values_round_trip(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), table="meters")
+    cache.set_many({1:{"type":"Natural Gas"}, "2":[1, 2]})
+    assert cache.get_many([1, 2, 3]) == {"1":{"type":"Natural Gas"}, "2":[1, 2]}
+    assert cache.get(3, "missing") == "missing"
+    cache.delete(1)
+    assert SQLiteCache(str(tmp_path / "cache.db"), table="meters").get_many([1, 2]) == {"2":[1, 2]}
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = SQLiteCache(ttl=60)
+    cache.set("default", 1)
+    cache.set("short", 2, ttl=10)
+    cache.set("long", 3, ttl=3600)
+    now[0] += 30
+    assert cache.get_many(["default", "short", "long"]) == {"default":1, "long":3}
+    now[0] += 31
+    assert cache.get_many(["default", "long"]) == {"long":3}
+    cache.purge()
+    assert cache._conn.execute("SELECT key FROM cache").fetchall() == [("long",)]
+
+
+def test_without_ttl_nothing_expires(monkeypatch):
+    cache = SQLiteCache()
+    cache.set("key", "value")
+    monkeypatch.setattr(time, "time", lambda: 1e12)
+    assert cache.get("key") == "value"
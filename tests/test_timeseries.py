@@ -0,0 +1,75 @@
+import pandas as pd
+from bench_transform import synthetic, vectorized
+from NOAAPipeline import TimeSeriesStore
+
+
+def rows(properties=4, meters=2, months=14):
+    batches, sites = synthetic(properties=properties, meters=meters, months=months)
+    return vectorized(batches, sites).drop_duplicates("ROWID", keep="last").reset_index(drop=True)
+
+
+def test_upsert_partitions_by_fy_and_meter_type(tmp_path):
+    full = rows()
+    store = TimeSeriesStore(str(tmp_path))
+    assert store.upsert(full) == len(full)
+    expected = sorted(set(zip(full["FY"].astype(str), full["METER TYPE"])))
+    assert store.partitions() == expected
+    stored = store.read()
+    assert len(stored) == len(full) and set(stored["ROWID"]) == set(full["ROWID"])
+    assert stored["USAGE"].sum() == full["TOTAL USAGE"].astype(float).sum()
+
+
+def test_upsert_replaces_rows_on_rowid(tmp_path):
+    full = rows()
+    store = TimeSeriesStore(str(tmp_path))
+    store.upsert(full)
+    changed = full.iloc[:5].copy()
+    changed["TOTAL USAGE"] = 1.0e6
+    store.upsert(changed)
+    stored = store.read(columns=["ROWID", "USAGE"]).set_index("ROWID")["USAGE"]
+    assert len(stored) == len(full)
+    assert (stored[changed["ROWID"]] == 1.0e6).all()
+
+
+def test_a_meter_whose_type_changed_moves_partition(tmp_path):
+    full = rows()
+    store = TimeSeriesStore(str(tmp_path))
+    store.upsert(full)
+    moved = full[full["METER ID"] == full["METER ID"].iloc[0]].copy()
+    moved["METER TYPE"] = "Fuel Oil (No. 2)"
+    store.upsert(moved)
+    stored = store.read()
+    assert len(stored) == len(full)
+    assert set(stored[stored["METER TYPE"] == "Fuel Oil (No. 2)"]["ROWID"]) == set(moved["ROWID"])
+
+
+def test_queries_read_only_what_they_ask_for(tmp_path):
+    full = rows()
+    store = TimeSeriesStore(str(tmp_path))
+    store.upsert(full)
+    fy, meter_type = store.partitions()[0]
+    part = store.read(columns=["ROWID", "USAGE"], fy=fy, meter_types=meter_type)
+    assert list(part.columns) == ["ROWID", "USAGE", "FY", "METER TYPE"]
+    assert len(part) == ((full["FY"].astype(str) == fy) & (full["METER TYPE"] == meter_type)).sum()
+    pm_id = full["PM ID"].iloc[0]
+    assert set(store.read(property_ids=[pm_id])["PM ID"]) == {pm_id}
+    assert len(store.read(fy="1999")) == 0
+
+
+def test_monthly_sums_usage_by_property_and_period(tmp_path):
+    full = rows()
+    store = TimeSeriesStore(str(tmp_path))
+    store.upsert(full)
+    fy = str(full["FY"].iloc[0])
+    monthly = store.monthly(fy)
+    in_fy = full[full["FY"].astype(str) == fy]
+    expected = in_fy.assign(USAGE=in_fy["TOTAL USAGE"].astype(float)).pivot_table(
+        index="PM ID", columns="Fiscal Period", values="USAGE", aggfunc="sum")
+    pd.testing.assert_frame_equal(monthly, expected, check_names=False, check_dtype=False)
+
+
+def test_script_keeps_synced_rows(pm, run_script, file_settings, tmp_path):
+    run_script(file_settings(TimeSeriesStore="timeseries"), "--since", "2024-01")
+    output = pd.read_csv(str(tmp_path / "output.csv"), dtype=object)
+    stored = TimeSeriesStore(str(tmp_path / "timeseries")).read(columns=["ROWID"])
+    assert set(stored["ROWID"]) == set(output["ROWID"])
@@ -0,0 +1,22 @@
+from bench_transform import synthetic, legacy, vectorized, check
+from NOAAPipeline import consumption_table, index_sites, transform
+
+
+def test_matches_per_meter_transform():
+    batches, sites = synthetic(properties=40, meters=3, months=6)
+    check(legacy(batches, sites), vectorized(batches, sites))
+
+
+def test_meters_without_usage_are_skipped():
+    batches, sites = synthetic(properties=3, meters=2, months=4)
+    row, meter, _ = batches[0]
+    batches[0] = (row, meter, [])
+    check(legacy(batches, sites), vectorized(batches, sites))
+
+
+def test_sites_listed_twice_repeat_their_rows():
+    batches, sites = synthetic(properties=5, meters=1, months=2)
+    full = transform(consumption_table(batches), index_sites(sites))
+    # synthetic() lists the first three sites twice
+    counts = full.groupby("PROPERTY ID").size()
+    assert (counts.iloc[:3] == 4).all() and (counts.iloc[3:] == 2).all()
@@ -0,0 +1,92 @@
+import email.utils
+import time
+import pytest
+import requests
+from EnergyStarAPI import AIMDLimiter, EnergyStarClient, TokenBucket, Transport
+from EnergyStarAPI.transport import _retry_after
+
+
+def test_token_bucket_paces_after_its_burst():
+    bucket = TokenBucket(50, burst=5)
+    started = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    # 5 from the burst, then 10 at 50 per second
+    assert 0.15 <= time.monotonic() - started < 1
+
+
+def test_aimd_halves_on_throttle_and_grows_to_its_ceiling():
+    limiter = AIMDLimiter(8, maximum=12)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 4
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 12
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.limit == 1
+
+
+def test_aimd_without_a_ceiling_only_recovers():
+    limiter = AIMDLimiter(4)
+    for _ in range(50):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 4
+    assert AIMDLimiter(4, maximum=2).maximum == 4
+
+
+def test_client_starts_at_its_initial_concurrency():
+    limiter = EnergyStarClient("u", "p", workers=8, max_per_host=6, concurrency=2).transport.limiter
+    assert (limiter.limit, limiter.maximum) == (2, 6)
+    limiter = EnergyStarClient("u", "p", workers=8, max_per_host=6).transport.limiter
+    assert (limiter.limit, limiter.maximum) == (6, 6)
+    assert EnergyStarClient("u", "p").transport.limiter is None
+
+
+def test_retry_after_seconds_and_dates():
+    class Response(object):
+        def __init__(self, value):
+            self.headers = {"Retry-After":value} if value is not None else {}
+    assert _retry_after(Response("2.5")) == 2.5
+    assert _retry_after(Response(None)) is None
+    assert _retry_after(Response("soon")) is None
+    later = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < _retry_after(Response(later)) <= 30
+
+
+def session_for(pm):
+    session = requests.Session()
+    session.auth = ("bench", "bench")
+    return session
+
+
+def test_throttled_requests_wait_retry_after_and_back_off(pm):
+    pm.error_rate, pm.error_status, pm.retry_after = 0.5, 429, 0.05
+    transport = Transport(session_for(pm), concurrency=4, max_retries=20, backoff=0.01)
+    url = "{0}/meter/{1}".format(pm.energystar_domain, pm.meter_id(0, 0))
+    assert all(transport.get(url).status_code == 200 for _ in range(10))
+    stats = transport.stats.snapshot()
+    assert stats["throttled"] == stats["retries"] == pm.stats["errors"] > 0
+    assert stats["retry_wait_seconds"] == pytest.approx(0.05 * stats["retries"])
+    assert stats["statuses"] == {200:10, 429:stats["retries"]}
+
+
+def test_gives_up_after_max_retries(pm):
+    pm.error_rate, pm.error_status = 1, 500
+    transport = Transport(session_for(pm), max_retries=2, backoff=0.01)
+    response = transport.get("{0}/meter/{1}".format(pm.energystar_domain, pm.meter_id(0, 0)))
+    assert response.status_code == 500
+    assert transport.stats.snapshot()["failures"] == 1
+    assert pm.stats["errors"] == 3
+
+
+def test_connection_errors_are_retried_then_raised():
+    transport = Transport(requests.Session(), max_retries=1, backoff=0.01, timeout=(0.5, 0.5))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.get("http://127.0.0.1:9/ws/account")
+    stats = transport.stats.snapshot()
+    assert (stats["connection_errors"], stats["retries"], stats["failures"]) == (2, 1, 1)